@@ -1,11 +1,15 @@
 from fastapi import APIRouter, UploadFile, File, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from sqlalchemy.orm import Session
 from datetime import timedelta
 from typing import List
 from .. import models, schemas, database
-from ..services import pdf_service, auth_service
+from ..services import (pdf_service, auth_service, ingest_service, search_service, llm_gateway, response_cache,
+                        semantic_cache, single_flight, intent_classifier, hybrid)
+import asyncio
 import os
+import json
 import jwt
 from typing import List
 
@@ -89,11 +93,15 @@ async def upload_pdf(file: UploadFile = File(...), db: Session = Depends(databas
         filename=file.filename,
         file_path=file_location,
         upload_date=datetime.utcnow(),
-        user_id=current_user.id
+        user_id=current_user.id,
+        ingest_status=ingest_service.STATUS_PENDING
     )
     db.add(db_document)
     db.commit()
     db.refresh(db_document)
+
+    # Extract and index in the background so the first question hits warm data
+    ingest_service.submit(db_document.id)
     
     return db_document
 
@@ -114,28 +122,133 @@ async def ask_question(
         
     # Use the latest edited file if available, otherwise use original
     current_file_path = document.edited_file_path if document.edited_file_path else document.file_path
-    pdf_text = await pdf_service.extract_text_from_pdf(current_file_path)
     
     # Use the process_user_input function instead of answer_question
-    # This will handle both questions and edit requests
-    result = await pdf_service.process_user_input(
-        question_request.question, 
-        pdf_text, 
-        current_file_path,
-        document,
-        db
-    )
+    # This will handle both questions and edit requests.
+    # No pdf_text: only the chunks relevant to the question are loaded
+    try:
+        result = await pdf_service.process_user_input(
+            question_request.question, 
+            None, 
+            current_file_path,
+            document,
+            db,
+            bypass_cache=question_request.bypass_cache
+        )
+    except llm_gateway.LLMTimeoutError as e:
+        raise HTTPException(status_code=504, detail=str(e))
+    except llm_gateway.LLMUnavailableError as e:
+        raise HTTPException(status_code=503, detail=str(e))
+
+    # An edit produced a new version; warm its caches before the next question
+    if result.get("is_edit"):
+        ingest_service.submit(document.id)
     
     # Return the full result (includes answer, is_edit flag, and editedPdfUrl if applicable)
     return result
 
 
+@router.post("/ask/stream")
+async def ask_question_stream(
+    question_request: schemas.QuestionRequest, 
+    db: Session = Depends(database.get_db),  
+    current_user: models.User = Depends(get_current_user)
+):
+    """
+    Streaming /ask over server-sent events: "token" events carry pieces of the
+    answer as the model generates them ({"text": ...}); a final "done" event carries
+    the same body /ask returns (answer, is_edit, editedPdfUrl). Failures end the
+    stream with an "error" event.
+    """
+    document = db.query(models.Document).filter(
+        models.Document.id == question_request.id,
+        models.Document.user_id == current_user.id
+    ).first()
+    
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+        
+    current_file_path = document.edited_file_path if document.edited_file_path else document.file_path
+    document_id = document.id
+
+    async def events():
+        # The request's session is closed before the body is streamed; edits are saved through a session of our own
+        stream_db = database.SessionLocal.session_factory()
+        try:
+            stream_document = stream_db.get(models.Document, document_id)
+            async for event, data in pdf_service.stream_user_input(
+                question_request.question,
+                current_file_path,
+                stream_document,
+                stream_db,
+                bypass_cache=question_request.bypass_cache
+            ):
+                if event == "token":
+                    data = {"text": data}
+                elif data.get("is_edit"):
+                    ingest_service.submit(document_id)
+                yield _sse_event(event, data)
+        except Exception as e:
+            print(f"Streaming answer failed for document {document_id}: {e}")
+            yield _sse_event("error", {"detail": str(e)})
+        finally:
+            stream_db.close()
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
+def _sse_event(event: str, data: dict) -> str:
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
 @router.get("/documents", response_model=List[schemas.DocumentResponse])
 async def get_documents(db: Session = Depends(database.get_db), current_user: models.User = Depends(get_current_user)):
     documents = db.query(models.Document).filter(models.Document.user_id == current_user.id).order_by(models.Document.upload_date.desc()).all()
     return documents
 
 
+@router.get("/search", response_model=List[schemas.SearchHit])
+async def search_documents(
+    q: str,
+    limit: int = 20,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    documents = db.query(models.Document).filter(models.Document.user_id == current_user.id).all()
+    
+    # Documents that were never ingested are not searchable yet; queue them. Failed
+    # ones stay failed until re-uploaded or edited, rather than retrying on every search
+    for document in documents:
+        if not document.content_hash and document.ingest_status != ingest_service.STATUS_FAILED:
+            ingest_service.ensure_queued(document.id)
+    
+    # Reconciling the index and cutting snippets read the text cache: keep it off the event loop
+    return await asyncio.to_thread(
+        search_service.search, current_user.id, documents, q, limit=min(max(limit, 1), 100)
+    )
+
+
+@router.get("/documents/{document_id}/status", response_model=schemas.DocumentStatus)
+async def get_document_status(
+    document_id: int,
+    db: Session = Depends(database.get_db),
+    current_user: models.User = Depends(get_current_user)
+):
+    document = db.query(models.Document).filter(
+        models.Document.id == document_id,
+        models.Document.user_id == current_user.id
+    ).first()
+    
+    if not document:
+        raise HTTPException(status_code=404, detail="Document not found")
+    
+    return document
+
+
 @router.post("/documents/{document_id}/messages", response_model=schemas.Message)
 async def add_message(
     document_id: int,
@@ -189,3 +302,17 @@ async def get_messages(
     
     return messages
 
+
+@router.get("/stats")
+async def get_stats(current_user: models.User = Depends(get_current_user)):
+    """Process-wide counters of the caches, the LLM gateway and the request routing, since startup."""
+    return {
+        "response_cache": dict(response_cache.stats),
+        "semantic_cache": dict(semantic_cache.stats),
+        "speculation": dict(pdf_service.speculation_stats),
+        "explicit_edits": dict(pdf_service.explicit_edit_stats),
+        "llm_gateway": dict(llm_gateway.stats),
+        "single_flight": dict(single_flight.stats),
+        "intent_classifier": dict(intent_classifier.stats),
+        "hybrid_retrieval": dict(hybrid.stats),
+    }
@@ -1,8 +1,10 @@
 from fastapi import FastAPI
 from app.api.routes import router
 from app.database import engine, Base
+from app.services import ingest_service, intent_classifier, llm_gateway, pdf_pool, prompt_builder, summary_service
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
+import asyncio
 import os
 
 app = FastAPI()
@@ -20,9 +22,18 @@ app.mount("/pdfs", StaticFiles(directory="pdfs"), name="pdfs")
 @app.on_event("startup")
 async def startup():
     Base.metadata.create_all(bind=engine)
+    pdf_pool.prewarm()
+    llm_gateway.start()
+    # tiktoken may fetch its encoding file; keep that off the event loop
+    await asyncio.to_thread(prompt_builder.load_encoding)
+    # Retrain the intent model on the chat history in the background
+    asyncio.get_running_loop().run_in_executor(None, intent_classifier.retrain_from_history)
 
 @app.on_event("shutdown")
 async def shutdown():
-    pass
+    ingest_service.shutdown()
+    summary_service.shutdown()
+    pdf_pool.shutdown()
+    await llm_gateway.stop()
 
 app.include_router(router)
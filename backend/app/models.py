@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, DateTime , Boolean, ForeignKey
+from sqlalchemy import Column, Integer, String, Text, DateTime , Boolean, ForeignKey
 from .database import Base
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
@@ -13,6 +13,18 @@ class Document(Base):
     edited_file_path = Column(String, nullable=True)  # Track latest edited version
     upload_date = Column(DateTime, default=datetime.utcnow)
     user_id = Column(Integer, ForeignKey("users.id"))
+
+    # Ingest pipeline state, filled in by ingest_service after upload/edit
+    ingest_status = Column(String, default="pending")
+    ingest_error = Column(String, nullable=True)
+    page_count = Column(Integer, nullable=True)
+    content_hash = Column(String, nullable=True)  # SHA-256 of the current version
+    ingested_at = Column(DateTime, nullable=True)
+
+    # Map-reduce summary of one version, filled in by summary_service after ingest
+    summary = Column(Text, nullable=True)
+    summary_hash = Column(String, nullable=True)  # content_hash the summary was made from
+    summarized_at = Column(DateTime, nullable=True)
     
     # Relationship
     user = relationship("User", back_populates="documents")
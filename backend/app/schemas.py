@@ -1,6 +1,6 @@
 from pydantic import BaseModel, ConfigDict
 from datetime import datetime
-from typing import List
+from typing import List, Optional
 
 class DocumentCreate(BaseModel):
     filename: str
@@ -9,6 +9,7 @@ class DocumentCreate(BaseModel):
 class QuestionRequest(BaseModel):
     question: str
     id: int
+    bypass_cache: bool = False
     
 class MessageBase(BaseModel):
     content: str
@@ -31,11 +32,31 @@ class DocumentResponse(BaseModel):
     filename: str
     file_path: str
     upload_date: datetime
+    ingest_status: Optional[str] = None
+    page_count: Optional[int] = None
     messages: List[Message] = []
     
     class Config:
         orm_mode = True
 
+class DocumentStatus(BaseModel):
+    id: int
+    ingest_status: Optional[str] = None
+    ingest_error: Optional[str] = None
+    page_count: Optional[int] = None
+    ingested_at: Optional[datetime] = None
+    summarized_at: Optional[datetime] = None
+
+    class Config:
+        orm_mode = True
+
+class SearchHit(BaseModel):
+    document_id: int
+    filename: str
+    page: int
+    score: float
+    snippet: str
+
 class UserCreate(BaseModel):
     name : str
     email : str
@@ -0,0 +1,192 @@
+"""
+BM25 lexical index over the page chunks of one document version.
+
+Exact keyword match is what contracts and forms need, and this runs entirely
+on CPU with no model downloads. Postings are stored CSR-style in flat arrays
+(term -> slice of chunk ids and term frequencies) and persisted per content
+digest next to the other caches.
+"""
+import heapq
+import json
+import math
+import os
+from array import array
+from collections import Counter, OrderedDict
+from pathlib import Path
+from threading import Lock, get_ident
+
+from .retrieval import Chunk, chunk_pages, tokenize
+
+BM25_CACHE_DIR = Path(os.getenv("BM25_CACHE_DIR", "cache/bm25"))
+BM25_MEMORY_SLOTS = int(os.getenv("BM25_MEMORY_SLOTS", "32"))
+BM25_K1 = float(os.getenv("BM25_K1", "1.2"))
+BM25_B = float(os.getenv("BM25_B", "0.75"))
+
+_FORMAT_VERSION = 1
+
+
+class BM25Index:
+    """
+    terms            term -> term id
+    term_offsets     postings of term t are [term_offsets[t], term_offsets[t + 1])
+    posting_chunks   chunk id of each posting
+    posting_freqs    term frequency of each posting
+    chunk_lengths    token count of each chunk
+    """
+    __slots__ = ("chunks", "total_chars", "terms", "term_offsets", "posting_chunks",
+                 "posting_freqs", "chunk_lengths", "avg_length")
+
+    def __init__(self, chunks, total_chars, terms, term_offsets, posting_chunks, posting_freqs, chunk_lengths):
+        self.chunks = chunks
+        self.total_chars = total_chars
+        self.terms = terms
+        self.term_offsets = term_offsets
+        self.posting_chunks = posting_chunks
+        self.posting_freqs = posting_freqs
+        self.chunk_lengths = chunk_lengths
+        self.avg_length = (sum(chunk_lengths) / len(chunk_lengths)) if chunk_lengths else 0.0
+
+    @classmethod
+    def build(cls, chunks: list, total_chars: int):
+        postings = {}
+        chunk_lengths = array("I")
+        for chunk_id, chunk in enumerate(chunks):
+            tokens = tokenize(chunk.text)
+            chunk_lengths.append(len(tokens))
+            for term, freq in Counter(tokens).items():
+                postings.setdefault(term, []).append((chunk_id, freq))
+
+        terms = {}
+        term_offsets = array("I", [0])
+        posting_chunks = array("I")
+        posting_freqs = array("H")
+        for term_id, (term, entries) in enumerate(postings.items()):
+            terms[term] = term_id
+            for chunk_id, freq in entries:
+                posting_chunks.append(chunk_id)
+                posting_freqs.append(min(freq, 0xFFFF))
+            term_offsets.append(len(posting_chunks))
+        return cls(chunks, total_chars, terms, term_offsets, posting_chunks, posting_freqs, chunk_lengths)
+
+    def search(self, query: str, k: int) -> list:
+        """Return [(chunk_id, score), ...] best first; chunks sharing no term with the query are never returned."""
+        chunk_count = len(self.chunks)
+        if not chunk_count:
+            return []
+        scores = {}
+        for term in set(tokenize(query)):
+            term_id = self.terms.get(term)
+            if term_id is None:
+                continue
+            start, end = self.term_offsets[term_id], self.term_offsets[term_id + 1]
+            df = end - start
+            idf = math.log(1 + (chunk_count - df + 0.5) / (df + 0.5))
+            for position in range(start, end):
+                chunk_id = self.posting_chunks[position]
+                freq = self.posting_freqs[position]
+                norm = BM25_K1 * (1 - BM25_B + BM25_B * self.chunk_lengths[chunk_id] / (self.avg_length or 1))
+                scores[chunk_id] = scores.get(chunk_id, 0.0) + idf * freq * (BM25_K1 + 1) / (freq + norm)
+        return heapq.nlargest(k, scores.items(), key=lambda item: item[1])
+
+    def to_bytes(self) -> bytes:
+        columns = [self.term_offsets, self.posting_chunks, self.posting_freqs, self.chunk_lengths]
+        header = {
+            "version": _FORMAT_VERSION,
+            "total_chars": self.total_chars,
+            "terms": sorted(self.terms, key=self.terms.get),
+            "chunks": [[chunk.page, chunk.text] for chunk in self.chunks],
+            "columns": [[column.typecode, len(column)] for column in columns],
+        }
+        return b"".join([json.dumps(header).encode("utf-8"), b"\n"] + [column.tobytes() for column in columns])
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        newline = data.index(b"\n")
+        header = json.loads(data[:newline])
+        if header.get("version") != _FORMAT_VERSION:
+            raise ValueError("unsupported bm25 format")
+        offset = newline + 1
+        columns = []
+        for typecode, length in header["columns"]:
+            column = array(typecode)
+            size = column.itemsize * length
+            column.frombytes(data[offset:offset + size])
+            offset += size
+            columns.append(column)
+        return cls(
+            [Chunk(page, text) for page, text in header["chunks"]],
+            header["total_chars"],
+            {term: term_id for term_id, term in enumerate(header["terms"])},
+            *columns,
+        )
+
+
+def build_index(pages) -> BM25Index:
+    return BM25Index.build(chunk_pages(pages), sum(len(text) for _, text in pages))
+
+
+def top_chunks(index: BM25Index, question: str, k: int) -> list:
+    """
+    The k best-scoring chunks for the question, returned in document order; the
+    opening chunks when no chunk shares a term with it, as in hybrid.search.
+    """
+    hits = index.search(question, k)
+    if not hits:
+        return index.chunks[:k]
+    return [index.chunks[chunk_id] for chunk_id in sorted(chunk_id for chunk_id, _ in hits)]
+
+
+_memory = OrderedDict()
+_memory_lock = Lock()
+
+
+def _entry_path(digest: str) -> Path:
+    return BM25_CACHE_DIR / digest[:2] / f"{digest}.bm25"
+
+
+def load_index(digest: str):
+    """BM25 index for a document version from memory or disk, or None on a miss."""
+    with _memory_lock:
+        index = _memory.get(digest)
+        if index is not None:
+            _memory.move_to_end(digest)
+            return index
+    try:
+        index = BM25Index.from_bytes(_entry_path(digest).read_bytes())
+    except (FileNotFoundError, OSError, ValueError):
+        return None
+    _remember(digest, index)
+    return index
+
+
+def store_index(digest: str, index: BM25Index):
+    _remember(digest, index)
+    entry = _entry_path(digest)
+    try:
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        # The ingest thread and a request thread may store the same digest at once
+        tmp = entry.with_suffix(f".{os.getpid()}.{get_ident()}.tmp")
+        tmp.write_bytes(index.to_bytes())
+        os.replace(tmp, entry)
+    except OSError as e:
+        print(f"Warning: could not write bm25 cache entry {digest}: {e}")
+
+
+def discard(digest: str):
+    """Drop the BM25 index of a superseded document version."""
+    with _memory_lock:
+        _memory.pop(digest, None)
+    try:
+        _entry_path(digest).unlink()
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"Warning: could not remove bm25 cache entry {digest}: {e}")
+
+
+def _remember(digest: str, index: BM25Index):
+    with _memory_lock:
+        _memory[digest] = index
+        _memory.move_to_end(digest)
+        while len(_memory) > BM25_MEMORY_SLOTS:
+            _memory.popitem(last=False)
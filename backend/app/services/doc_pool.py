@@ -0,0 +1,103 @@
+"""
+Per-process pool of open fitz.Document handles.
+
+Lives inside each pdf_pool worker so the documents of an active chat stay
+parsed (and, in production, downloaded) between consecutive requests.
+Entries are keyed by stored file path and tagged with the content digest of
+the version they hold; eviction is LRU against an approximate memory ceiling,
+plus an idle TTL so quiet documents do not pin memory forever.
+"""
+import os
+import time
+from collections import OrderedDict
+
+DOC_POOL_MAX_MB = int(os.getenv("DOC_POOL_MAX_MB", "256"))
+DOC_POOL_IDLE_TTL = float(os.getenv("DOC_POOL_IDLE_TTL", "300"))
+# Parsed documents take several times their file size once pages are loaded
+DOC_POOL_SIZE_FACTOR = float(os.getenv("DOC_POOL_SIZE_FACTOR", "3"))
+
+
+class PooledDocument:
+    __slots__ = ("digest", "document", "source", "etag", "size", "last_used")
+
+    def __init__(self, digest, document, source, etag, size):
+        self.digest = digest
+        self.document = document
+        self.source = source
+        self.etag = etag
+        self.size = size
+        self.last_used = time.monotonic()
+
+
+class DocumentPool:
+    def __init__(self, max_bytes: int, idle_ttl: float):
+        self.max_bytes = max_bytes
+        self.idle_ttl = idle_ttl
+        self.total_bytes = 0
+        self._entries = OrderedDict()
+
+    def get(self, file_path: str):
+        """Return the entry for file_path (any version) and mark it most recently used, or None."""
+        self._evict_idle()
+        entry = self._entries.get(file_path)
+        if entry is None:
+            return None
+        entry.last_used = time.monotonic()
+        self._entries.move_to_end(file_path)
+        return entry
+
+    def put(self, file_path: str, digest: str, document, source, etag=None) -> PooledDocument:
+        """Pool an open document, replacing (and closing) any older version for the same path."""
+        self.discard(file_path)
+        raw_size = len(source) if isinstance(source, bytes) else os.path.getsize(source)
+        entry = PooledDocument(digest, document, source, etag, int(raw_size * DOC_POOL_SIZE_FACTOR))
+        self._entries[file_path] = entry
+        self.total_bytes += entry.size
+        self._evict_over_budget(keep=file_path)
+        return entry
+
+    def take(self, file_path: str, digest: str):
+        """
+        Remove and return the pooled document for this exact version, or None.
+        Used by callers that mutate the document: once edited it no longer matches its digest.
+        """
+        entry = self._entries.get(file_path)
+        if entry is None or entry.digest != digest or entry.document is None:
+            return None
+        document = entry.document
+        entry.document = None
+        self._drop(file_path, close=False)
+        return document
+
+    def discard(self, file_path: str):
+        if file_path in self._entries:
+            self._drop(file_path)
+
+    def clear(self):
+        for file_path in list(self._entries):
+            self._drop(file_path)
+
+    def _drop(self, file_path: str, close: bool = True):
+        entry = self._entries.pop(file_path)
+        self.total_bytes -= entry.size
+        if close and entry.document is not None:
+            try:
+                entry.document.close()
+            except Exception:
+                pass
+
+    def _evict_idle(self):
+        cutoff = time.monotonic() - self.idle_ttl
+        for file_path in [path for path, entry in self._entries.items() if entry.last_used < cutoff]:
+            self._drop(file_path)
+
+    def _evict_over_budget(self, keep: str):
+        # Least recently used first; never evict the entry just added, even if it alone exceeds the budget
+        for file_path in list(self._entries):
+            if self.total_bytes <= self.max_bytes:
+                break
+            if file_path != keep:
+                self._drop(file_path)
+
+
+pool = DocumentPool(DOC_POOL_MAX_MB * 1024 * 1024, DOC_POOL_IDLE_TTL)
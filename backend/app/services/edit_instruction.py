@@ -0,0 +1,104 @@
+"""
+Deterministic parsing of explicit edit instructions.
+
+"change X to Y", "replace 'X' with 'Y'", "instead of X, write Y" and the
+other forms intent_classifier.EDIT_PATTERNS recognises already name the
+text to replace and its replacement, so asking the model to restate them
+only adds latency. parse() pulls out the candidate (original, new) pairs;
+the caller checks which originals occur in the document and only consults
+the model when none or several do, or when parse() finds nothing.
+"""
+import re
+
+# Verbs of the "<verb> X <preposition> Y" forms, with the prepositions that separate X from Y
+_FORMS = [
+    (r"change|edit|update|modify|rename|correct|fix|set|turn", r"to|into|as"),
+    (r"replace|swap|substitute", r"with|by"),
+    (r"swap|exchange", r"for"),
+]
+_INSTEAD_RE = re.compile(r"^instead\s+of\s+(.+?),?\s+(?:write|put|use|say)\s+(.+)$", re.IGNORECASE)
+
+_QUOTED_RE = re.compile(r'"([^"]+)"|“([^”]+)”|‘([^’]+)’|(?<!\w)\'(.+?)\'(?!\w)|`([^`]+)`')
+_PLACEHOLDER = "\x00{}\x00"
+_PLACEHOLDER_RE = re.compile(r"\x00(\d+)\x00")
+
+# Politeness in front of an instruction ("please", "can you"); also used by intent_classifier
+POLITE_PREFIX = (
+    r"(?:(?:please|kindly|can\s+you|could\s+you|would\s+you|will\s+you|i\s+want\s+to|i'd\s+like\s+to|"
+    r"i\s+would\s+like\s+to|let's|go\s+ahead\s+and)\s+)*"
+)
+_LEADING_RE = re.compile(r"^" + POLITE_PREFIX, re.IGNORECASE)
+_TRAILING_RE = re.compile(
+    r"(?:\s+(?:please|thanks|thank\s+you|everywhere|throughout(?:\s+the\s+(?:document|pdf|file))?|"
+    r"in\s+the\s+(?:document|pdf|file)))*[\s.!?,]*$",
+    re.IGNORECASE,
+)
+# "the word X": a descriptor in front of quoted text
+_DESCRIBED_RE = re.compile(
+    r"(?:(?:the\s+)?(?:word|words|text|phrase|string|name|title|heading|line|value|number|date|sentence)\s+)?"
+    + _PLACEHOLDER_RE.pattern,
+    re.IGNORECASE,
+)
+# Unquoted text that describes its target ("the date") instead of quoting it is left to the model
+_DESCRIPTIVE_RE = re.compile(
+    r"^(?:the|a|an|this|that|these|those|my|our|your|his|her|their|its|all|every|each|some|any)\b", re.IGNORECASE
+)
+# Unquoted replacements that carry a location are left to the model
+_QUALIFIED_RE = re.compile(
+    r"\b(?:on|in|at)\s+(?:page|line|section|paragraph|the\s+(?:title|heading|header|footer))\b", re.IGNORECASE
+)
+# Several instructions in one message ("change 1 to 2 and 3 to 4") are left to the model
+_COMPOUND_RE = re.compile(r"\b(?:and|then|also)\b.*\b(?:to|into|as|with|by|for)\b", re.IGNORECASE)
+
+
+def parse(instruction: str) -> list:
+    """
+    Candidate [{"original", "new"}, ...] readings of an explicit edit instruction, most
+    likely first; [] when it does not name both texts. Unquoted text may split in more
+    than one place ("change 1 to 2 to 3"), hence several candidates.
+    """
+    text = _TRAILING_RE.sub("", _LEADING_RE.sub("", instruction.strip()))
+    quotes = []
+
+    def hold(match):
+        quotes.append(next(group for group in match.groups() if group is not None))
+        return _PLACEHOLDER.format(len(quotes) - 1)
+
+    skeleton = _QUOTED_RE.sub(hold, text)
+    candidates = []
+    splits = [] if _COMPOUND_RE.search(skeleton) else _splits(skeleton)
+    for original, new in splits:
+        (original, original_quoted), (new, new_quoted) = _resolve(original, quotes), _resolve(new, quotes)
+        if not original or not new or original == new:
+            continue
+        if (not original_quoted and _DESCRIPTIVE_RE.match(original)) or (not new_quoted and _QUALIFIED_RE.search(new)):
+            continue
+        candidate = {"original": original, "new": new}
+        if candidate not in candidates:
+            candidates.append(candidate)
+    return candidates
+
+
+def _splits(skeleton: str):
+    """Every (original, new) split of the instruction that one of the forms allows."""
+    match = _INSTEAD_RE.match(skeleton)
+    if match:
+        yield match.group(1), match.group(2)
+    for verbs, prepositions in _FORMS:
+        match = re.match(rf"^(?:{verbs})\s+(.+)$", skeleton, re.IGNORECASE)
+        if not match:
+            continue
+        rest = match.group(1)
+        for separator in re.finditer(rf"\s+(?:{prepositions})\s+", rest, re.IGNORECASE):
+            yield rest[:separator.start()], rest[separator.end():]
+
+
+def _resolve(part: str, quotes: list):
+    """(text, quoted) for a part of the skeleton; text is None when it mixes quoted and unquoted text."""
+    part = part.strip().strip(",:;")
+    match = _DESCRIBED_RE.fullmatch(part)
+    if match:
+        return quotes[int(match.group(1))], True
+    if _PLACEHOLDER_RE.search(part):
+        return None, True
+    return part, False
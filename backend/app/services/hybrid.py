@@ -0,0 +1,121 @@
+"""
+Hybrid retrieval: BM25 and dense search over the same page chunks, fused with
+reciprocal rank fusion and optionally reranked by a cheap local cross-scoring
+pass before the prompt is built.
+
+Both indexes are built by chunk_pages() over the same pages, so chunk ids line
+up. The dense leg runs under a latency budget and a concurrency cap; when it is
+slow, saturated, failing or its index is not built yet the query degrades to lexical-only
+instead of stretching the tail latency.
+"""
+import asyncio
+import os
+import time
+
+from . import retrieval
+from .retrieval import tokenize
+
+HYBRID_BUDGET_MS = float(os.getenv("HYBRID_BUDGET_MS", "250"))
+HYBRID_MAX_DENSE_INFLIGHT = int(os.getenv("HYBRID_MAX_DENSE_INFLIGHT", "8"))
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))
+HYBRID_RERANK = os.getenv("HYBRID_RERANK", "true").lower() == "true"
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+stats = {"queries": 0, "degraded": 0}
+_dense_inflight = 0
+
+
+def reciprocal_rank_fusion(rankings, k: int = RRF_K) -> list:
+    """Fuse ranked lists of chunk ids: score(id) = sum over lists of 1 / (k + rank). Returns ids best first."""
+    scores = {}
+    for ranking in rankings:
+        for rank, chunk_id in enumerate(ranking, start=1):
+            scores[chunk_id] = scores.get(chunk_id, 0.0) + 1.0 / (k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def rerank(question: str, chunks: list, chunk_ids: list) -> list:
+    """
+    Reorder candidates by how well each chunk covers the question: share of the
+    question's distinct terms it contains, plus a bonus for each question bigram
+    it contains verbatim. Ties keep the fused order.
+    """
+    terms = set(tokenize(question))
+    if not terms:
+        return chunk_ids
+    question_tokens = tokenize(question)
+    bigrams = {f"{a} {b}" for a, b in zip(question_tokens, question_tokens[1:])}
+
+    def score(item):
+        position, chunk_id = item
+        tokens = tokenize(chunks[chunk_id].text)
+        coverage = len(terms.intersection(tokens)) / len(terms)
+        chunk_bigrams = {f"{a} {b}" for a, b in zip(tokens, tokens[1:])}
+        phrase = len(bigrams & chunk_bigrams) / len(bigrams) if bigrams else 0.0
+        return (-(coverage + 0.5 * phrase), position)
+
+    return [chunk_id for _, chunk_id in sorted(enumerate(chunk_ids), key=score)]
+
+
+def _dense_query(index, question: str, k: int) -> list:
+    return index.search(retrieval.get_embedder().embed([question])[0], k)
+
+
+def _dense_done(work):
+    global _dense_inflight
+    _dense_inflight -= 1
+    if not work.cancelled():
+        work.exception()  # an abandoned query's error is not worth a warning
+
+
+async def _dense_search(index, question: str, k: int) -> list:
+    """
+    Dense leg of a query. When the budget runs out the caller stops waiting, but
+    the thread keeps embedding and searching, so it still counts as in flight
+    until it finishes.
+    """
+    global _dense_inflight
+    _dense_inflight += 1
+    work = asyncio.ensure_future(asyncio.to_thread(_dense_query, index, question, k))
+    work.add_done_callback(_dense_done)
+    return await asyncio.shield(work)
+
+
+async def search(question: str, lexical_index, dense_index=None, k: int = retrieval.RETRIEVAL_TOP_K,
+                 budget_ms: float = HYBRID_BUDGET_MS, use_rerank: bool = HYBRID_RERANK) -> list:
+    """
+    Top-k chunks (document order) for a question. Both legs are queried
+    concurrently; the dense leg is dropped if it does not answer within budget_ms.
+    """
+    started = time.monotonic()
+    stats["queries"] += 1
+
+    dense_task = None
+    aligned = dense_index is not None and len(dense_index.chunks) == len(lexical_index.chunks)
+    if aligned and _dense_inflight < HYBRID_MAX_DENSE_INFLIGHT:
+        dense_task = asyncio.ensure_future(_dense_search(dense_index, question, HYBRID_CANDIDATES))
+
+    lexical_hits = await asyncio.to_thread(lexical_index.search, question, HYBRID_CANDIDATES)
+    rankings = [[chunk_id for chunk_id, _ in lexical_hits]]
+
+    if dense_task is not None:
+        remaining = max(0.0, budget_ms / 1000 - (time.monotonic() - started))
+        try:
+            dense_hits = await asyncio.wait_for(dense_task, timeout=remaining)
+            rankings.append([chunk_id for chunk_id, _ in dense_hits])
+        except asyncio.TimeoutError:
+            dense_task = None
+        except Exception as e:
+            # e.g. a remote embedder that is unreachable or over quota; the lexical hits still answer
+            print(f"Warning: dense retrieval failed, using lexical results only: {e}")
+            dense_task = None
+    if dense_task is None:
+        stats["degraded"] += 1
+
+    fused = reciprocal_rank_fusion(rankings)
+    if not fused:
+        # Nothing matched lexically and dense was unavailable: fall back to the opening chunks
+        return lexical_index.chunks[:k]
+    if use_rerank:
+        fused = rerank(question, lexical_index.chunks, fused)
+    return [lexical_index.chunks[chunk_id] for chunk_id in sorted(fused[:k])]
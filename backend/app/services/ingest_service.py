@@ -0,0 +1,135 @@
+"""
+Upload-time ingest pipeline.
+
+After a document is uploaded (or edited) its heavy preprocessing runs on a
+bounded background worker pool, so the first question hits warm caches
+instead of paying for download and parsing. Progress is recorded on
+Document.ingest_status, which clients poll via /documents/{id}/status.
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from threading import Lock
+
+from .. import models
+from ..database import SessionLocal
+from . import bm25, pdf_pool, pdf_worker, retrieval, search_service, summary_service, text_cache
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", "2"))
+
+STATUS_PENDING = "pending"
+STATUS_PROCESSING = "processing"
+STATUS_READY = "ready"
+STATUS_FAILED = "failed"
+
+_executor = ThreadPoolExecutor(max_workers=INGEST_WORKERS, thread_name_prefix="ingest")
+_in_flight = set()
+# Documents submitted again while running; they run once more when the current run ends
+_dirty = set()
+_in_flight_lock = Lock()
+
+
+def submit(document_id: int):
+    """Queue a document for ingest. A document already queued or running runs once more after the current run."""
+    with _in_flight_lock:
+        if document_id in _in_flight:
+            _dirty.add(document_id)
+            return
+        _in_flight.add(document_id)
+    _executor.submit(_run, document_id)
+
+
+def ensure_queued(document_id: int):
+    """Queue a document for ingest unless it is already queued or running (no re-run is requested)."""
+    with _in_flight_lock:
+        if document_id in _in_flight:
+            return
+        _in_flight.add(document_id)
+    _executor.submit(_run, document_id)
+
+
+def shutdown():
+    _executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _run(document_id: int):
+    db = SessionLocal()
+    try:
+        document = db.query(models.Document).filter(models.Document.id == document_id).first()
+        if not document:
+            return
+
+        document.ingest_status = STATUS_PROCESSING
+        document.ingest_error = None
+        db.commit()
+
+        try:
+            current_file_path = document.edited_file_path or document.file_path
+            result = _ingest_file(current_file_path)
+            _build_chunk_index(current_file_path, result["digest"])
+        except Exception as e:
+            print(f"Ingest failed for document {document_id}: {e}")
+            document.ingest_status = STATUS_FAILED
+            document.ingest_error = str(e)
+            db.commit()
+            return
+
+        text_cache.remember(current_file_path, result["digest"])
+        document.content_hash = result["digest"]
+        document.page_count = result["page_count"]
+        document.ingest_status = STATUS_READY
+        document.ingested_at = datetime.utcnow()
+        db.commit()
+        search_service.update_document(document.user_id, document.id, result["digest"])
+        summary_service.submit(document.id)
+        print(f"Ingested document {document_id}: {result['page_count']} pages")
+    finally:
+        db.close()
+        SessionLocal.remove()
+        _finish(document_id)
+
+
+def _finish(document_id: int):
+    """Run a document again if it was submitted while running (e.g. edited mid-run), else release it."""
+    with _in_flight_lock:
+        rerun = document_id in _dirty
+        _dirty.discard(document_id)
+        if not rerun:
+            _in_flight.discard(document_id)
+            return
+    try:
+        _executor.submit(_run, document_id)
+    except RuntimeError:  # shutting down
+        with _in_flight_lock:
+            _in_flight.discard(document_id)
+
+
+def _ingest_file(file_path: str) -> dict:
+    """
+    pdf_worker.ingest_file, with the pages of a document over PARALLEL_EXTRACT_MIN_PAGES
+    parsed first in parallel page ranges; ingest_file then joins their cached layouts.
+    """
+    extracted = pdf_pool.run_sync(pdf_worker.extract_pages, file_path, pdf_pool.PARALLEL_EXTRACT_MIN_PAGES)
+    local_path = extracted["local_path"]
+    if local_path is not None:
+        try:
+            parts = pdf_pool.map_sync(pdf_worker.extract_page_range, [
+                (local_path, start, stop) for start, stop in pdf_pool.page_ranges(extracted["page_count"])
+            ])
+        finally:
+            if local_path != file_path:
+                os.unlink(local_path)
+        text_cache.put_pages(extracted["digest"], [page_text for part in parts for page_text in part])
+    return pdf_pool.run_sync(pdf_worker.ingest_file, file_path)
+
+
+def _build_chunk_index(file_path: str, digest: str):
+    """Index the page chunks of a version so the first question only has to search them."""
+    mode = retrieval.RETRIEVAL_MODE
+    index_modules = {"dense": [retrieval], "bm25": [bm25], "hybrid": [bm25, retrieval]}.get(mode, [])
+    missing = [module for module in index_modules if module.load_index(digest) is None]
+    if not missing:
+        return
+    pages = pdf_pool.run_sync(pdf_worker.read_pages, file_path)["pages"]
+    for index_module in missing:
+        index_module.store_index(digest, index_module.build_index(pages))
@@ -0,0 +1,252 @@
+"""
+Local EDIT / QUESTION intent classifier.
+
+Saves the LLM round trip that used to classify every message the edit
+regexes did not catch. Explicit edit phrasings ("change X to Y", "replace X
+with Y", ...) that open the message and are not phrased as a question are
+decided by patterns; everything else is scored by a
+logistic regression over hashed character n-grams, trained on a built-in seed
+set plus past chats from the messages table (a user message is labelled EDIT
+when the assistant's reply reports an edit). Callers fall back to the LLM
+when the confidence is below INTENT_MIN_CONFIDENCE.
+"""
+import hashlib
+import os
+import re
+from pathlib import Path
+from threading import Lock
+
+import numpy as np
+from scipy import sparse
+
+from .edit_instruction import POLITE_PREFIX
+
+INTENT_MIN_CONFIDENCE = float(os.getenv("INTENT_MIN_CONFIDENCE", "0.8"))
+INTENT_MODEL_PATH = Path(os.getenv("INTENT_MODEL_PATH", "cache/intent_model.npz"))
+INTENT_FEATURE_DIM = 2 ** 15
+NGRAM_SIZES = (2, 3, 4)
+
+EDIT = "EDIT"
+QUESTION = "QUESTION"
+
+# Instructions start the message, after any politeness: "how do I change X to Y" is a question
+_START = r"^\s*" + POLITE_PREFIX
+
+EDIT_PATTERNS = [
+    _START + r"change\s+(.+?)\s+to\s+(.+)",
+    _START + r"edit\s+(.+?)\s+to\s+(.+)",
+    _START + r"replace\s+(.+?)\s+with\s+(.+)",
+    _START + r"update\s+(.+?)\s+to\s+(.+)",
+    _START + r"modify\s+(.+?)\s+to\s+(.+)",
+    _START + r"(rename|correct|fix)\s+(.+?)\s+(to|as)\s+(.+)",
+    _START + r"set\s+(.+?)\s+to\s+(.+)",
+    _START + r"swap\s+(.+?)\s+(for|with)\s+(.+)",
+    _START + r"substitute\s+(.+?)\s+(with|for|by)\s+(.+)",
+    _START + r"(delete|remove|erase)\s+(the\s+)?(word|text|line|sentence|phrase|name|date|number)\b",
+    _START + r"make\s+(it|the\s+.+?)\s+(say|read)\s+(.+)",
+    r"\bshould\s+(say|read)\s+(.+)",
+    _START + r"instead\s+of\s+(.+?),?\s+(write|put|use)\s+(.+)",
+]
+
+QUESTION_PATTERNS = [
+    r"^\s*(what|who|whom|whose|when|where|why|how|which)\b",
+    r"^\s*(is|are|does|do|did|was|were|has|have)\b",
+    r"\?\s*$",
+    r"^\s*(summari[sz]e|explain|describe|list|tell\s+me|give\s+me|show\s+me|find)\b",
+]
+
+# Labelled examples the model always trains on, so it works before any history exists
+_SEED_EXAMPLES = [
+    ("change the date to March 5", EDIT),
+    ("replace John Smith with Jane Doe", EDIT),
+    ("update the total to $500", EDIT),
+    ("the invoice number should be 1042", EDIT),
+    ("fix the typo in the title", EDIT),
+    ("correct the spelling of the company name", EDIT),
+    ("make the address 12 Main Street", EDIT),
+    ("rename the project to Apollo", EDIT),
+    ("put 2024 instead of 2023", EDIT),
+    ("swap the first name for Maria", EDIT),
+    ("edit the heading so it says Annual Report", EDIT),
+    ("can you change the phone number", EDIT),
+    ("please set the amount to 300", EDIT),
+    ("use Acme Corp as the client name", EDIT),
+    ("the due date is wrong, it should be June 1", EDIT),
+    ("remove the word draft", EDIT),
+    ("write Berlin where it says Munich", EDIT),
+    ("modify the salary figure", EDIT),
+    ("I want the signature date to read 01/02/2025", EDIT),
+    ("alter the title", EDIT),
+    ("what is the due date", QUESTION),
+    ("who signed this contract", QUESTION),
+    ("summarize the document", QUESTION),
+    ("what is this document about", QUESTION),
+    ("how much is the total", QUESTION),
+    ("when does the lease end", QUESTION),
+    ("explain the termination clause", QUESTION),
+    ("list the parties involved", QUESTION),
+    ("is there a penalty for late payment?", QUESTION),
+    ("what are the key points", QUESTION),
+    ("tell me about the payment terms", QUESTION),
+    ("does it mention insurance", QUESTION),
+    ("give me an overview", QUESTION),
+    ("which page talks about pricing", QUESTION),
+    ("find the invoice number", QUESTION),
+    ("what changed in section 4", QUESTION),
+    ("how do I change my password according to the manual", QUESTION),
+    ("describe the methodology", QUESTION),
+    ("any deadlines I should know about", QUESTION),
+    ("the total amount", QUESTION),
+]
+
+# Assistant replies that mark the preceding user message as an edit request
+_EDIT_REPLY_PREFIXES = ("I've edited the PDF", "I couldn't make that edit")
+
+stats = {"pattern": 0, "model": 0, "unsure": 0}
+
+
+class IntentModel:
+    """Binary logistic regression; predict() returns P(EDIT)."""
+
+    def __init__(self, weights: np.ndarray, bias: float):
+        self.weights = weights
+        self.bias = bias
+
+    def predict(self, messages) -> np.ndarray:
+        logits = featurize(messages) @ self.weights + self.bias
+        return 1.0 / (1.0 + np.exp(-logits))
+
+
+_model = None
+_model_lock = Lock()
+
+
+def _normalize(message: str) -> str:
+    return " " + " ".join(message.lower().split()) + " "
+
+
+def _bucket(ngram: str) -> int:
+    return int.from_bytes(hashlib.blake2b(ngram.encode("utf-8"), digest_size=8).digest(), "little") % INTENT_FEATURE_DIM
+
+
+def featurize(messages):
+    """Sparse (len(messages), INTENT_FEATURE_DIM) matrix of L2-normalized hashed character n-gram counts."""
+    rows, columns, values = [], [], []
+    for row, message in enumerate(messages):
+        text = _normalize(message)
+        counts = {}
+        for size in NGRAM_SIZES:
+            for start in range(len(text) - size + 1):
+                bucket = _bucket(text[start:start + size])
+                counts[bucket] = counts.get(bucket, 0) + 1
+        norm = sum(count * count for count in counts.values()) ** 0.5 or 1.0
+        for bucket, count in counts.items():
+            rows.append(row)
+            columns.append(bucket)
+            values.append(count / norm)
+    return sparse.csr_matrix((values, (rows, columns)), shape=(len(messages), INTENT_FEATURE_DIM), dtype=np.float32)
+
+
+def train(examples, epochs: int = 300, learning_rate: float = 2.0, l2: float = 1e-4) -> IntentModel:
+    """Fit on [(message, "EDIT" | "QUESTION"), ...] with full-batch gradient descent, classes weighted equally."""
+    messages = [message for message, _ in examples]
+    labels = np.array([1.0 if label == EDIT else 0.0 for _, label in examples], dtype=np.float32)
+    features = featurize(messages)
+    positives = max(labels.sum(), 1.0)
+    negatives = max(len(labels) - labels.sum(), 1.0)
+    sample_weights = np.where(labels == 1.0, 0.5 / positives, 0.5 / negatives).astype(np.float32)
+
+    weights = np.zeros(INTENT_FEATURE_DIM, dtype=np.float32)
+    bias = 0.0
+    for _ in range(epochs):
+        predictions = 1.0 / (1.0 + np.exp(-(features @ weights + bias)))
+        error = (predictions - labels) * sample_weights
+        weights -= learning_rate * (features.T @ error + l2 * weights)
+        bias -= learning_rate * float(error.sum())
+    return IntentModel(weights, bias)
+
+
+def history_examples(db) -> list:
+    """Label past user messages by the assistant reply that followed them in the same chat."""
+    from .. import models
+
+    examples = []
+    previous = None
+    rows = db.query(models.Message).order_by(models.Message.document_id, models.Message.id).all()
+    for message in rows:
+        if (previous is not None and previous.is_user and not message.is_user
+                and previous.document_id == message.document_id and previous.content):
+            label = EDIT if (message.content or "").startswith(_EDIT_REPLY_PREFIXES) else QUESTION
+            examples.append((previous.content, label))
+        previous = message
+    return examples
+
+
+def retrain_from_history():
+    """Train on the seed set plus the messages table and persist the model. Run at startup."""
+    from ..database import SessionLocal
+
+    global _model
+    db = SessionLocal()
+    try:
+        examples = history_examples(db)
+    except Exception as e:
+        print(f"Warning: could not read message history for the intent model: {e}")
+        examples = []
+    finally:
+        db.close()
+        SessionLocal.remove()
+
+    model = train(_SEED_EXAMPLES + examples)
+    with _model_lock:
+        _model = model
+    try:
+        INTENT_MODEL_PATH.parent.mkdir(parents=True, exist_ok=True)
+        tmp = INTENT_MODEL_PATH.with_suffix(f".{os.getpid()}.tmp.npz")
+        np.savez(tmp, weights=model.weights, bias=np.float32(model.bias))
+        os.replace(tmp, INTENT_MODEL_PATH)
+    except OSError as e:
+        print(f"Warning: could not save intent model: {e}")
+    print(f"Intent model trained on {len(_SEED_EXAMPLES) + len(examples)} messages ({len(examples)} from history)")
+
+
+def _get_model() -> IntentModel:
+    global _model
+    with _model_lock:
+        if _model is None:
+            try:
+                stored = np.load(INTENT_MODEL_PATH)
+                if stored["weights"].shape == (INTENT_FEATURE_DIM,):
+                    _model = IntentModel(stored["weights"], float(stored["bias"]))
+            except (FileNotFoundError, OSError, ValueError, KeyError):
+                pass
+        if _model is None:
+            _model = train(_SEED_EXAMPLES)
+        return _model
+
+
+def classify(message: str):
+    """
+    Return (intent, confidence): intent is "EDIT" or "QUESTION", confidence in [0.5, 1].
+    Below INTENT_MIN_CONFIDENCE the caller should ask the LLM instead.
+    """
+    question_like = any(re.search(pattern, message, re.IGNORECASE) for pattern in QUESTION_PATTERNS)
+    # A question that mentions an edit ("can I change X to Y?") is left to the model, never certain
+    if not question_like and any(re.search(pattern, message, re.IGNORECASE) for pattern in EDIT_PATTERNS):
+        stats["pattern"] += 1
+        return EDIT, 1.0
+
+    edit_probability = float(_get_model().predict([message])[0])
+    if edit_probability < 0.5 and question_like:
+        # Phrased as a question and the model agrees: confident enough without the LLM
+        stats["pattern"] += 1
+        return QUESTION, max(1.0 - edit_probability, INTENT_MIN_CONFIDENCE)
+
+    if question_like:
+        # Phrased as a question but scored as an edit: too close to call without the LLM
+        stats["unsure"] += 1
+        return EDIT, min(edit_probability, INTENT_MIN_CONFIDENCE - 0.01)
+
+    intent, confidence = (EDIT, edit_probability) if edit_probability >= 0.5 else (QUESTION, 1.0 - edit_probability)
+    stats["model" if confidence >= INTENT_MIN_CONFIDENCE else "unsure"] += 1
+    return intent, confidence
@@ -0,0 +1,509 @@
+"""
+Async gateway for every LLM call the backend makes.
+
+Calls never block the event loop: Gemini goes through langchain's async
+client and OpenAI through httpx. Concurrency is bounded by a global semaphore
+and one per provider, each call has a timeout, and cancelling the awaiting
+task (e.g. a client disconnect) cancels the provider request with it.
+stream() yields the response in pieces as it is generated, under the same limits.
+Background threads (summaries) submit their calls to the server's event loop
+with complete_blocking, so they share the same limits.
+
+Providers are pluggable (gemini, openai, and fake for tests and offline
+runs). A failed or timed-out call falls back to the next provider in
+LLM_FALLBACK_PROVIDERS; a provider that keeps failing has its circuit opened
+and is skipped until CIRCUIT_RESET_SECONDS have passed. With LLM_HEDGE on,
+a call still running after its provider's p95 latency is raced against the
+next provider, and the first answer wins.
+"""
+import asyncio
+import hashlib
+import json
+import os
+import time
+from collections import deque
+
+from dotenv import load_dotenv
+
+from . import single_flight
+
+load_dotenv()
+
+LLM_PROVIDER = os.getenv("LLM_PROVIDER", "gemini")
+GEMINI_MODEL = os.getenv("GEMINI_MODEL", "gemini-2.0-flash")
+OPENAI_MODEL = os.getenv("OPENAI_MODEL", "gpt-3.5-turbo")
+OPENAI_API_URL = os.getenv("OPENAI_API_URL", "https://api.openai.com/v1/chat/completions")
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "32"))
+PROVIDER_CONCURRENCY = {
+    "gemini": int(os.getenv("GEMINI_MAX_CONCURRENCY", "16")),
+    "openai": int(os.getenv("OPENAI_MAX_CONCURRENCY", "8")),
+}
+# Providers tried, in order, after the requested one fails or has its circuit open
+LLM_FALLBACK_PROVIDERS = [name.strip() for name in os.getenv("LLM_FALLBACK_PROVIDERS", "").split(",") if name.strip()]
+LLM_HEDGE = os.getenv("LLM_HEDGE", "false").lower() == "true"
+# The hedge fires after the provider's p95 latency, once it has this many samples; until then after LLM_HEDGE_DELAY
+LLM_HEDGE_MIN_SAMPLES = int(os.getenv("LLM_HEDGE_MIN_SAMPLES", "20"))
+LLM_HEDGE_DELAY = float(os.getenv("LLM_HEDGE_DELAY", "5"))
+LLM_HEDGE_MIN_DELAY = float(os.getenv("LLM_HEDGE_MIN_DELAY", "0.5"))
+LATENCY_WINDOW = int(os.getenv("LLM_LATENCY_WINDOW", "200"))
+# Consecutive failures that open a provider's circuit, and how long it stays open before a probe call
+CIRCUIT_FAILURES = int(os.getenv("CIRCUIT_FAILURES", "5"))
+CIRCUIT_RESET_SECONDS = float(os.getenv("CIRCUIT_RESET_SECONDS", "30"))
+FAKE_LLM_RESPONSE = os.getenv("FAKE_LLM_RESPONSE", "This is a response from the fake provider.")
+FAKE_LLM_LATENCY = float(os.getenv("FAKE_LLM_LATENCY", "0"))
+
+stats = {
+    "calls": 0, "inflight": 0, "timeouts": 0, "cancelled": 0, "errors": 0,
+    "fallbacks": 0, "hedged": 0, "hedge_wins": 0, "circuit_rejections": 0, "circuit_opened": 0,
+}
+
+
+class LLMError(Exception):
+    """A provider answered with an error."""
+
+
+class LLMTimeoutError(TimeoutError):
+    """An LLM call did not complete within its timeout."""
+
+
+class LLMUnavailableError(LLMError):
+    """Every provider that could answer has its circuit open."""
+
+
+class CircuitBreaker:
+    """
+    Opens after CIRCUIT_FAILURES consecutive failures. Once CIRCUIT_RESET_SECONDS have
+    passed, one probe call is let through: success closes the circuit, failure reopens it.
+    """
+
+    def __init__(self, provider: str):
+        self.provider = provider
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def allow(self) -> bool:
+        if self.opened_at is None:
+            return True
+        if self.probing or time.monotonic() - self.opened_at < CIRCUIT_RESET_SECONDS:
+            return False
+        self.probing = True
+        return True
+
+    def record_success(self):
+        self.failures = 0
+        self.opened_at = None
+        self.probing = False
+
+    def record_failure(self):
+        self.failures += 1
+        if self.probing or self.failures >= CIRCUIT_FAILURES:
+            if self.opened_at is None:
+                stats["circuit_opened"] += 1
+                print(f"Warning: opening circuit for LLM provider {self.provider} after {self.failures} failures")
+            self.opened_at = time.monotonic()
+        self.probing = False
+
+    def release(self):
+        """The call ended without a verdict (cancelled)."""
+        self.probing = False
+
+
+_loop = None
+_global_limit = None
+_provider_limits = {}
+_breakers = {}
+_latencies = {}
+_gemini_client = None
+_http_client = None
+
+
+def start():
+    """Bind the gateway to the running event loop. Called once at server startup."""
+    global _loop
+    _loop = asyncio.get_running_loop()
+
+
+async def stop():
+    global _http_client
+    if _http_client is not None:
+        await _http_client.aclose()
+        _http_client = None
+
+
+def model_name(provider: str = None) -> str:
+    """Model a provider answers with; part of response cache keys."""
+    provider = provider or LLM_PROVIDER
+    if provider == "gemini":
+        return GEMINI_MODEL
+    if provider == "openai":
+        return f"openai:{OPENAI_MODEL}"
+    return provider
+
+
+def _breaker(provider: str) -> CircuitBreaker:
+    if provider not in _breakers:
+        _breakers[provider] = CircuitBreaker(provider)
+    return _breakers[provider]
+
+
+def latency_p95(provider: str):
+    """95th percentile of the provider's recent call latencies in seconds, or None without enough samples."""
+    samples = _latencies.get(provider)
+    if not samples or len(samples) < LLM_HEDGE_MIN_SAMPLES:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * 0.95))]
+
+
+def _record_latency(provider: str, seconds: float):
+    if provider not in _latencies:
+        _latencies[provider] = deque(maxlen=LATENCY_WINDOW)
+    _latencies[provider].append(seconds)
+
+
+def _chain(provider: str) -> list:
+    """The requested provider followed by the fallbacks, each once."""
+    chain = [provider]
+    for name in LLM_FALLBACK_PROVIDERS:
+        if name not in chain and name in _PROVIDERS:
+            chain.append(name)
+    return chain
+
+
+def _limits(provider: str):
+    global _global_limit
+    if _global_limit is None:
+        _global_limit = asyncio.Semaphore(LLM_MAX_CONCURRENCY)
+    if provider not in _provider_limits:
+        _provider_limits[provider] = asyncio.Semaphore(PROVIDER_CONCURRENCY.get(provider, LLM_MAX_CONCURRENCY))
+    return _global_limit, _provider_limits[provider]
+
+
+async def complete(prompt: str, provider: str = None, timeout: float = None, **options) -> str:
+    """
+    Send one prompt and return the response text, stripped.
+    options: system, max_tokens, temperature, json_output (ask for a JSON object);
+    not every provider uses every option.
+    Each provider attempt gets timeout seconds, waiting for a free slot included; when
+    every attempt fails the last error is raised (LLMTimeoutError if it timed out).
+    Identical concurrent calls (same provider, prompt and options) share one request.
+    """
+    provider = provider or LLM_PROVIDER
+    prompt_hash = hashlib.sha256(prompt.encode("utf-8")).hexdigest()
+    key = ("llm", provider, prompt_hash, tuple(sorted(options.items())))
+    return await single_flight.run(key, _complete, prompt, provider, timeout, **options)
+
+
+async def _complete(prompt: str, provider: str, timeout: float, **options) -> str:
+    """Try the provider chain in order; with LLM_HEDGE each attempt may be raced against the next provider."""
+    chain = _chain(provider)
+    tried = set()
+    error = None
+    for position, name in enumerate(chain):
+        if name in tried:
+            continue
+        if not _breaker(name).allow():
+            stats["circuit_rejections"] += 1
+            continue
+        tried.add(name)
+        backups = [other for other in chain[position + 1:] if other not in tried] if LLM_HEDGE else []
+        if position > 0:
+            stats["fallbacks"] += 1
+        try:
+            if backups:
+                return await _hedged(prompt, name, backups, tried, timeout, options)
+            return await _attempt(prompt, name, timeout, options)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            print(f"Warning: LLM provider {name} failed: {e}")
+            error = e
+    if error is None:
+        raise LLMUnavailableError(f"circuit open for {', '.join(chain)}")
+    raise error
+
+
+async def _hedged(prompt: str, provider: str, backups: list, tried: set, timeout: float, options: dict) -> str:
+    """
+    Call provider; if it has not answered after its p95 latency, also call the first
+    backup whose circuit allows it and return whichever answers first.
+    """
+    delay = latency_p95(provider)
+    delay = LLM_HEDGE_DELAY if delay is None else max(delay, LLM_HEDGE_MIN_DELAY)
+    tasks = {asyncio.ensure_future(_attempt(prompt, provider, timeout, options)): provider}
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=delay)
+        if not done:
+            backup = next((name for name in backups if _breaker(name).allow()), None)
+            if backup is not None:
+                stats["hedged"] += 1
+                tried.add(backup)
+                tasks[asyncio.ensure_future(_attempt(prompt, backup, timeout, options))] = backup
+
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            winner = None
+            for task in done:
+                if task.exception() is None:
+                    winner = task
+                else:
+                    error = task.exception()
+            if winner is not None:
+                if tasks[winner] != provider:
+                    stats["hedge_wins"] += 1
+                return winner.result()
+        raise error
+    finally:
+        for task in tasks:
+            task.cancel()
+
+
+async def _attempt(prompt: str, provider: str, timeout: float, options: dict) -> str:
+    """One call to one provider under its limits and timeout, recorded in its latency window and circuit."""
+    call = _PROVIDERS[provider]
+    breaker = _breaker(provider)
+    global_limit, provider_limit = _limits(provider)
+    timeout = timeout or LLM_TIMEOUT
+
+    async def limited():
+        async with global_limit, provider_limit:
+            stats["inflight"] += 1
+            started = time.monotonic()
+            try:
+                result = await call(prompt, **options)
+            finally:
+                stats["inflight"] -= 1
+            _record_latency(provider, time.monotonic() - started)
+            return result
+
+    stats["calls"] += 1
+    try:
+        result = await asyncio.wait_for(limited(), timeout=timeout)
+    except asyncio.TimeoutError:
+        stats["timeouts"] += 1
+        _record_latency(provider, timeout)
+        breaker.record_failure()
+        raise LLMTimeoutError(f"{provider} did not answer within {timeout:g}s")
+    except asyncio.CancelledError:
+        stats["cancelled"] += 1
+        breaker.release()
+        raise
+    except Exception:
+        stats["errors"] += 1
+        breaker.record_failure()
+        raise
+    breaker.record_success()
+    return result
+
+
+async def stream(prompt: str, provider: str = None, timeout: float = None, **options):
+    """
+    Send one prompt and yield the response text in pieces as the provider generates it.
+    Same limits as complete(); timeout bounds the whole stream, slot wait included.
+    A provider that fails before its first piece falls back to the next one; streams
+    are not hedged.
+    """
+    chain = _chain(provider or LLM_PROVIDER)
+    error = None
+    for position, name in enumerate(chain):
+        breaker = _breaker(name)
+        if not breaker.allow():
+            stats["circuit_rejections"] += 1
+            continue
+        if position > 0:
+            stats["fallbacks"] += 1
+        started = False
+        attempt = _stream_attempt(prompt, name, timeout, options)
+        try:
+            async for piece in attempt:
+                started = True
+                yield piece
+        except (asyncio.CancelledError, GeneratorExit):
+            breaker.release()
+            raise
+        except Exception as e:
+            breaker.record_failure()
+            if started:
+                raise
+            print(f"Warning: LLM provider {name} failed: {e}")
+            error = e
+            continue
+        finally:
+            await attempt.aclose()
+        breaker.record_success()
+        return
+    if error is None:
+        raise LLMUnavailableError(f"circuit open for {', '.join(chain)}")
+    raise error
+
+
+async def _stream_attempt(prompt: str, provider: str, timeout: float, options: dict):
+    call = _STREAMERS[provider]
+    global_limit, provider_limit = _limits(provider)
+    timeout = timeout or LLM_TIMEOUT
+    loop = asyncio.get_running_loop()
+    deadline = loop.time() + timeout
+
+    async def within_deadline(awaitable):
+        try:
+            return await asyncio.wait_for(awaitable, timeout=max(0.0, deadline - loop.time()))
+        except asyncio.TimeoutError:
+            stats["timeouts"] += 1
+            raise LLMTimeoutError(f"{provider} did not finish within {timeout:g}s")
+
+    stats["calls"] += 1
+    await within_deadline(global_limit.acquire())
+    try:
+        await within_deadline(provider_limit.acquire())
+    except BaseException:
+        global_limit.release()
+        raise
+
+    stats["inflight"] += 1
+    pieces = call(prompt, **options)
+    try:
+        while True:
+            try:
+                piece = await within_deadline(pieces.__anext__())
+            except StopAsyncIteration:
+                break
+            if piece:
+                yield piece
+    except asyncio.CancelledError:
+        stats["cancelled"] += 1
+        raise
+    except LLMTimeoutError:
+        raise
+    except Exception:
+        stats["errors"] += 1
+        raise
+    finally:
+        await pieces.aclose()
+        stats["inflight"] -= 1
+        provider_limit.release()
+        global_limit.release()
+
+
+def complete_blocking(prompt: str, provider: str = None, timeout: float = None, **options) -> str:
+    """complete() for worker threads: runs on the server's loop, under the same limits."""
+    if _loop is None or not _loop.is_running():
+        return asyncio.run(complete(prompt, provider, timeout, **options))
+    return asyncio.run_coroutine_threadsafe(complete(prompt, provider, timeout, **options), _loop).result()
+
+
+def _gemini():
+    global _gemini_client
+    if _gemini_client is None:
+        from langchain_google_genai import ChatGoogleGenerativeAI
+
+        _gemini_client = ChatGoogleGenerativeAI(
+            model=GEMINI_MODEL,
+            google_api_key=os.environ["GEMINI_API_KEY"],
+        )
+    return _gemini_client
+
+
+async def _gemini_complete(prompt: str, system: str = None, json_output: bool = False, **_):
+    from langchain_core.messages import HumanMessage, SystemMessage
+
+    messages = [SystemMessage(content=system)] if system else []
+    messages.append(HumanMessage(content=prompt))
+    extra = {"generation_config": {"response_mime_type": "application/json"}} if json_output else {}
+    response = await _gemini().ainvoke(messages, **extra)
+    return (response.content or "").strip()
+
+
+async def _gemini_stream(prompt: str, system: str = None, **_):
+    from langchain_core.messages import HumanMessage, SystemMessage
+
+    messages = [SystemMessage(content=system)] if system else []
+    messages.append(HumanMessage(content=prompt))
+    async for chunk in _gemini().astream(messages):
+        if chunk.content:
+            yield chunk.content
+
+
+def _openai_client():
+    global _http_client
+    if _http_client is None:
+        import httpx
+
+        _http_client = httpx.AsyncClient(timeout=None)  # the gateway's own timeout applies
+    return _http_client
+
+
+def _openai_request(prompt: str, system: str, max_tokens: int, temperature: float,
+                    stream: bool = False, json_output: bool = False) -> dict:
+    data = {
+        "model": OPENAI_MODEL,
+        "messages": [{"role": "system", "content": system}, {"role": "user", "content": prompt}],
+    }
+    if max_tokens is not None:
+        data["max_tokens"] = max_tokens
+    if temperature is not None:
+        data["temperature"] = temperature
+    if stream:
+        data["stream"] = True
+    if json_output:
+        data["response_format"] = {"type": "json_object"}
+    return data
+
+
+def _openai_headers() -> dict:
+    return {"Authorization": f"Bearer {os.getenv('OPENAI_API_KEY')}"}
+
+
+async def _openai_complete(prompt: str, system: str = "You are a helpful assistant.",
+                           max_tokens: int = None, temperature: float = None, json_output: bool = False):
+    response = await _openai_client().post(
+        OPENAI_API_URL,
+        headers=_openai_headers(),
+        json=_openai_request(prompt, system, max_tokens, temperature, json_output=json_output),
+    )
+    if response.status_code != 200:
+        raise LLMError(f"openai returned {response.status_code}: {response.text}")
+    return response.json()["choices"][0]["message"]["content"].strip()
+
+
+async def _openai_stream(prompt: str, system: str = "You are a helpful assistant.",
+                         max_tokens: int = None, temperature: float = None):
+    from httpx_sse import aconnect_sse
+
+    async with aconnect_sse(
+        _openai_client(), "POST", OPENAI_API_URL,
+        headers=_openai_headers(),
+        json=_openai_request(prompt, system, max_tokens, temperature, stream=True),
+    ) as event_source:
+        if event_source.response.status_code != 200:
+            await event_source.response.aread()
+            raise LLMError(f"openai returned {event_source.response.status_code}: {event_source.response.text}")
+        async for event in event_source.aiter_sse():
+            if event.data == "[DONE]":
+                break
+            choices = json.loads(event.data).get("choices") or [{}]
+            piece = choices[0].get("delta", {}).get("content")
+            if piece:
+                yield piece
+
+
+async def _fake_complete(prompt: str, json_output: bool = False, **_):
+    """Canned answer after FAKE_LLM_LATENCY seconds; no network or keys needed."""
+    await asyncio.sleep(FAKE_LLM_LATENCY)
+    if json_output:
+        return json.dumps({"intent": "QUESTION", "answer": FAKE_LLM_RESPONSE, "edits": []})
+    return FAKE_LLM_RESPONSE
+
+
+async def _fake_stream(prompt: str, **_):
+    words = FAKE_LLM_RESPONSE.split(" ")
+    for position, word in enumerate(words):
+        await asyncio.sleep(FAKE_LLM_LATENCY / len(words))
+        yield word if position == 0 else " " + word
+
+
+_PROVIDERS = {"gemini": _gemini_complete, "openai": _openai_complete, "fake": _fake_complete}
+_STREAMERS = {"gemini": _gemini_stream, "openai": _openai_stream, "fake": _fake_stream}
@@ -0,0 +1,136 @@
+"""
+Page-level extraction cache keyed by per-page content hashes.
+
+An edit rewrites one or two spans on one page, but produces a whole new file
+(and content digest). Hashing each page's content stream lets every new
+version reuse the extracted text and span layout of the pages it shares with
+earlier versions, so only the pages an edit touched are parsed again. The
+cache is shared by every document, so the hash covers everything a page's
+text depends on, including the XObjects and fonts its resources point to.
+
+Backed by SQLite so the pdf_pool worker processes share one store.
+"""
+import hashlib
+import os
+import re
+import sqlite3
+from pathlib import Path
+
+PAGE_CACHE_PATH = Path(os.getenv("PAGE_CACHE_PATH", "cache/pages.db"))
+
+_HASH_VERSION = b"page-hash-2"
+_REF_RE = re.compile(r"\b(\d+)\s+\d+\s+R\b")
+# Links back up the object tree (/Parent of pages, /P of annotations) would pull in every other page
+_BACKLINK_RE = re.compile(r"/(?:Parent|P)\s+\d+\s+\d+\s+R\b")
+
+_connection = None
+
+
+def _db():
+    global _connection
+    if _connection is None:
+        PAGE_CACHE_PATH.parent.mkdir(parents=True, exist_ok=True)
+        _connection = sqlite3.connect(str(PAGE_CACHE_PATH), timeout=30, isolation_level=None)
+        _connection.execute("PRAGMA journal_mode=WAL")
+        _connection.execute("CREATE TABLE IF NOT EXISTS page_text (hash TEXT PRIMARY KEY, text TEXT NOT NULL)")
+        _connection.execute("CREATE TABLE IF NOT EXISTS page_layout (hash TEXT PRIMARY KEY, layout BLOB NOT NULL)")
+    return _connection
+
+
+def page_hash(page, memo: dict = None) -> str:
+    """
+    Hash of what a page renders from: its content streams, everything its resources
+    reach (form and image XObjects, fonts, their ToUnicode maps and font files),
+    its size and rotation. Resource objects are hashed by content, not xref, so the
+    hash is the same for the unchanged pages of another version of the file.
+    memo caches object hashes across the pages of one document.
+    """
+    document = page.parent
+    memo = {} if memo is None else memo
+    sha = hashlib.sha256(_HASH_VERSION)
+    sha.update(page.read_contents())
+    sha.update(repr((tuple(page.rect), page.rotation)).encode("utf-8"))
+    sha.update(_resolve_refs(document, _resources(document, page.xref), memo, set()).encode("utf-8"))
+    return sha.hexdigest()
+
+
+def page_hashes(document, page_nums=None) -> list:
+    if page_nums is None:
+        page_nums = range(document.page_count)
+    memo = {}
+    return [page_hash(document[page_num], memo) for page_num in page_nums]
+
+
+def _resources(document, xref: int) -> str:
+    """Source of a page's /Resources, inherited from the page tree when the page has none."""
+    seen = set()
+    while xref and xref not in seen:
+        seen.add(xref)
+        kind, value = document.xref_get_key(xref, "Resources")
+        if kind != "null":
+            return value
+        kind, value = document.xref_get_key(xref, "Parent")
+        xref = int(value.split()[0]) if kind == "xref" else 0
+    return ""
+
+
+def _resolve_refs(document, source: str, memo: dict, active: set) -> str:
+    """source with every indirect reference replaced by the hash of the object it points to."""
+    source = _BACKLINK_RE.sub("", source)
+    return _REF_RE.sub(lambda match: _object_hash(document, int(match.group(1)), memo, active), source)
+
+
+def _object_hash(document, xref: int, memo: dict, active: set) -> str:
+    if xref in memo:
+        return memo[xref]
+    if xref in active:
+        return "cycle"
+    active.add(xref)
+    try:
+        sha = hashlib.sha256(_resolve_refs(document, document.xref_object(xref, compressed=True), memo, active).encode("utf-8"))
+        if document.xref_is_stream(xref):
+            sha.update(document.xref_stream_raw(xref) or b"")
+    finally:
+        active.discard(xref)
+    memo[xref] = sha.hexdigest()
+    return memo[xref]
+
+
+def _get_many(table: str, column: str, hashes) -> dict:
+    found = {}
+    unique = list(dict.fromkeys(hashes))
+    for start in range(0, len(unique), 500):
+        batch = unique[start:start + 500]
+        placeholders = ",".join("?" * len(batch))
+        rows = _db().execute(f"SELECT hash, {column} FROM {table} WHERE hash IN ({placeholders})", batch)
+        found.update(rows.fetchall())
+    return found
+
+
+def _put_many(table: str, column: str, items: dict):
+    if not items:
+        return
+    db = _db()
+    db.execute("BEGIN")
+    try:
+        db.executemany(f"INSERT OR IGNORE INTO {table} (hash, {column}) VALUES (?, ?)", items.items())
+        db.execute("COMMIT")
+    except Exception:
+        db.execute("ROLLBACK")
+        raise
+
+
+def get_texts(hashes) -> dict:
+    return _get_many("page_text", "text", hashes)
+
+
+def put_texts(items: dict):
+    _put_many("page_text", "text", items)
+
+
+def get_layouts(hashes) -> dict:
+    return _get_many("page_layout", "layout", hashes)
+
+
+def put_layouts(items: dict):
+    _put_many("page_layout", "layout", items)
@@ -0,0 +1,102 @@
+"""
+Dedicated process pool for PyMuPDF work.
+
+Parsing, editing and saving PDFs is CPU-bound and holds the GIL, so running
+it on the uvicorn event loop (or a thread) stalls every other request in the
+worker. Jobs submitted here run in separate processes that have already
+registered the custom fonts.
+"""
+import asyncio
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from functools import partial
+from threading import Lock
+
+from . import pdf_worker
+
+PDF_POOL_WORKERS = int(os.getenv("PDF_POOL_WORKERS", str(min(4, os.cpu_count() or 1))))
+# Documents with more pages than this are extracted in parallel page ranges
+PARALLEL_EXTRACT_MIN_PAGES = int(os.getenv("PARALLEL_EXTRACT_MIN_PAGES", "150"))
+# Smallest page range worth shipping to a separate worker
+PARALLEL_EXTRACT_MIN_RANGE = int(os.getenv("PARALLEL_EXTRACT_MIN_RANGE", "50"))
+
+_executor = None
+_executor_lock = Lock()
+
+
+def get_executor() -> ProcessPoolExecutor:
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            # spawn, not fork: the API process runs threads (ingest, uvicorn) that must not be forked mid-lock
+            _executor = ProcessPoolExecutor(
+                max_workers=PDF_POOL_WORKERS,
+                mp_context=multiprocessing.get_context("spawn"),
+                initializer=pdf_worker.init_worker,
+            )
+        return _executor
+
+
+def _reset_executor(broken: ProcessPoolExecutor):
+    """Drop a pool whose worker died (e.g. a crash inside MuPDF) so the next job gets a fresh one."""
+    global _executor
+    with _executor_lock:
+        if _executor is broken:
+            _executor = None
+    broken.shutdown(wait=False, cancel_futures=True)
+
+
+async def run(fn, *args, **kwargs):
+    """Run fn(*args, **kwargs) in the pool and await its result without blocking the event loop."""
+    executor = get_executor()
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(executor, partial(fn, *args, **kwargs))
+    except BrokenProcessPool:
+        _reset_executor(executor)
+        raise
+
+
+def run_sync(fn, *args, **kwargs):
+    """Blocking variant of run() for callers already off the event loop (e.g. ingest threads)."""
+    executor = get_executor()
+    try:
+        return executor.submit(fn, *args, **kwargs).result()
+    except BrokenProcessPool:
+        _reset_executor(executor)
+        raise
+
+
+def map_sync(fn, arg_tuples) -> list:
+    """Run fn(*args) for every args tuple concurrently in the pool and return the results in order."""
+    executor = get_executor()
+    try:
+        futures = [executor.submit(fn, *args) for args in arg_tuples]
+        return [future.result() for future in futures]
+    except BrokenProcessPool:
+        _reset_executor(executor)
+        raise
+
+
+def page_ranges(page_count: int) -> list:
+    """[(start, stop), ...] page ranges for a parallel extraction: at most one per worker, none tiny."""
+    range_count = min(PDF_POOL_WORKERS, max(1, page_count // PARALLEL_EXTRACT_MIN_RANGE))
+    step = -(-page_count // range_count)  # ceiling division
+    return [(start, min(start + step, page_count)) for start in range(0, page_count, step)]
+
+
+def prewarm():
+    """Start every worker now so the first request does not pay for process start-up and font registration."""
+    executor = get_executor()
+    for _ in range(PDF_POOL_WORKERS):
+        executor.submit(os.getpid)
+
+
+def shutdown():
+    global _executor
+    with _executor_lock:
+        executor, _executor = _executor, None
+    if executor is not None:
+        executor.shutdown(wait=False, cancel_futures=True)
@@ -1,12 +1,9 @@
 import os
+import asyncio
 import boto3
-import pymupdf as fitz
 from dotenv import load_dotenv
-from langchain_google_genai import ChatGoogleGenerativeAI
-from langchain_core.messages import HumanMessage
-import re
 from datetime import datetime
-from pathlib import Path
+from . import text_cache, pdf_pool, pdf_worker, span_layout, text_index, retrieval, bm25, hybrid, prompt_builder, response_cache, semantic_cache, summary_service, llm_gateway, single_flight, intent_classifier, structured_output, edit_instruction
 
 load_dotenv()
 
@@ -18,77 +15,27 @@ s3_client = boto3.client(
     region_name=os.environ['AWS_REGION']
 )
 
-# Register downloaded fonts with PyMuPDF
-def register_custom_fonts():
-    """Register custom fonts from fonts directory."""
-    try:
-        fonts_dir = Path(__file__).parent.parent.parent / "fonts"
-        
-        font_mappings = {
-            'DejaVuSerifCondensed': 'DejaVuSerifCondensed.ttf',
-            'DejaVuSerifCondensed-Bold': 'DejaVuSerifCondensed-Bold.ttf',
-            'DejaVuSerifCondensed-BoldItalic': 'DejaVuSerifCondensed-BoldItalic.ttf',
-            'DejaVuSerifCondensed-Italic': 'DejaVuSerifCondensed-Italic.ttf',
-        }
-        
-        for font_name, file_name in font_mappings.items():
-            font_path = fonts_dir / file_name
-            if font_path.exists():
-                try:
-                    fitz.Font(font_name, str(font_path))
-                except Exception:
-                    pass  # Font already registered or skipped
-    except Exception:
-        pass  # Skip if fonts directory doesn't exist
-
-# Register fonts on startup
-register_custom_fonts()
-
-# Font fallback mapping for better font substitution
-FONT_FALLBACK_MAP = {
-    'DejaVuSerifCondensed': 'DejaVuSerifCondensed',  # Try to use the same font
-    'DejaVuSerifCondensed-Bol': 'DejaVuSerifCondensed-Bold',
-    'DejaVuSerifCondensed-BolIta': 'DejaVuSerifCondensed-BoldItalic',
-    'DejaVuSerifCondensed-Ita': 'DejaVuSerifCondensed-Italic',
-    'ind_hi_1_001': 'Helvetica',
-    'XBZar-Bold': 'Helvetica-Bold',
-    'Garuda': 'Helvetica',
-    'Tlwg': 'Helvetica',
-}
-
-def get_best_font_substitute(font_name):
-    """Get the best font substitute for unavailable fonts."""
-    if not font_name:
-        return 'DejaVuSerifCondensed'
-    
-    # Check direct mapping first
-    if font_name in FONT_FALLBACK_MAP:
-        return FONT_FALLBACK_MAP[font_name]
-    
-    # Check if it's a bold variant
-    if 'Bold' in font_name or 'bold' in font_name or '-B' in font_name:
-        return 'DejaVuSerifCondensed-Bold'
-    
-    # Check if it's an italic variant
-    if 'Italic' in font_name or 'Oblique' in font_name or '-I' in font_name or '-O' in font_name:
-        return 'DejaVuSerifCondensed-Italic'
-    
-    # Check if it's bold-italic
-    if ('Bold' in font_name or 'bold' in font_name) and ('Italic' in font_name or 'Oblique' in font_name):
-        return 'DejaVuSerifCondensed-BoldItalic'
-    
-    # Default fallback to DejaVu
-    return 'DejaVuSerifCondensed'
-
-llm = ChatGoogleGenerativeAI(
-    model="gemini-2.0-flash",
-    google_api_key=os.environ["GEMINI_API_KEY"],
-)
 conversation_history = []
 environment = os.environ['ENVIRONMENT']
 
+# Used when RETRIEVAL_MODE=off and the question is answered from a plain prefix of the document
+QA_CONTEXT_MAX_CHARS = int(os.getenv("QA_CONTEXT_MAX_CHARS", "400000"))
+# Handle edits and messages of unclear intent with one structured call (intent + answer or edits)
+COMBINED_MODE = os.getenv("COMBINED_MODE", "true").lower() == "true"
+# When intent needs the LLM, start answering at the same time and drop the answer if it is an edit
+SPECULATIVE_MODE = os.getenv("SPECULATIVE_MODE", "true").lower() == "true"
+
+# Speculative answers: kept, discarded, and the tokens spent on discarded ones
+speculation_stats = {"started": 0, "kept": 0, "discarded": 0, "wasted_prompt_tokens": 0, "wasted_completion_tokens": 0}
+# Explicit edit instructions: applied without the model, or handed to it (ambiguous / text not found)
+explicit_edit_stats = {"direct": 0, "ambiguous": 0, "not_found": 0}
+
 print(f"PDF Service initialized in {environment} environment.")
 
+def _write_file(path: str, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+
 async def save_pdf(file) -> str:
     """
     Save a PDF file either locally or to an S3 bucket based on the environment.
@@ -101,7 +48,9 @@ async def save_pdf(file) -> str:
         file_key = f"pdfs/{file.filename}"
         await file.seek(0)
         
-        s3_client.upload_fileobj(file.file, bucket_name, file_key, ExtraArgs={'ContentType': 'application/pdf'})
+        await asyncio.to_thread(
+            s3_client.upload_fileobj, file.file, bucket_name, file_key, ExtraArgs={'ContentType': 'application/pdf'}
+        )
         file_url = f"https://{bucket_name}.s3.{region}.amazonaws.com/{file_key}"
         print(f"File uploaded to S3 at: {file_url}")
         return file_url
@@ -109,314 +58,547 @@ async def save_pdf(file) -> str:
     else:
         os.makedirs('pdfs', exist_ok=True)
         file_location = f"pdfs/{file.filename}"
-        with open(file_location, "wb") as f:
-            f.write(await file.read())
+        data = await file.read()
+        await asyncio.to_thread(_write_file, file_location, data)
         
         print(f"File saved locally at: {file_location}")
         return file_location
 
-async def extract_text_from_pdf(file_path: str) -> str:
+async def extract_text_from_pdf(file_path: str, max_chars: int = None) -> str:
     """
     Extracts text from a PDF file.
+    Parsing runs in the PDF process pool; repeated questions against the same
+    document version are served from the text cache. See extract_pages.
+    With max_chars only that prefix is read, page by page, and nothing beyond it is held in memory.
+    Concurrent identical calls share one extraction.
     """
-    if environment == "development":
-        document = fitz.open(file_path)
-        text = ""
-        for page in document:
-            text += page.get_text()
-        document.close()
-        return text
-    else:
-        import tempfile
-        import requests
-        
-        temp = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-        response = requests.get(file_path)
-        temp.write(response.content)
-        temp.close()
-        
-        document = fitz.open(temp.name)
-        text = ""
-        for page in document:
-            text += page.get_text()
-        document.close()
-        
-        os.unlink(temp.name)
-        return text
+    return await single_flight.run(("extract_text", file_path, max_chars), _extract_text_from_pdf, file_path, max_chars)
+
+async def _extract_text_from_pdf(file_path: str, max_chars: int = None) -> str:
+    if max_chars is not None:
+        pages = await read_pages(file_path, max_chars=max_chars)
+        return "".join(text for _, text in pages)
+    return "".join(await extract_pages(file_path))
 
-async def answer_question(question: str, pdf_text: str):
+async def extract_pages(file_path: str) -> list:
     """
-    Answers a question based on the provided PDF text using ChatGoogleGenerativeAI.
+    Text of every page of a PDF, in page order. Documents longer than
+    pdf_pool.PARALLEL_EXTRACT_MIN_PAGES are split into page ranges extracted
+    concurrently. Concurrent calls for one file share one extraction.
     """
-    conversation_history.append({"role": "user", "content": question})
+    return await single_flight.run(("extract_pages", file_path), _extract_pages, file_path)
+
+async def _extract_pages(file_path: str) -> list:
+    result = await pdf_pool.run(pdf_worker.extract_pages, file_path, pdf_pool.PARALLEL_EXTRACT_MIN_PAGES)
+    text_cache.remember(file_path, result["digest"])
+    if result["pages"] is not None:
+        return result["pages"]
+
+    local_path = result["local_path"]
+    try:
+        pages = await _extract_pages_parallel(local_path, result["page_count"])
+    finally:
+        if local_path != file_path:
+            os.unlink(local_path)
+
+    await asyncio.to_thread(text_cache.put_pages, result["digest"], pages)
+    return pages
 
-    context = " ".join([entry["content"] for entry in conversation_history[-3:]])
-    message = HumanMessage(
-        content=[
-            {
-                "type": "text",
-                "text": f"Here’s the document summary: {pdf_text}. Now, here's the ongoing conversation: {context}. Please provide a brief, chat-style response to the latest question: '{question}'."
-            }
-        ]
+async def read_pages(file_path: str, max_chars: int = None, max_tokens: int = None, pages=None) -> list:
+    """
+    Return [(page_number, text), ...] for a PDF, stopping once the character or
+    token budget is reached. See pdf_worker.iter_page_text.
+    """
+    key = ("read_pages", file_path, max_chars, max_tokens, tuple(sorted(pages)) if pages is not None else None)
+    result = await single_flight.run(
+        key, pdf_pool.run, pdf_worker.read_pages, file_path, max_chars=max_chars, max_tokens=max_tokens, pages=pages
     )
+    text_cache.remember(file_path, result["digest"])
+    return result["pages"]
 
-    response = llm.invoke([message])
+async def document_digest(file_path: str) -> str:
+    """Content digest (version key) of the file a document currently points at."""
+    # Coalesced, so a burst of questions on one S3 document revalidates the download once
+    digest = await single_flight.run(("digest", file_path), pdf_pool.run, pdf_worker.document_digest, file_path)
+    text_cache.remember(file_path, digest)
+    return digest
 
-    if response and hasattr(response, 'content'):
-        response_text = response.content.strip()
-        conversation_history.append({"role": "assistant", "content": response_text})
+async def retrieve_context(file_path: str, question: str) -> str:
+    """
+    Build the document context for a question: the whole text for short documents,
+    otherwise a list of the RETRIEVAL_TOP_K chunks most relevant to the question, picked by
+    embedding similarity (RETRIEVAL_MODE=dense), BM25 keyword match (bm25) or
+    both fused (hybrid).
+    """
+    if retrieval.RETRIEVAL_MODE == "off":
+        return await extract_text_from_pdf(file_path, max_chars=QA_CONTEXT_MAX_CHARS)
+
+    digest = await document_digest(file_path)
+    if retrieval.RETRIEVAL_MODE in ("bm25", "hybrid"):
+        index = await _load_or_build(file_path, digest, bm25)
+    else:
+        index = await _load_or_build(file_path, digest, retrieval)
+
+    if index.total_chars <= retrieval.RETRIEVAL_FULL_TEXT_CHARS:
+        return await extract_text_from_pdf(file_path)
+
+    if retrieval.RETRIEVAL_MODE == "hybrid":
+        dense_index = retrieval.load_index(digest)
+        if dense_index is None:
+            # Answer lexically now; the dense index is built in the background for later questions
+            _spawn_background(_load_or_build(file_path, digest, retrieval))
+        chunks = await hybrid.search(question, index, dense_index)
+    elif retrieval.RETRIEVAL_MODE == "bm25":
+        chunks = await asyncio.to_thread(bm25.top_chunks, index, question, retrieval.RETRIEVAL_TOP_K)
+    else:
+        chunks = await asyncio.to_thread(retrieval.top_chunks, index, question)
+    return retrieval.context_parts(chunks)
+
+_background_tasks = set()
+
+def _spawn_background(coro):
+    """Run a coroutine without awaiting it, keeping a reference until it finishes."""
+    task = asyncio.ensure_future(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
+async def _load_or_build(file_path: str, digest: str, index_module):
+    """Load a retrieval index (retrieval or bm25 module) for a version, building and storing it on a miss."""
+    index = index_module.load_index(digest)
+    if index is None:
+        index = await single_flight.run(("index", index_module.__name__, digest), _build_index, file_path, digest, index_module)
+    return index
+
+async def _build_index(file_path: str, digest: str, index_module):
+    index = index_module.load_index(digest)
+    if index is None:
+        pages = list(enumerate(await extract_pages(file_path)))
+        index = await asyncio.to_thread(index_module.build_index, pages)
+        await asyncio.to_thread(index_module.store_index, digest, index)
+    return index
+
+async def _summary_context(file_path: str, question: str, document):
+    """The stored summary as context for a broad question about the current version, or None."""
+    if document is None or not document.summary or not summary_service.is_broad_question(question):
+        return None
+    digest = text_cache.known_digest(file_path) or await document_digest(file_path)
+    if document.summary_hash != digest:
+        return None  # summary of an earlier version; the current one is still being summarized
+    return document.summary
+
+async def _extract_pages_parallel(local_path: str, page_count: int) -> list:
+    """Fan page ranges out across the pool and join the results in page order."""
+    parts = await asyncio.gather(*[
+        pdf_pool.run(pdf_worker.extract_page_range, local_path, start, stop)
+        for start, stop in pdf_pool.page_ranges(page_count)
+    ])
+    return [page_text for part in parts for page_text in part]
+
+async def answer_question(question: str, pdf_text: str, version: str = None, bypass_cache: bool = False):
+    """
+    Answers a question based on the provided PDF text using ChatGoogleGenerativeAI.
+    pdf_text may be a single string or a list of context parts (retrieved chunks);
+    the prompt is fitted to the token budget either way.
+    version is the content digest the context came from; answers are cached per version,
+    both exactly and for paraphrased questions. bypass_cache forces a fresh answer.
+    """
+    cache_key, cached = await _cached_answer(question, pdf_text, version, bypass_cache)
+    if cached is not None:
+        return cached
+
+    history = [entry["content"] for entry in conversation_history[-3:]]
+    response_text = await llm_gateway.complete(prompt_builder.build_answer_prompt(question, pdf_text, history))
+
+    if response_text:
+        await _remember_answer(cache_key, version, question, response_text)
         return response_text
     
     return "I'm sorry, I couldn't find an answer to that question."
 
-async def process_user_input(question: str, pdf_text: str, file_path: str, document=None, db=None):
+async def answer_question_stream(question: str, pdf_text: str, version: str = None, bypass_cache: bool = False):
+    """
+    Streaming variant of answer_question: yields the answer text in pieces as the
+    model generates it. A cached answer is yielded whole.
+    """
+    cache_key, cached = await _cached_answer(question, pdf_text, version, bypass_cache)
+    if cached is not None:
+        yield cached
+        return
+
+    history = [entry["content"] for entry in conversation_history[-3:]]
+    parts = []
+    async for text in llm_gateway.stream(prompt_builder.build_answer_prompt(question, pdf_text, history)):
+        parts.append(text)
+        yield text
+
+    response_text = "".join(parts).strip()
+    if response_text:
+        await _remember_answer(cache_key, version, question, response_text)
+    else:
+        yield "I'm sorry, I couldn't find an answer to that question."
+
+async def _cached_answer(question: str, pdf_text, version: str, bypass_cache: bool):
+    """Record the question in the history and return (cache_key, cached answer or None)."""
+    conversation_history.append({"role": "user", "content": question})
+
+    cache_key = _answer_cache_key(question, pdf_text, version)
+    cached = None
+    if not bypass_cache:
+        cached = response_cache.get(cache_key)
+        if cached is None:
+            cached = await asyncio.to_thread(semantic_cache.lookup, version, question)
+    if cached is not None:
+        conversation_history.append({"role": "assistant", "content": cached})
+    return cache_key, cached
+
+def _answer_cache_key(question: str, pdf_text, version: str) -> str:
+    # The history is left out of the cache key: it is shared by every session, so
+    # with it a repeated question or a retry would never match
+    return response_cache.make_key(
+        llm_gateway.model_name(), prompt_builder.build_answer_prompt(question, pdf_text, []), version
+    )
+
+async def _remember_answer(cache_key: str, version: str, question: str, response_text: str):
+    conversation_history.append({"role": "assistant", "content": response_text})
+    response_cache.put(cache_key, response_text)
+    # Embedding the question can take a remote round trip; the answer does not wait for it
+    _spawn_background(asyncio.to_thread(semantic_cache.store, version, question, response_text))
+
+async def process_user_input(question: str, pdf_text: str, file_path: str, document=None, db=None,
+                             bypass_cache: bool = False):
     """
     Process user input - either answer a question or edit the PDF based on instruction.
+    When pdf_text is None the answer context is retrieved from file_path.
+    bypass_cache skips cached answers (the fresh answer is still cached).
     """
-    # Check if this is likely an edit request
-    edit_patterns = [
-        r"change\s+(.+?)\s+to\s+(.+)",
-        r"edit\s+(.+?)\s+to\s+(.+)",
-        r"replace\s+(.+?)\s+with\s+(.+)",
-        r"update\s+(.+?)\s+to\s+(.+)",
-        r"modify\s+(.+?)\s+to\s+(.+)"
-    ]
-    
-    is_edit_request = False
-    for pattern in edit_patterns:
-        if re.search(pattern, question, re.IGNORECASE):
-            is_edit_request = True
-            break
-    
-    # If not clearly an edit request, let's ask the AI to determine intent
-    if not is_edit_request:
-        intent_prompt = f"Determine if this message is asking to edit/change a PDF document or just asking a question: '{question}'. Answer only with 'EDIT' or 'QUESTION'."
-        message = HumanMessage(content=intent_prompt)
-        intent_response = llm.invoke([message])
-        intent_text = intent_response.content.strip().upper()
-        
-        is_edit_request = "EDIT" in intent_text
-    
+    route, intent = await _route(question)
+    if route == ROUTE_PLAN:
+        return await _plan_and_act(question, file_path, document, db, bypass_cache, pdf_text, intent)
+
+    if route == ROUTE_SPECULATE:
+        return await _speculate(question, file_path, document, db, bypass_cache, pdf_text)
+
     # If it's an edit request, process it as such
-    if is_edit_request:
-        result = await edit_pdf(file_path, question)
-        
-        if result["success"]:
-            # Update the document's edited_file_path in the database
-            if document and db:
-                document.edited_file_path = result["edited_file_path"]
-                db.commit()
-            
-            response_text = f"I've edited the PDF as requested. {result['changes']} You can download the updated version."
-            return {
-                "answer": response_text,
-                "is_edit": True,
-                "editedPdfUrl": result["editedPdfUrl"]
-            }
-        else:
-            return {
-                "answer": f"I couldn't make that edit: {result['message']}. Could you be more specific?",
-                "is_edit": False
-            }
+    if route == ROUTE_EDIT:
+        return await _handle_edit(question, file_path, document, db)
     
     # If it's a question, answer it normally
-    answer = await answer_question(question, pdf_text)
+    if pdf_text is None:
+        pdf_text = await _question_context(file_path, question, document)
+    answer = await answer_question(question, pdf_text, text_cache.known_digest(file_path), bypass_cache)
     return {
         "answer": answer,
         "is_edit": False
     }
 
-async def edit_pdf(file_path: str, instruction: str):
+async def stream_user_input(question: str, file_path: str, document=None, db=None, bypass_cache: bool = False):
     """
-    Edit a PDF based on user instruction while preserving exact font and formatting.
-    Returns information about the edited PDF.
+    Streaming variant of process_user_input. Yields (event, data) pairs:
+    ("token", text) for each piece of an answer as it is generated, then one
+    ("done", result) where result is what process_user_input returns.
+    Answers from a combined structured call arrive as a single token.
     """
-    # Handle S3 paths in production
-    if environment == "production" and file_path.startswith("http"):
-        import tempfile
-        import requests
-        
-        temp = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
-        response = requests.get(file_path)
-        temp.write(response.content)
-        temp.close()
-        local_path = temp.name
-    else:
-        local_path = file_path
+    route, intent = await _route(question)
+    if route == ROUTE_PLAN:
+        result = await _plan_and_act(question, file_path, document, db, bypass_cache, leaning=intent)
+        if not result["is_edit"]:
+            yield "token", result["answer"]
+        yield "done", result
+        return
+    if route == ROUTE_SPECULATE:
+        async for event in _speculate_stream(question, file_path, document, db, bypass_cache):
+            yield event
+        return
+    if route == ROUTE_EDIT:
+        yield "done", await _handle_edit(question, file_path, document, db)
+        return
 
-    # Open the PDF
-    doc = fitz.open(local_path)
-    
-    # Extract text to analyze what needs to be changed
-    full_text = ""
-    for page in doc:
-        full_text += page.get_text()
-    
-    # Use AI to understand the edit instruction and identify what to change
-    prompt = f"""
-    I need to edit a PDF document based on this instruction: "{instruction}"
-    
-    Here's the text content of the PDF:
-    {full_text[:2000]}
-    
-    Please identify:
-    1. What text needs to be changed (exact original text)
-    2. What it should be changed to (exact new text)
-    
-    Return your response in this format:
-    Original: [original text]
-    New: [new text]
+    pdf_text = await _question_context(file_path, question, document)
+    parts = []
+    async for text in answer_question_stream(question, pdf_text, text_cache.known_digest(file_path), bypass_cache):
+        parts.append(text)
+        yield "token", text
+    yield "done", {"answer": "".join(parts).strip(), "is_edit": False}
+
+ROUTE_QUESTION = "question"
+ROUTE_EDIT = "edit"
+# One structured call returns the intent together with the answer or the edits
+ROUTE_PLAN = "plan"
+# Intent is asked from the LLM while the answer is already being generated
+ROUTE_SPECULATE = "speculate"
+
+async def _route(question: str) -> tuple:
     """
+    How to handle a message: (route, intent the local classifier leans to). Confident
+    questions are answered directly. In COMBINED_MODE everything else (edits, and
+    messages the local classifier is unsure about) goes through one structured call;
+    otherwise intent is settled by the LLM, speculatively in SPECULATIVE_MODE.
+    """
+    intent, confidence = intent_classifier.classify(question)
+    confident = confidence >= intent_classifier.INTENT_MIN_CONFIDENCE
+    if confident and intent == intent_classifier.QUESTION:
+        return ROUTE_QUESTION, intent
+    if confident and edit_instruction.parse(question):
+        return ROUTE_EDIT, intent  # edit_pdf can usually apply it without the model
+    if COMBINED_MODE:
+        return ROUTE_PLAN, intent
+    if confident:
+        return ROUTE_EDIT, intent
+    if SPECULATIVE_MODE:
+        return ROUTE_SPECULATE, intent
+    return (ROUTE_EDIT if await _llm_intent_is_edit(question) else ROUTE_QUESTION), intent
+
+async def _llm_intent_is_edit(question: str) -> bool:
+    # If not clearly an edit request, let's ask the AI to determine intent
+    intent_prompt = f"Determine if this message is asking to edit/change a PDF document or just asking a question: '{question}'. Answer only with 'EDIT' or 'QUESTION'."
+    # Intent depends on the message alone, so it is cached across documents and versions
+    intent_key = response_cache.make_key(llm_gateway.model_name(), intent_prompt)
+    intent_text = response_cache.get(intent_key)
+    if intent_text is None:
+        intent_text = (await llm_gateway.complete(intent_prompt)).upper()
+        response_cache.put(intent_key, intent_text)
     
-    message = HumanMessage(content=prompt)
-    response = llm.invoke([message])
-    
-    # Parse the AI response
-    response_text = response.content.strip()
+    return "EDIT" in intent_text
+
+async def _plan_and_act(question: str, file_path: str, document=None, db=None, bypass_cache: bool = False,
+                        pdf_text=None, leaning: str = None) -> dict:
+    """
+    Handle a message with one structured call that returns its intent and either the
+    answer or the edits, instead of an intent call followed by an answer or edit call.
+    leaning is the intent the local classifier leans to, when already classified.
+    """
+    if leaning is None:
+        leaning = intent_classifier.classify(question)[0]
+    if pdf_text is None:
+        # Chunks relevant to the message serve both outcomes: they hold the text an edit targets
+        pdf_text = await _question_context(file_path, question, document)
+    version = text_cache.known_digest(file_path)
+
+    # A message the classifier leans towards reading as a question may already be answered
+    cache_key = None
+    if leaning == intent_classifier.QUESTION:
+        cache_key, cached = await _cached_answer(question, pdf_text, version, bypass_cache)
+        if cached is not None:
+            return {"answer": cached, "is_edit": False}
+
+    history = [entry["content"] for entry in conversation_history[-3:]]
+    prompt = prompt_builder.build_plan_prompt(question, pdf_text, history)
+    plan = structured_output.parse_plan(await llm_gateway.complete(prompt, json_output=True))
+
+    if plan is None:
+        print("Warning: unusable structured response; falling back to separate intent and answer calls")
+        if cache_key is not None:
+            conversation_history.pop()  # the fallback records the question itself
+        if SPECULATIVE_MODE:
+            return await _speculate(question, file_path, document, db, bypass_cache, pdf_text)
+        if await _llm_intent_is_edit(question):
+            return await _handle_edit(question, file_path, document, db)
+        return {"answer": await answer_question(question, pdf_text, version, bypass_cache), "is_edit": False}
+
+    if plan["intent"] == structured_output.INTENT_EDIT:
+        # No usable edits in the plan: edit_pdf asks for them with the dedicated edit prompt
+        return await _handle_edit(question, file_path, document, db, edits=plan["edits"] or None)
+
+    if cache_key is None:
+        conversation_history.append({"role": "user", "content": question})
+        cache_key = _answer_cache_key(question, pdf_text, version)
+    await _remember_answer(cache_key, version, question, plan["answer"])
+    return {"answer": plan["answer"], "is_edit": False}
+
+async def _speculate(question: str, file_path: str, document=None, db=None, bypass_cache: bool = False,
+                     pdf_text=None) -> dict:
+    """
+    Ask the LLM for the message's intent and, at the same time, answer it as a question.
+    The answer is kept when the intent is QUESTION and cancelled otherwise, so questions
+    wait for one LLM round trip instead of two.
+    """
+    draft = _new_draft()
+    answering = asyncio.create_task(_draft_answer(draft, question, file_path, document, pdf_text, bypass_cache))
+    try:
+        is_edit = await _llm_intent_is_edit(question)
+    except BaseException:
+        await _discard_draft(draft, answering)
+        raise
+    if is_edit:
+        await _discard_draft(draft, answering)
+        return await _handle_edit(question, file_path, document, db)
+
+    await answering
+    speculation_stats["kept"] += 1
+    return {"answer": await _commit_draft(draft, question), "is_edit": False}
+
+async def _speculate_stream(question: str, file_path: str, document=None, db=None, bypass_cache: bool = False):
+    """Streaming variant of _speculate: answer pieces are held back until the intent is known."""
+    draft = _new_draft()
+    pieces = asyncio.Queue()
+    answering = asyncio.create_task(_draft_answer(draft, question, file_path, document, None, bypass_cache, pieces))
+    try:
+        is_edit = await _llm_intent_is_edit(question)
+    except BaseException:
+        await _discard_draft(draft, answering)
+        raise
+    if is_edit:
+        await _discard_draft(draft, answering)
+        yield "done", await _handle_edit(question, file_path, document, db)
+        return
+
+    try:
+        while (piece := await pieces.get()) is not None:
+            yield "token", piece
+    except BaseException:
+        await _discard_draft(draft, answering)
+        raise
+    await answering
+    speculation_stats["kept"] += 1
+    answer = await _commit_draft(draft, question)
+    if not "".join(draft["parts"]).strip():
+        yield "token", answer
+    yield "done", {"answer": answer, "is_edit": False}
+
+def _new_draft() -> dict:
+    speculation_stats["started"] += 1
+    return {"prompt": None, "parts": [], "cached": False, "cache_key": None, "version": None}
+
+async def _draft_answer(draft: dict, question: str, file_path: str, document, pdf_text, bypass_cache: bool,
+                        pieces: asyncio.Queue = None):
+    """
+    Answer a question without recording it in the history or the caches, filling draft
+    as it goes. With pieces, the answer is streamed into the queue, then None.
+    """
+    try:
+        if pdf_text is None:
+            pdf_text = await _question_context(file_path, question, document)
+        draft["version"] = version = text_cache.known_digest(file_path)
+        draft["cache_key"] = _answer_cache_key(question, pdf_text, version)
+        if not bypass_cache:
+            cached = response_cache.get(draft["cache_key"])
+            if cached is None:
+                cached = await asyncio.to_thread(semantic_cache.lookup, version, question)
+            if cached is not None:
+                draft["cached"] = True
+                draft["parts"].append(cached)
+                if pieces is not None:
+                    pieces.put_nowait(cached)
+                return
+
+        # The history the answer would see once the question is recorded
+        history = [entry["content"] for entry in conversation_history[-2:]] + [question]
+        draft["prompt"] = prompt_builder.build_answer_prompt(question, pdf_text, history)
+        if pieces is None:
+            draft["parts"].append(await llm_gateway.complete(draft["prompt"]))
+            return
+        async for text in llm_gateway.stream(draft["prompt"]):
+            draft["parts"].append(text)
+            pieces.put_nowait(text)
+    finally:
+        if pieces is not None:
+            pieces.put_nowait(None)
+
+async def _discard_draft(draft: dict, answering: asyncio.Task):
+    """Cancel a speculative answer that is no longer wanted and count what it cost."""
+    answering.cancel()
+    try:
+        await answering
+    except asyncio.CancelledError:
+        pass
+    except Exception as e:
+        print(f"Warning: discarded speculative answer failed: {e}")
+    speculation_stats["discarded"] += 1
+    if draft["prompt"] is not None:
+        # Tokens generated before a cancelled call stopped are not reported; only what arrived counts
+        speculation_stats["wasted_prompt_tokens"] += prompt_builder.count_tokens(draft["prompt"])
+        speculation_stats["wasted_completion_tokens"] += prompt_builder.count_tokens("".join(draft["parts"]))
+
+async def _commit_draft(draft: dict, question: str) -> str:
+    """Record a kept speculative answer in the history and caches, as answer_question would."""
+    conversation_history.append({"role": "user", "content": question})
+    response_text = "".join(draft["parts"]).strip()
+    if draft["cached"]:
+        conversation_history.append({"role": "assistant", "content": response_text})
+        return response_text
+    if response_text:
+        await _remember_answer(draft["cache_key"], draft["version"], question, response_text)
+        return response_text
+    return "I'm sorry, I couldn't find an answer to that question."
+
+async def _handle_edit(question: str, file_path: str, document=None, db=None, edits=None) -> dict:
+    result = await edit_pdf(file_path, question, edits)
     
-    # Extract original and new text using regex
-    original_match = re.search(r"Original: (.*?)(?:\n|$)", response_text)
-    new_match = re.search(r"New: (.*?)(?:\n|$)", response_text)
+    if result["success"]:
+        # Update the document's edited_file_path in the database
+        if document and db:
+            document.edited_file_path = result["edited_file_path"]
+            db.commit()
+        # The previous version is superseded; drop its extracted text and layout
+        superseded = text_cache.invalidate(file_path)
+        if superseded:
+            span_layout.discard(superseded)
+            text_index.discard(superseded)
+            retrieval.discard(superseded)
+            bm25.discard(superseded)
+            semantic_cache.discard(superseded)
+        
+        response_text = f"I've edited the PDF as requested. {result['changes']} You can download the updated version."
+        return {
+            "answer": response_text,
+            "is_edit": True,
+            "editedPdfUrl": result["editedPdfUrl"]
+        }
+    else:
+        return {
+            "answer": f"I couldn't make that edit: {result['message']}. Could you be more specific?",
+            "is_edit": False
+        }
+
+async def _question_context(file_path: str, question: str, document=None):
+    """Context for answering a question: the stored summary for broad questions, retrieved chunks otherwise."""
+    pdf_text = await _summary_context(file_path, question, document)
+    if pdf_text is None:
+        pdf_text = await retrieve_context(file_path, question)
+    return pdf_text
+
+async def _explicit_edits(file_path: str, instruction: str):
+    """
+    The edit an explicit instruction ("change X to Y") names, when exactly one reading
+    of it refers to text in the document; None when the model has to work it out.
+    """
+    candidates = edit_instruction.parse(instruction)
+    if not candidates:
+        return None
+    counts = await pdf_pool.run(pdf_worker.count_matches, file_path, [edit["original"] for edit in candidates])
+    found = [edit for edit, count in zip(candidates, counts) if count]
+    if len(found) != 1:
+        explicit_edit_stats["ambiguous" if found else "not_found"] += 1
+        return None
+    explicit_edit_stats["direct"] += 1
+    return found
+
+async def edit_pdf(file_path: str, instruction: str, edits=None):
+    """
+    Edit a PDF based on user instruction while preserving exact font and formatting.
+    edits is an already planned list of {"original", "new"} replacements; without it
+    an explicit instruction is applied as written, and the model is asked what to change
+    only when it is not explicit or its text is not found.
+    Returns information about the edited PDF.
+    """
+    if edits is None:
+        edits = await _explicit_edits(file_path, instruction)
+    if edits is None:
+        # The chunks matching the instruction, retrieved as for questions, so edits
+        # anywhere in a long document get their text into the prompt's token budget
+        document = await retrieve_context(file_path, instruction)
+        
+        # Use AI to understand the edit instruction and identify what to change
+        prompt = prompt_builder.build_edit_prompt(instruction, document)
+        
+        response_text = await llm_gateway.complete(prompt, json_output=True)
+        
+        # Parse the AI response: JSON edits, or the older "Original:/New:" lines
+        edits = structured_output.parse_edits(response_text)
     
-    if not original_match or not new_match:
-        if environment == "production" and file_path.startswith("http"):
-            os.unlink(local_path)
+    if not edits:
         return {"success": False, "message": "Could not identify what to change"}
     
-    original_text = original_match.group(1).strip()
-    new_text = new_match.group(1).strip()
-    
-    # Perform the edit on the PDF with formatting preservation
-    changes_made = False
-    
-    for page_num, page in enumerate(doc):
-        # Use search to find all occurrences with exact positioning
-        text_dict = page.get_text("dict")
-        
-        for block in text_dict.get("blocks", []):
-            if block.get("type") != 0:  # 0 = text block
-                continue
-                
-            for line in block.get("lines", []):
-                for span in line.get("spans", []):
-                    span_text = span.get("text", "")
-                    
-                    # Check if original text is in this span
-                    if original_text not in span_text:
-                        continue
-                    
-                    # Extract complete font information
-                    original_font = span.get("font", "Helv")
-                    font_size = span.get("size", 12)
-                    font_color = span.get("color", 0)
-                    bbox = span.get("bbox", (0, 0, 0, 0))
-                    
-                    # Get best substitute if original font not available
-                    best_substitute = get_best_font_substitute(original_font)
-                    
-                    # Convert color to RGB
-                    text_color = font_color
-                    if isinstance(text_color, int):
-                        if text_color == 0:
-                            rgb_color = (0, 0, 0)  # Black
-                        else:
-                            r = (text_color >> 16) & 0xff
-                            g = (text_color >> 8) & 0xff
-                            b = text_color & 0xff
-                            rgb_color = (r/255, g/255, b/255)
-                    else:
-                        rgb_color = text_color if text_color else (0, 0, 0)
-                    
-                    # Clear the old text area with white rectangle
-                    page.draw_rect(fitz.Rect(bbox), color=None, fill=(1, 1, 1))
-                    
-                    # Calculate baseline position for proper vertical alignment
-                    baseline_y = bbox[3] - (font_size * 0.2)
-                    baseline_point = fitz.Point(bbox[0], baseline_y)
-                    
-                    # Try to insert text with progressively more fallback options
-                    text_inserted = False
-                    
-                    # Attempt 1: Try with original font from font file (if DejaVu)
-                    if original_font == 'DejaVuSerifCondensed':
-                        font_file = Path(__file__).parent.parent.parent / "fonts" / "DejaVuSerifCondensed.ttf"
-                        if font_file.exists():
-                            try:
-                                page.insert_text(
-                                    baseline_point,
-                                    new_text,
-                                    fontname="DejaVuSerifCondensed",
-                                    fontsize=font_size,
-                                    color=rgb_color,
-                                    fontfile=str(font_file)  # Use fontfile parameter with path
-                                )
-                                text_inserted = True
-                            except Exception:
-                                pass  # Font file approach failed
-                    
-                    # Attempt 2: Try with original font name (standard)
-                    if not text_inserted:
-                        try:
-                            page.insert_text(
-                                baseline_point,
-                                new_text,
-                                fontname=original_font,
-                                fontsize=font_size,
-                                color=rgb_color
-                            )
-                            text_inserted = True
-                        except Exception:
-                            pass  # Original font not available
-                    
-                    # Attempt 3: Try with best substitute font
-                    if not text_inserted and best_substitute != original_font:
-                        try:
-                            page.insert_text(
-                                baseline_point,
-                                new_text,
-                                fontname=best_substitute,
-                                fontsize=font_size,
-                                color=rgb_color
-                            )
-                            text_inserted = True
-                        except Exception:
-                            pass  # Substitute also failed
-                    
-                    # Attempt 4: Try Helvetica directly
-                    if not text_inserted and best_substitute != "Helvetica":
-                        try:
-                            page.insert_text(
-                                baseline_point,
-                                new_text,
-                                fontname="Helvetica",
-                                fontsize=font_size,
-                                color=rgb_color
-                            )
-                            text_inserted = True
-                        except Exception:
-                            pass  # Helvetica also failed
-                    
-                    # Attempt 5: Use default font
-                    if not text_inserted:
-                        try:
-                            page.insert_text(
-                                baseline_point,
-                                new_text,
-                                fontsize=font_size,
-                                color=rgb_color
-                            )
-                            text_inserted = True
-                        except Exception as e:
-                            print(f"Warning: Could not insert text with any font method: {e}")
-                    
-                    if text_inserted:
-                        changes_made = True
-
-    if not changes_made:
-        if environment == "production" and file_path.startswith("http"):
-            os.unlink(local_path)
-        return {"success": False, "message": "Could not find the text to replace"}
-    
     # Save the edited PDF with a new name
     timestamp = datetime.now().strftime("%Y%m%d%H%M%S")
     file_name = os.path.basename(file_path) if not file_path.startswith("http") else file_path.split("/")[-1]
@@ -424,35 +606,35 @@ async def edit_pdf(file_path: str, instruction: str):
     
     if environment == "production":
         # Save locally first
-        temp_output = f"/tmp/{new_file_name}"
-        doc.save(temp_output)
-        doc.close()
-        
+        output_path = f"/tmp/{new_file_name}"
+    else:
+        os.makedirs('pdfs', exist_ok=True)
+        output_path = f"pdfs/{new_file_name}"
+
+    # Perform the edit on the PDF with formatting preservation
+    applied = await pdf_pool.run(pdf_worker.apply_edits, file_path, edits, output_path)
+
+    if not applied:
+        return {"success": False, "message": "Could not find the text to replace"}
+    
+    if environment == "production":
         # Upload to S3 (commented out for local development)
         # bucket_name = os.environ['AWS_BUCKET_NAME']
         # file_key = f"pdfs/{new_file_name}"
-        # with open(temp_output, 'rb') as f:
+        # with open(output_path, 'rb') as f:
         #     s3_client.upload_fileobj(f, bucket_name, file_key, ExtraArgs={'ContentType': 'application/pdf'})
         
         # Clean up temporary files
-        os.unlink(local_path)
-        os.unlink(temp_output)
+        os.unlink(output_path)
         
         # edited_pdf_url = f"https://{bucket_name}.s3.amazonaws.com/{file_key}"
-        edited_pdf_url = f"/pdfs/{new_file_name}"
-        edited_pdf_path = temp_output
-    else:
-        # Save locally
-        os.makedirs('pdfs', exist_ok=True)
-        edited_pdf_path = f"pdfs/{new_file_name}"
-        doc.save(edited_pdf_path)
-        doc.close()
-        edited_pdf_url = f"/pdfs/{new_file_name}"
+    edited_pdf_url = f"/pdfs/{new_file_name}"
+    edited_pdf_path = output_path
     
     # Return the path to the new file and a description of changes
     return {
         "success": True, 
         "editedPdfUrl": edited_pdf_url,
         "edited_file_path": edited_pdf_path,
-        "changes": f"Changed '{original_text}' to '{new_text}'."
+        "changes": " ".join(f"Changed '{edit['original']}' to '{edit['new']}'." for edit in applied)
     }
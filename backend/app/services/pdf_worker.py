@@ -0,0 +1,475 @@
+"""
+Blocking PyMuPDF work, executed inside the pdf_pool worker processes.
+
+This module must stay light to import: worker processes are spawned fresh
+and only need fitz and the text cache, not the S3 client or the LLM.
+"""
+import os
+import pymupdf as fitz
+from pathlib import Path
+from . import doc_pool, page_cache, span_layout, text_cache, text_index
+
+environment = os.environ['ENVIRONMENT']
+
+# Register downloaded fonts with PyMuPDF
+def register_custom_fonts():
+    """Register custom fonts from fonts directory."""
+    try:
+        fonts_dir = Path(__file__).parent.parent.parent / "fonts"
+        
+        font_mappings = {
+            'DejaVuSerifCondensed': 'DejaVuSerifCondensed.ttf',
+            'DejaVuSerifCondensed-Bold': 'DejaVuSerifCondensed-Bold.ttf',
+            'DejaVuSerifCondensed-BoldItalic': 'DejaVuSerifCondensed-BoldItalic.ttf',
+            'DejaVuSerifCondensed-Italic': 'DejaVuSerifCondensed-Italic.ttf',
+        }
+        
+        for font_name, file_name in font_mappings.items():
+            font_path = fonts_dir / file_name
+            if font_path.exists():
+                try:
+                    fitz.Font(font_name, str(font_path))
+                except Exception:
+                    pass  # Font already registered or skipped
+    except Exception:
+        pass  # Skip if fonts directory doesn't exist
+
+# Font fallback mapping for better font substitution
+FONT_FALLBACK_MAP = {
+    'DejaVuSerifCondensed': 'DejaVuSerifCondensed',  # Try to use the same font
+    'DejaVuSerifCondensed-Bol': 'DejaVuSerifCondensed-Bold',
+    'DejaVuSerifCondensed-BolIta': 'DejaVuSerifCondensed-BoldItalic',
+    'DejaVuSerifCondensed-Ita': 'DejaVuSerifCondensed-Italic',
+    'ind_hi_1_001': 'Helvetica',
+    'XBZar-Bold': 'Helvetica-Bold',
+    'Garuda': 'Helvetica',
+    'Tlwg': 'Helvetica',
+}
+
+def get_best_font_substitute(font_name):
+    """Get the best font substitute for unavailable fonts."""
+    if not font_name:
+        return 'DejaVuSerifCondensed'
+    
+    # Check direct mapping first
+    if font_name in FONT_FALLBACK_MAP:
+        return FONT_FALLBACK_MAP[font_name]
+    
+    # Check if it's a bold variant
+    if 'Bold' in font_name or 'bold' in font_name or '-B' in font_name:
+        return 'DejaVuSerifCondensed-Bold'
+    
+    # Check if it's an italic variant
+    if 'Italic' in font_name or 'Oblique' in font_name or '-I' in font_name or '-O' in font_name:
+        return 'DejaVuSerifCondensed-Italic'
+    
+    # Check if it's bold-italic
+    if ('Bold' in font_name or 'bold' in font_name) and ('Italic' in font_name or 'Oblique' in font_name):
+        return 'DejaVuSerifCondensed-BoldItalic'
+    
+    # Default fallback to DejaVu
+    return 'DejaVuSerifCondensed'
+
+
+def init_worker():
+    """Process pool initializer: runs once in every worker before it takes jobs."""
+    register_custom_fonts()
+
+def fetch_pdf(file_path: str):
+    """
+    Resolve a stored file path to (digest, source).
+    source is what fitz.open needs: the local path for files on disk,
+    the downloaded bytes for S3 URLs in production. Downloads are revalidated
+    against the pooled copy's ETag, so an unchanged object is not fetched again.
+    """
+    if environment == "development" or not file_path.startswith("http"):
+        return text_cache.digest_file(file_path), file_path
+
+    import requests
+
+    entry = doc_pool.pool.get(file_path)
+    headers = {"If-None-Match": entry.etag} if entry is not None and entry.etag else {}
+    response = requests.get(file_path, headers=headers)
+    if response.status_code == 304 and entry is not None:
+        return entry.digest, entry.source
+
+    digest = text_cache.digest_bytes(response.content)
+    if entry is None or entry.digest != digest:
+        # Pool the download now; the document itself is opened on first use
+        doc_pool.pool.put(file_path, digest, None, response.content, response.headers.get("ETag"))
+    return digest, response.content
+
+def document_digest(file_path: str) -> str:
+    return fetch_pdf(file_path)[0]
+
+def open_pdf(source):
+    """Open a source returned by fetch_pdf."""
+    if isinstance(source, bytes):
+        return fitz.open(stream=source, filetype="pdf")
+    return fitz.open(source)
+
+def open_document(file_path: str, digest: str, source):
+    """
+    Return an open document for this version from the handle pool, opening and
+    pooling it on a miss. Pooled documents are shared: callers must not close them.
+    """
+    entry = doc_pool.pool.get(file_path)
+    if entry is not None and entry.digest == digest:
+        if entry.document is None:
+            entry.document = open_pdf(entry.source)
+        return entry.document
+
+    document = open_pdf(source)
+    doc_pool.pool.put(file_path, digest, document, source)
+    return document
+
+# Rough characters-per-token ratio used for token budgets inside the workers
+CHARS_PER_TOKEN = 4
+
+def page_texts(document, page_nums=None) -> tuple:
+    """
+    Return (texts, page_hashes) for the given pages of an open document (all pages
+    by default), in page order. The text of a page is the text of its span layout,
+    whichever path extracts it. Pages whose content hash was seen before, in this
+    or any other version, are served from the page cache instead of parsed.
+    """
+    if page_nums is None:
+        page_nums = range(document.page_count)
+    page_nums = list(page_nums)
+    hashes = page_cache.page_hashes(document, page_nums)
+    known = page_cache.get_texts(hashes)
+    missing = [(page_num, page_hash) for page_num, page_hash in zip(page_nums, hashes) if page_hash not in known]
+    if missing:
+        layouts = page_layouts(document, [page_num for page_num, _ in missing], [page_hash for _, page_hash in missing])
+        known.update((page_hash, layout.text) for (_, page_hash), layout in zip(missing, layouts))
+    return [known[page_hash] for page_hash in hashes], hashes
+
+def page_layouts(document, page_nums=None, hashes=None) -> list:
+    """
+    Single-page span layouts of the given pages (all by default), in page order.
+    Pages whose content hash has a cached layout are not parsed again; the layouts
+    and texts of the parsed ones are added to the page cache.
+    """
+    if page_nums is None:
+        page_nums = range(document.page_count)
+    page_nums = list(page_nums)
+    if hashes is None:
+        hashes = page_cache.page_hashes(document, page_nums)
+    known = page_cache.get_layouts(hashes)
+    layouts = {}
+    fresh = {}
+    for page_num, page_hash in zip(page_nums, hashes):
+        if page_hash in layouts:
+            continue
+        if page_hash in known:
+            try:
+                layouts[page_hash] = span_layout.SpanLayout.from_bytes(known[page_hash])
+                continue
+            except ValueError:
+                pass  # written by an older format; parse the page again
+        layouts[page_hash] = span_layout.build_page_layout(document[page_num])
+        fresh[page_hash] = layouts[page_hash]
+    page_cache.put_layouts({page_hash: layout.to_bytes() for page_hash, layout in fresh.items()})
+    page_cache.put_texts({page_hash: layout.text for page_hash, layout in fresh.items()})
+    return [layouts[page_hash] for page_hash in hashes]
+
+def extract_pages(file_path: str, split_over_pages: int = None) -> dict:
+    """
+    Extract the text of every page of a stored PDF. Results are cached by the SHA-256 of the PDF bytes.
+
+    Returns {"digest", "pages", "page_count", "local_path"}. When the document has more
+    than split_over_pages pages nothing is extracted ("pages" is None); instead the
+    caller gets a local_path it can hand to extract_page_range from several workers.
+    A local_path that is not file_path is a temporary download the caller must delete.
+    """
+    digest, source = fetch_pdf(file_path)
+    if text_cache.has_text(digest):
+        return {"digest": digest, "pages": list(text_cache.iter_pages(digest)), "page_count": None, "local_path": None}
+
+    document = open_document(file_path, digest, source)
+    page_count = document.page_count
+    if split_over_pages is None or page_count <= split_over_pages:
+        # The same layout serves later edits of this version
+        pages = get_layout(file_path, digest, source).page_texts()
+        text_cache.put_pages(digest, pages)
+        return {"digest": digest, "pages": pages, "page_count": page_count, "local_path": None}
+
+    local_path = source
+    if isinstance(source, bytes):
+        import tempfile
+
+        temp = tempfile.NamedTemporaryFile(delete=False, suffix='.pdf')
+        temp.write(source)
+        temp.close()
+        local_path = temp.name
+    return {"digest": digest, "pages": None, "page_count": page_count, "local_path": local_path}
+
+def extract_page_range(local_path: str, start: int, stop: int) -> list:
+    """
+    Extract the text of pages [start, stop). Each worker opens its own handle on the
+    document. The page layouts parsed on the way land in the page cache, so the
+    document layout is joined from them rather than parsed again.
+    """
+    document = fitz.open(local_path)
+    try:
+        return page_texts(document, range(start, stop))[0]
+    finally:
+        document.close()
+
+def iter_page_text(file_path: str, max_chars: int = None, max_tokens: int = None, pages=None):
+    """
+    Lazily yield (page_number, text) for a stored PDF, 0-based page numbers.
+
+    Reads from the text cache or the span layout when the version is already
+    extracted, otherwise parses one page at a time. Stops as soon as max_chars / max_tokens is
+    reached; the last page yielded is truncated to fit. pages restricts the
+    walk to a set of page numbers.
+    """
+    digest, source = fetch_pdf(file_path)
+    yield from _iter_page_text(file_path, digest, source, max_chars, max_tokens, pages)
+
+def _iter_page_text(file_path: str, digest: str, source, max_chars, max_tokens, pages):
+    budget = None
+    if max_chars is not None:
+        budget = max_chars
+    if max_tokens is not None:
+        budget = min(budget, max_tokens * CHARS_PER_TOKEN) if budget is not None else max_tokens * CHARS_PER_TOKEN
+    wanted = set(pages) if pages is not None else None
+
+    document = None
+    if text_cache.has_text(digest):
+        page_iter = enumerate(text_cache.iter_pages(digest))
+    elif (layout := span_layout.load(digest)) is not None:
+        page_iter = enumerate(layout.page_texts())
+    else:
+        document = open_document(file_path, digest, source)
+        page_iter = ((page_num, page_texts(document, [page_num])[0][0]) for page_num in range(document.page_count)
+                     if wanted is None or page_num in wanted)
+
+    # A cold walk over the whole document that never hit the budget is a full extraction; keep it
+    seen = [] if document is not None and wanted is None else None
+    for page_num, text in page_iter:
+        if wanted is not None and page_num not in wanted:
+            continue
+        if seen is not None:
+            seen.append(text)
+        if budget is not None:
+            if budget <= 0:
+                return
+            if len(text) > budget:
+                seen = None
+            text = text[:budget]
+            budget -= len(text)
+        yield page_num, text
+    if seen is not None:
+        text_cache.put_pages(digest, seen)
+
+def read_pages(file_path: str, max_chars: int = None, max_tokens: int = None, pages=None) -> dict:
+    """
+    Pool entry point for iter_page_text: only the pages within budget cross the process boundary.
+    Returns {"digest", "pages": [(page_number, text), ...]}.
+    """
+    digest, source = fetch_pdf(file_path)
+    return {"digest": digest, "pages": list(_iter_page_text(file_path, digest, source, max_chars, max_tokens, pages))}
+
+def ingest_file(file_path: str) -> dict:
+    """
+    Run every preprocessing step for one document version and return its metadata.
+    Each step populates a cache that the request path reads from. Large documents
+    have their pages parsed in parallel first (see ingest_service), so the layout
+    here is joined from the page cache.
+    """
+    digest, source = fetch_pdf(file_path)
+
+    # One dict parse per page feeds both the edit engine and the page text
+    layout = get_layout(file_path, digest, source)
+    if not text_cache.has_text(digest):
+        text_cache.put_pages(digest, layout.page_texts())
+    get_index(digest, layout)
+
+    return {"digest": digest, "page_count": layout.page_count, "span_count": layout.span_count}
+
+def get_layout(file_path: str, digest: str, source):
+    """Span layout for a document version: from the layout cache, or built (and cached) from the pooled document."""
+    layout = span_layout.load(digest)
+    if layout is None:
+        layout = span_layout.join_pages(page_layouts(open_document(file_path, digest, source)))
+        span_layout.save(digest, layout)
+    return layout
+
+def get_index(digest: str, layout):
+    """Trigram index over a layout's span text: from the index cache, or built (and cached) now."""
+    index = text_index.load(digest, layout.text)
+    if index is None:
+        index = text_index.TrigramIndex.build(layout.text)
+        text_index.save(digest, index)
+    return index
+
+def count_matches(file_path: str, needles) -> list:
+    """For each needle, how many places apply_edits could replace it in (0 when absent)."""
+    digest, source = fetch_pdf(file_path)
+    layout = get_layout(file_path, digest, source)
+    index = get_index(digest, layout)
+    return [len(layout.span_ranges(index.find(needle), len(needle))) for needle in needles]
+
+def apply_edit(file_path: str, original_text: str, new_text: str, output_path: str) -> bool:
+    """
+    Replace every span containing original_text with new_text, preserving the
+    span's font, size and colour, and save the result to output_path.
+    Returns False (and writes nothing) when the text was not found.
+    """
+    return bool(apply_edits(file_path, [{"original": original_text, "new": new_text}], output_path))
+
+def apply_edits(file_path: str, edits, output_path: str) -> list:
+    """
+    Apply several {"original", "new"} replacements (see apply_edit) to one copy of
+    the document and save it once to output_path. Every edit is located in the
+    unedited version. Returns the edits that were applied; nothing is written when none was.
+    """
+    digest, source = fetch_pdf(file_path)
+
+    # Locate target spans through the text index instead of walking every page's dict tree
+    layout = get_layout(file_path, digest, source)
+    index = get_index(digest, layout)
+    planned = []
+    for edit in edits:
+        matches = layout.span_ranges(index.find(edit["original"]), len(edit["original"]))
+        if matches:
+            planned.append((edit, matches))
+    if not planned:
+        return []
+
+    # The edit mutates the document, so take it out of the pool rather than sharing it
+    doc = doc_pool.pool.take(file_path, digest) or open_pdf(source)
+
+    # Perform the edit on the PDF with formatting preservation
+    applied = []
+    for edit, matches in planned:
+        changes_made = False
+        for first, last in matches:
+            span = layout.span(first)
+            # Text split across spans: the rest of the match is cleared and the new text drawn in the first span's style
+            covered = [layout.span(span_index) for span_index in range(first + 1, last + 1)]
+            if _replace_span(doc[span.page], span, edit["new"], covered):
+                changes_made = True
+        if changes_made:
+            applied.append(edit)
+
+    if applied:
+        doc.save(output_path)
+    doc.close()
+    return applied
+
+def _replace_span(page, span, new_text: str, covered=()) -> bool:
+    """
+    Overwrite one span of a page with new_text in the span's own font, size and colour,
+    falling back through substitute fonts. Spans in covered are blanked as well.
+    Returns whether the text was inserted.
+    """
+    # Extract complete font information
+    original_font = span.font
+    font_size = span.size
+    font_color = span.color
+    bbox = span.bbox
+
+    # Get best substitute if original font not available
+    best_substitute = get_best_font_substitute(original_font)
+
+    # Convert color to RGB
+    text_color = font_color
+    if isinstance(text_color, int):
+        if text_color == 0:
+            rgb_color = (0, 0, 0)  # Black
+        else:
+            r = (text_color >> 16) & 0xff
+            g = (text_color >> 8) & 0xff
+            b = text_color & 0xff
+            rgb_color = (r/255, g/255, b/255)
+    else:
+        rgb_color = text_color if text_color else (0, 0, 0)
+
+    # Clear the old text area with white rectangle
+    page.draw_rect(fitz.Rect(bbox), color=None, fill=(1, 1, 1))
+    for other in covered:
+        page.draw_rect(fitz.Rect(other.bbox), color=None, fill=(1, 1, 1))
+
+    # Calculate baseline position for proper vertical alignment
+    baseline_y = bbox[3] - (font_size * 0.2)
+    baseline_point = fitz.Point(bbox[0], baseline_y)
+
+    # Try to insert text with progressively more fallback options
+    text_inserted = False
+
+    # Attempt 1: Try with original font from font file (if DejaVu)
+    if original_font == 'DejaVuSerifCondensed':
+        font_file = Path(__file__).parent.parent.parent / "fonts" / "DejaVuSerifCondensed.ttf"
+        if font_file.exists():
+            try:
+                page.insert_text(
+                    baseline_point,
+                    new_text,
+                    fontname="DejaVuSerifCondensed",
+                    fontsize=font_size,
+                    color=rgb_color,
+                    fontfile=str(font_file)  # Use fontfile parameter with path
+                )
+                text_inserted = True
+            except Exception:
+                pass  # Font file approach failed
+
+    # Attempt 2: Try with original font name (standard)
+    if not text_inserted:
+        try:
+            page.insert_text(
+                baseline_point,
+                new_text,
+                fontname=original_font,
+                fontsize=font_size,
+                color=rgb_color
+            )
+            text_inserted = True
+        except Exception:
+            pass  # Original font not available
+
+    # Attempt 3: Try with best substitute font
+    if not text_inserted and best_substitute != original_font:
+        try:
+            page.insert_text(
+                baseline_point,
+                new_text,
+                fontname=best_substitute,
+                fontsize=font_size,
+                color=rgb_color
+            )
+            text_inserted = True
+        except Exception:
+            pass  # Substitute also failed
+
+    # Attempt 4: Try Helvetica directly
+    if not text_inserted and best_substitute != "Helvetica":
+        try:
+            page.insert_text(
+                baseline_point,
+                new_text,
+                fontname="Helvetica",
+                fontsize=font_size,
+                color=rgb_color
+            )
+            text_inserted = True
+        except Exception:
+            pass  # Helvetica also failed
+
+    # Attempt 5: Use default font
+    if not text_inserted:
+        try:
+            page.insert_text(
+                baseline_point,
+                new_text,
+                fontsize=font_size,
+                color=rgb_color
+            )
+            text_inserted = True
+        except Exception as e:
+            print(f"Warning: Could not insert text with any font method: {e}")
+    
+    return text_inserted
@@ -0,0 +1,192 @@
+"""
+Token-budgeted prompt assembly.
+
+Every prompt gets a fixed token budget (PROMPT_MAX_TOKENS) split between the
+question, the conversation history and the document context, so prompt size,
+and with it LLM latency and cost, stays predictable whatever the document
+length. Tokens are counted with tiktoken; counts of chunk-sized strings
+(retrieved chunks recur across questions) are memoized by digest, so the memo
+never keeps whole documents or prompts alive. load_encoding() is called once
+at startup, off the event loop, since tiktoken may download its encoding file.
+"""
+import hashlib
+import os
+from collections import OrderedDict
+from threading import Lock
+
+PROMPT_MAX_TOKENS = int(os.getenv("PROMPT_MAX_TOKENS", "8000"))
+QUESTION_MAX_TOKENS = int(os.getenv("QUESTION_MAX_TOKENS", "500"))
+HISTORY_MAX_TOKENS = int(os.getenv("HISTORY_MAX_TOKENS", "1000"))
+EDIT_PROMPT_MAX_TOKENS = int(os.getenv("EDIT_PROMPT_MAX_TOKENS", "3000"))
+TOKEN_ENCODING = os.getenv("TOKEN_ENCODING", "cl100k_base")
+# Used when tiktoken or its encoding files are unavailable (e.g. air-gapped hosts)
+FALLBACK_CHARS_PER_TOKEN = 4
+# Token counts remembered, and the longest string whose count is remembered (a few chunks)
+TOKEN_COUNT_SLOTS = int(os.getenv("TOKEN_COUNT_SLOTS", "8192"))
+TOKEN_COUNT_MAX_CHARS = int(os.getenv("TOKEN_COUNT_MAX_CHARS", "4000"))
+
+# Room reserved for the fixed wording of each template
+_TEMPLATE_TOKENS = 60
+
+_encoding = None
+_encoding_failed = False
+_encoding_lock = Lock()
+
+_counts = OrderedDict()  # text digest -> token count
+_counts_lock = Lock()
+
+
+def load_encoding():
+    """Load the tiktoken encoding; blocking, so call it from a worker thread."""
+    global _encoding, _encoding_failed
+    with _encoding_lock:
+        if _encoding is None and not _encoding_failed:
+            try:
+                import tiktoken
+
+                _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+            except Exception as e:
+                print(f"Warning: tiktoken unavailable ({e}); estimating tokens from characters")
+                _encoding_failed = True
+    return _encoding
+
+
+def _get_encoding():
+    if _encoding is None and not _encoding_failed:
+        # Only scripts and tests get here; the app loads the encoding at startup
+        return load_encoding()
+    return _encoding
+
+
+def _count(text: str) -> int:
+    encoding = _get_encoding()
+    if encoding is None:
+        return -(-len(text) // FALLBACK_CHARS_PER_TOKEN)
+    return len(encoding.encode(text, disallowed_special=()))
+
+
+def count_tokens(text: str) -> int:
+    if len(text) > TOKEN_COUNT_MAX_CHARS:
+        return _count(text)
+    key = hashlib.blake2b(text.encode("utf-8", "surrogatepass"), digest_size=16).digest()
+    with _counts_lock:
+        count = _counts.get(key)
+        if count is not None:
+            _counts.move_to_end(key)
+            return count
+    count = _count(text)
+    with _counts_lock:
+        _counts[key] = count
+        while len(_counts) > TOKEN_COUNT_SLOTS:
+            _counts.popitem(last=False)
+    return count
+
+
+def truncate_to_tokens(text: str, max_tokens: int) -> str:
+    """Longest prefix of text that fits in max_tokens."""
+    if max_tokens <= 0:
+        return ""
+    if count_tokens(text) <= max_tokens:
+        return text
+    encoding = _get_encoding()
+    if encoding is None:
+        return text[:max_tokens * FALLBACK_CHARS_PER_TOKEN]
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens])
+
+
+def fit_parts(parts, max_tokens: int, separator: str = "\n\n") -> str:
+    """
+    Join as many parts as fit in max_tokens, in order. The first part that does not
+    fit whole is truncated, everything after it dropped.
+    """
+    if isinstance(parts, str):
+        return truncate_to_tokens(parts, max_tokens)
+    kept = []
+    remaining = max_tokens
+    separator_tokens = count_tokens(separator)
+    for part in parts:
+        cost = count_tokens(part) + (separator_tokens if kept else 0)
+        if cost <= remaining:
+            kept.append(part)
+            remaining -= cost
+            continue
+        tail = truncate_to_tokens(part, remaining - (separator_tokens if kept else 0))
+        if tail:
+            kept.append(tail)
+        break
+    return separator.join(kept)
+
+
+def fit_history(entries, max_tokens: int) -> str:
+    """Most recent history entries that fit in max_tokens, oldest first."""
+    kept = []
+    remaining = max_tokens
+    for entry in reversed(entries):
+        cost = count_tokens(entry) + 1
+        if cost > remaining:
+            break
+        kept.append(entry)
+        remaining -= cost
+    return " ".join(reversed(kept))
+
+
+def build_answer_prompt(question: str, document, history) -> str:
+    """
+    Prompt for answering a question. document is the context text or a list of
+    context parts (retrieved chunks); history is a list of recent message strings.
+    """
+    question = truncate_to_tokens(question, QUESTION_MAX_TOKENS)
+    history_text = fit_history(history, HISTORY_MAX_TOKENS)
+    document_budget = PROMPT_MAX_TOKENS - _TEMPLATE_TOKENS - count_tokens(question) - count_tokens(history_text)
+    document_text = fit_parts(document, document_budget)
+    return (
+        f"Here’s the document summary: {document_text}. Now, here's the ongoing conversation: {history_text}. "
+        f"Please provide a brief, chat-style response to the latest question: '{question}'."
+    )
+
+
+def build_edit_prompt(instruction: str, document) -> str:
+    """Prompt asking the model for the exact original and replacement text of each edit, as JSON."""
+    instruction = truncate_to_tokens(instruction, QUESTION_MAX_TOKENS)
+    document_budget = EDIT_PROMPT_MAX_TOKENS - 2 * _TEMPLATE_TOKENS - count_tokens(instruction)
+    document_text = fit_parts(document, document_budget)
+    return f"""
+    I need to edit a PDF document based on this instruction: "{instruction}"
+
+    Here's the text content of the PDF:
+    {document_text}
+
+    Please identify:
+    1. What text needs to be changed (exact original text, copied from the document)
+    2. What it should be changed to (exact new text)
+
+    Return only JSON in this format, with one entry per change:
+    {{"edits": [{{"original": "<original text>", "new": "<new text>"}}]}}
+    """
+
+
+def build_plan_prompt(message: str, document, history) -> str:
+    """
+    Prompt for one structured call that both classifies a message and acts on it:
+    the model returns JSON with the intent and either an answer or the edits to make.
+    """
+    message = truncate_to_tokens(message, QUESTION_MAX_TOKENS)
+    history_text = fit_history(history, HISTORY_MAX_TOKENS)
+    document_budget = (PROMPT_MAX_TOKENS - 3 * _TEMPLATE_TOKENS - count_tokens(message)
+                       - count_tokens(history_text))
+    document_text = fit_parts(document, document_budget)
+    return f"""
+    You are helping a user with a PDF document. Here's the relevant document content:
+    {document_text}
+
+    Ongoing conversation: {history_text}
+
+    Latest message: "{message}"
+
+    Decide whether the message asks to edit/change the document or asks a question about it.
+    - For a question, give a brief, chat-style answer.
+    - For an edit, list every change as the exact original text copied from the document and the exact new text.
+
+    Return only JSON matching this schema:
+    {{"intent": "EDIT" or "QUESTION", "answer": "<answer, empty for edits>", "edits": [{{"original": "<text>", "new": "<text>"}}]}}
+    """
@@ -1,47 +1,28 @@
 import os
-import requests
 from dotenv import load_dotenv
+from . import llm_gateway
 
 # Load environment variables from .env file
 load_dotenv()
 
-# Get the OpenAI API key from the environment variable
-API_KEY = os.getenv('OPENAI_API_KEY')
-API_URL = 'https://api.openai.com/v1/chat/completions'
+# Fallback providers, hedging and circuit breaking are configured on the gateway
+QA_PROVIDER = os.getenv("QA_PROVIDER", "openai")
 
 async def answer_question(question: str, pdf_text: str):
-    # Prepare the messages for the OpenAI API
-    messages = [
-        {"role": "system", "content": "You are a helpful assistant."},
-        {"role": "user", "content": f"Context: {pdf_text}\n\nQuestion: {question}"}
-    ]
-
-    # Set up the headers for the API request
-    headers = {
-        'Authorization': f'Bearer {API_KEY}',
-        'Content-Type': 'application/json',
-    }
-
-    # Prepare the data payload for the API request
-    data = {
-        "model": "gpt-3.5-turbo",
-        "messages": messages,
-        "max_tokens": 150,  # Adjust as needed for longer responses
-        "temperature": 0.7,  # Adjust for creativity; lower values are more deterministic
-    }
+    # The request runs through the async gateway (OPENAI_API_KEY from the environment for openai)
+    prompt = f"Context: {pdf_text}\n\nQuestion: {question}"
 
     try:
-        # Make the API request
-        response = requests.post(API_URL, headers=headers, json=data)
-
-        # Check if the response was successful
-        if response.status_code == 200:
-            answer = response.json()['choices'][0]['message']['content']
-            return answer.strip()
-        else:
-            print("Error:", response.status_code, response.text)
-            return "Sorry, I couldn't process your request."
-    
+        return await llm_gateway.complete(
+            prompt,
+            provider=QA_PROVIDER,
+            system="You are a helpful assistant.",
+            max_tokens=150,  # Adjust as needed for longer responses
+            temperature=0.7,  # Adjust for creativity; lower values are more deterministic
+        )
+    except (llm_gateway.LLMError, llm_gateway.LLMTimeoutError) as e:
+        print("Error:", str(e))
+        return "Sorry, I couldn't process your request."
     except Exception as e:
         print("Exception occurred:", str(e))
         return "An error occurred while processing your request."
\ No newline at end of file
@@ -0,0 +1,108 @@
+"""
+Exact-match cache of LLM responses.
+
+Keyed by (model, normalized prompt, document version digest): a repeated
+question against the same version, a page reload or a client retry returns
+the stored response instead of paying for another LLM call, and an edit (new
+digest) can never be answered from the previous version. Entries live in an
+in-memory LRU and, optionally, on disk next to the other caches; both tiers
+expire entries after RESPONSE_CACHE_TTL seconds.
+"""
+import hashlib
+import json
+import os
+import time
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock
+
+RESPONSE_CACHE_ENABLED = os.getenv("RESPONSE_CACHE_ENABLED", "true").lower() == "true"
+RESPONSE_CACHE_SLOTS = int(os.getenv("RESPONSE_CACHE_SLOTS", "1024"))
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+RESPONSE_CACHE_DISK = os.getenv("RESPONSE_CACHE_DISK", "true").lower() == "true"
+RESPONSE_CACHE_DIR = Path(os.getenv("RESPONSE_CACHE_DIR", "cache/responses"))
+
+stats = {"hits": 0, "disk_hits": 0, "misses": 0, "expired": 0, "stores": 0}
+
+_memory = OrderedDict()  # key -> (stored_at, response)
+_memory_lock = Lock()
+
+
+def normalize(prompt: str) -> str:
+    """Unicode-normalize and collapse whitespace, so formatting-only differences share an entry."""
+    return " ".join(unicodedata.normalize("NFKC", prompt).split())
+
+
+def make_key(model: str, prompt: str, version: str = None) -> str:
+    material = json.dumps([model, normalize(prompt), version or ""], ensure_ascii=False)
+    return hashlib.sha256(material.encode("utf-8")).hexdigest()
+
+
+def _entry_path(key: str) -> Path:
+    return RESPONSE_CACHE_DIR / key[:2] / f"{key}.json"
+
+
+def get(key: str):
+    """Cached response for a key, or None on a miss or an expired entry."""
+    if not RESPONSE_CACHE_ENABLED:
+        return None
+    now = time.time()
+    with _memory_lock:
+        entry = _memory.get(key)
+        if entry is not None:
+            if now - entry[0] <= RESPONSE_CACHE_TTL:
+                _memory.move_to_end(key)
+                stats["hits"] += 1
+                return entry[1]
+            del _memory[key]
+            stats["expired"] += 1
+
+    if RESPONSE_CACHE_DISK:
+        try:
+            stored = json.loads(_entry_path(key).read_text(encoding="utf-8"))
+        except (FileNotFoundError, OSError, ValueError):
+            stored = None
+        if stored is not None:
+            if now - stored["stored_at"] <= RESPONSE_CACHE_TTL:
+                _remember(key, stored["stored_at"], stored["response"])
+                stats["disk_hits"] += 1
+                return stored["response"]
+            stats["expired"] += 1
+            _unlink(key)
+
+    stats["misses"] += 1
+    return None
+
+
+def put(key: str, response: str):
+    if not RESPONSE_CACHE_ENABLED:
+        return
+    stored_at = time.time()
+    _remember(key, stored_at, response)
+    stats["stores"] += 1
+    if not RESPONSE_CACHE_DISK:
+        return
+    entry = _entry_path(key)
+    try:
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        tmp = entry.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_text(json.dumps({"stored_at": stored_at, "response": response}), encoding="utf-8")
+        os.replace(tmp, entry)
+    except OSError as e:
+        print(f"Warning: could not write response cache entry {key}: {e}")
+
+
+def _remember(key: str, stored_at: float, response: str):
+    with _memory_lock:
+        _memory[key] = (stored_at, response)
+        _memory.move_to_end(key)
+        while len(_memory) > RESPONSE_CACHE_SLOTS:
+            _memory.popitem(last=False)
+
+
+def _unlink(key: str):
+    try:
+        _entry_path(key).unlink()
+    except OSError:
+        pass
@@ -0,0 +1,283 @@
+"""
+Chunk retrieval for question answering.
+
+Instead of sending the whole document with every question, page text is
+split into overlapping chunks, embedded once per document version, and only
+the top-k chunks most similar to the question are put in the prompt.
+Embedders are pluggable: a deterministic local hashing embedder (no model,
+no network; used by default and in tests) and Gemini embeddings.
+"""
+import hashlib
+import json
+import os
+import re
+from collections import OrderedDict
+from pathlib import Path
+from threading import Lock, get_ident
+
+import numpy as np
+
+try:
+    import faiss
+except ImportError:  # pragma: no cover - faiss-cpu is in requirements, numpy search is the fallback
+    faiss = None
+
+# "dense" retrieves chunks by embedding similarity, "bm25" by keyword match (see bm25.py),
+# "hybrid" fuses both (see hybrid.py); "off" sends a plain prefix of the document
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "dense")
+RETRIEVAL_EMBEDDER = os.getenv("RETRIEVAL_EMBEDDER", "hashing")
+RETRIEVAL_TOP_K = int(os.getenv("RETRIEVAL_TOP_K", "6"))
+CHUNK_CHARS = int(os.getenv("CHUNK_CHARS", "1200"))
+CHUNK_OVERLAP = int(os.getenv("CHUNK_OVERLAP", "200"))
+# Documents shorter than this are sent whole; retrieval would only drop context
+RETRIEVAL_FULL_TEXT_CHARS = int(os.getenv("RETRIEVAL_FULL_TEXT_CHARS", "12000"))
+CHUNK_CACHE_DIR = Path(os.getenv("CHUNK_CACHE_DIR", "cache/chunks"))
+CHUNK_MEMORY_SLOTS = int(os.getenv("CHUNK_MEMORY_SLOTS", "32"))
+# Chunk vectors remembered by chunk text, so a new version re-embeds only the chunks an edit changed
+CHUNK_VECTOR_SLOTS = int(os.getenv("CHUNK_VECTOR_SLOTS", "8192"))
+
+_TOKEN_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class Chunk:
+    __slots__ = ("page", "text")
+
+    def __init__(self, page: int, text: str):
+        self.page = page
+        self.text = text
+
+
+def chunk_pages(pages, chunk_chars: int = CHUNK_CHARS, overlap: int = CHUNK_OVERLAP) -> list:
+    """
+    Split [(page_number, text), ...] into overlapping chunks that never cross a page.
+    Chunk ends are moved back to the nearest whitespace so words are not cut.
+    """
+    chunks = []
+    step_floor = max(1, chunk_chars - overlap)
+    for page_num, text in pages:
+        text = text.strip()
+        start = 0
+        while start < len(text):
+            end = min(start + chunk_chars, len(text))
+            if end < len(text):
+                cut = text.rfind(" ", start + step_floor, end)
+                if cut != -1:
+                    end = cut
+            chunks.append(Chunk(page_num, text[start:end].strip()))
+            if end >= len(text):
+                break
+            start = max(end - overlap, start + 1)
+    return [chunk for chunk in chunks if chunk.text]
+
+
+def tokenize(text: str) -> list:
+    return _TOKEN_RE.findall(text.lower())
+
+
+class HashingEmbedder:
+    """
+    Feature-hashing embedder over word unigrams and bigrams.
+    Deterministic across processes and machines, needs no model download.
+    """
+    name = "hashing"
+
+    def __init__(self, dim: int = 512):
+        self.dim = dim
+
+    def _bucket(self, feature: str):
+        digest = hashlib.blake2b(feature.encode("utf-8"), digest_size=8).digest()
+        value = int.from_bytes(digest, "little")
+        return value % self.dim, 1.0 if (value >> 63) & 1 else -1.0
+
+    def embed(self, texts) -> np.ndarray:
+        vectors = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for row, text in enumerate(texts):
+            tokens = tokenize(text)
+            features = tokens + [f"{a} {b}" for a, b in zip(tokens, tokens[1:])]
+            for feature in features:
+                bucket, sign = self._bucket(feature)
+                vectors[row, bucket] += sign
+        return _normalize(vectors)
+
+
+class GeminiEmbedder:
+    """Gemini text embeddings through langchain; needs GEMINI_API_KEY and network access."""
+    name = "gemini"
+
+    def __init__(self):
+        from langchain_google_genai import GoogleGenerativeAIEmbeddings
+
+        self._client = GoogleGenerativeAIEmbeddings(
+            model="models/text-embedding-004",
+            google_api_key=os.environ["GEMINI_API_KEY"],
+        )
+
+    def embed(self, texts) -> np.ndarray:
+        return _normalize(np.asarray(self._client.embed_documents(list(texts)), dtype=np.float32))
+
+
+_EMBEDDERS = {"hashing": HashingEmbedder, "gemini": GeminiEmbedder}
+_embedder = None
+
+
+def make_embedder(name: str):
+    """A new embedder by name ("hashing" or "gemini")."""
+    return _EMBEDDERS[name]()
+
+
+def get_embedder():
+    global _embedder
+    if _embedder is None:
+        _embedder = make_embedder(RETRIEVAL_EMBEDDER)
+    return _embedder
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class ChunkIndex:
+    """Embedded chunks of one document version, searchable by cosine similarity."""
+
+    def __init__(self, chunks: list, vectors: np.ndarray, total_chars: int):
+        self.chunks = chunks
+        self.vectors = np.ascontiguousarray(vectors, dtype=np.float32)
+        self.total_chars = total_chars
+        self._faiss = None
+        if faiss is not None and len(chunks):
+            self._faiss = faiss.IndexFlatIP(self.vectors.shape[1])
+            self._faiss.add(self.vectors)
+
+    def search(self, query_vector: np.ndarray, k: int) -> list:
+        """Return [(chunk_position, score), ...] best first."""
+        k = min(k, len(self.chunks))
+        if k == 0:
+            return []
+        query = np.ascontiguousarray(query_vector.reshape(1, -1), dtype=np.float32)
+        if self._faiss is not None:
+            scores, positions = self._faiss.search(query, k)
+            return [(int(p), float(s)) for p, s in zip(positions[0], scores[0]) if p != -1]
+        scores = self.vectors @ query[0]
+        best = np.argsort(-scores)[:k]
+        return [(int(p), float(scores[p])) for p in best]
+
+    def save(self, path_prefix: Path):
+        path_prefix.parent.mkdir(parents=True, exist_ok=True)
+        meta = {"total_chars": self.total_chars, "chunks": [[chunk.page, chunk.text] for chunk in self.chunks]}
+        # Per thread as well as per process: ingest and request threads can build the same version
+        tmp = Path(f"{path_prefix}.{os.getpid()}.{get_ident()}.tmp")
+        with open(tmp, "wb") as f:
+            np.save(f, self.vectors)
+        os.replace(tmp, Path(f"{path_prefix}.npy"))
+        # The metadata file is written last: its presence marks a complete entry
+        tmp.write_text(json.dumps(meta), encoding="utf-8")
+        os.replace(tmp, Path(f"{path_prefix}.json"))
+
+    @classmethod
+    def load(cls, path_prefix: Path):
+        meta = json.loads(Path(f"{path_prefix}.json").read_text(encoding="utf-8"))
+        vectors = np.load(Path(f"{path_prefix}.npy"))
+        return cls([Chunk(page, text) for page, text in meta["chunks"]], vectors, meta["total_chars"])
+
+
+# Shared by the event loop's helper threads and the ingest workers
+_memory = OrderedDict()
+_memory_lock = Lock()
+_save_lock = Lock()
+
+
+def _path_prefix(digest: str, embedder) -> Path:
+    return CHUNK_CACHE_DIR / digest[:2] / f"{digest}.{embedder.name}"
+
+
+_vectors = OrderedDict()
+
+
+def build_index(pages, embedder=None) -> ChunkIndex:
+    embedder = embedder or get_embedder()
+    chunks = chunk_pages(pages)
+    total_chars = sum(len(text) for _, text in pages)
+    if not chunks:
+        return ChunkIndex([], np.zeros((0, 1), dtype=np.float32), total_chars)
+    return ChunkIndex(chunks, _embed_chunks(embedder, [chunk.text for chunk in chunks]), total_chars)
+
+
+def _embed_chunks(embedder, texts: list) -> np.ndarray:
+    """Embed chunk texts, reusing the vectors of chunks embedded for an earlier version."""
+    keys = [(embedder.name, hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()) for text in texts]
+    with _memory_lock:
+        known = [_vectors.get(key) for key in keys]
+    missing = [position for position, vector in enumerate(known) if vector is None]
+    if missing:
+        fresh = embedder.embed([texts[position] for position in missing])
+        for row, position in enumerate(missing):
+            known[position] = fresh[row]
+    with _memory_lock:
+        for key, vector in zip(keys, known):
+            _vectors[key] = vector
+            _vectors.move_to_end(key)
+        while len(_vectors) > CHUNK_VECTOR_SLOTS:
+            _vectors.popitem(last=False)
+    return np.vstack(known)
+
+
+def load_index(digest: str, embedder=None):
+    """Chunk index for a document version from memory or disk, or None on a miss."""
+    embedder = embedder or get_embedder()
+    key = (digest, embedder.name)
+    with _memory_lock:
+        index = _memory.get(key)
+        if index is not None:
+            _memory.move_to_end(key)
+            return index
+    try:
+        index = ChunkIndex.load(_path_prefix(digest, embedder))
+    except (FileNotFoundError, OSError, ValueError):
+        return None
+    _remember(key, index)
+    return index
+
+
+def store_index(digest: str, index: ChunkIndex, embedder=None):
+    embedder = embedder or get_embedder()
+    _remember((digest, embedder.name), index)
+    try:
+        # One writer at a time in this process, so the .npy and .json of an entry come from one build
+        with _save_lock:
+            index.save(_path_prefix(digest, embedder))
+    except OSError as e:
+        print(f"Warning: could not write chunk cache entry {digest}: {e}")
+
+
+def _remember(key, index: ChunkIndex):
+    with _memory_lock:
+        _memory[key] = index
+        _memory.move_to_end(key)
+        while len(_memory) > CHUNK_MEMORY_SLOTS:
+            _memory.popitem(last=False)
+
+
+def discard(digest: str):
+    """Drop every cached chunk index of a superseded document version."""
+    with _memory_lock:
+        for key in [key for key in _memory if key[0] == digest]:
+            del _memory[key]
+    for path in CHUNK_CACHE_DIR.glob(f"{digest[:2]}/{digest}.*"):
+        try:
+            path.unlink()
+        except OSError:
+            pass
+
+
+def top_chunks(index: ChunkIndex, question: str, k: int = RETRIEVAL_TOP_K, embedder=None) -> list:
+    """The k chunks most similar to the question, returned in document order."""
+    embedder = embedder or get_embedder()
+    hits = index.search(embedder.embed([question])[0], k)
+    return [index.chunks[position] for position in sorted(position for position, _ in hits)]
+
+
+def context_parts(chunks: list) -> list:
+    """Prompt-ready text of each chunk, labelled with its 1-based page number."""
+    return [f"[Page {chunk.page + 1}] {chunk.text}" for chunk in chunks]
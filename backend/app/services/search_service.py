@@ -0,0 +1,177 @@
+"""
+Cross-document search over every PDF a user owns.
+
+Each user gets an in-memory BM25 index whose entries are document pages.
+Every search reconciles it with the user's Document rows (content_hash),
+so versions ingested by another worker process show up and deleted documents
+drop out; ingest in this process updates it as well. Replacing a document's
+version re-indexes only the pages whose text changed. Snippets are cut from
+the cached page text of the top hits only. Searching reads the text cache, so
+callers on the event loop run it in a thread.
+"""
+import hashlib
+import heapq
+import math
+import os
+from collections import Counter
+from threading import Lock
+
+from . import text_cache
+from .retrieval import tokenize
+
+SEARCH_SNIPPET_CHARS = int(os.getenv("SEARCH_SNIPPET_CHARS", "160"))
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+class UserIndex:
+    """Page-level BM25 index over one user's documents."""
+
+    def __init__(self):
+        self.lock = Lock()
+        self.postings = {}      # term -> {entry_id: term frequency}
+        self.entries = {}       # entry_id -> (document_id, page_number, token_count)
+        self.document_entries = {}  # document_id -> (digest, {page_number: (entry_id, terms, text_hash)})
+        self.total_tokens = 0
+        self._next_entry = 0
+
+    def has_document(self, document_id: int, digest: str) -> bool:
+        current = self.document_entries.get(document_id)
+        return current is not None and current[0] == digest
+
+    def replace_document(self, document_id: int, digest: str, pages):
+        """
+        Index [(page_number, text), ...] as the current version of a document.
+        Pages whose text is unchanged from the indexed version keep their entries.
+        """
+        with self.lock:
+            previous = self.document_entries.pop(document_id, (None, {}))[1]
+            current = {}
+            for page_num, text in pages:
+                text_hash = hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+                kept = previous.pop(page_num, None)
+                if kept is not None and kept[2] == text_hash:
+                    current[page_num] = kept
+                    continue
+                if kept is not None:
+                    self._remove_entry(*kept[:2])
+                counts = Counter(tokenize(text))
+                if not counts:
+                    continue
+                entry_id = self._next_entry
+                self._next_entry += 1
+                length = sum(counts.values())
+                self.entries[entry_id] = (document_id, page_num, length)
+                self.total_tokens += length
+                for term, freq in counts.items():
+                    self.postings.setdefault(term, {})[entry_id] = freq
+                current[page_num] = (entry_id, list(counts), text_hash)
+            for entry_id, terms, _ in previous.values():
+                self._remove_entry(entry_id, terms)  # pages the new version no longer has
+            self.document_entries[document_id] = (digest, current)
+
+    def remove_document(self, document_id: int):
+        with self.lock:
+            current = self.document_entries.pop(document_id, None)
+            if current is not None:
+                for entry_id, terms, _ in current[1].values():
+                    self._remove_entry(entry_id, terms)
+
+    def _remove_entry(self, entry_id: int, terms):
+        for term in terms:
+            postings = self.postings.get(term)
+            if postings is not None:
+                postings.pop(entry_id, None)
+                if not postings:
+                    del self.postings[term]
+        self.total_tokens -= self.entries.pop(entry_id)[2]
+
+    def search(self, query: str, limit: int) -> list:
+        """[(document_id, page_number, score), ...] best first."""
+        with self.lock:
+            entry_count = len(self.entries)
+            if not entry_count:
+                return []
+            avg_length = self.total_tokens / entry_count
+            scores = {}
+            for term in set(tokenize(query)):
+                postings = self.postings.get(term)
+                if not postings:
+                    continue
+                idf = math.log(1 + (entry_count - len(postings) + 0.5) / (len(postings) + 0.5))
+                for entry_id, freq in postings.items():
+                    norm = BM25_K1 * (1 - BM25_B + BM25_B * self.entries[entry_id][2] / avg_length)
+                    scores[entry_id] = scores.get(entry_id, 0.0) + idf * freq * (BM25_K1 + 1) / (freq + norm)
+            best = heapq.nlargest(limit, scores.items(), key=lambda item: item[1])
+            return [(self.entries[entry_id][0], self.entries[entry_id][1], score) for entry_id, score in best]
+
+
+_indexes = {}
+_indexes_lock = Lock()
+
+
+def _user_index(user_id: int) -> UserIndex:
+    with _indexes_lock:
+        index = _indexes.get(user_id)
+        if index is None:
+            index = _indexes[user_id] = UserIndex()
+        return index
+
+
+def update_document(user_id: int, document_id: int, digest: str):
+    """Index the current version of a document from the text cache. Called by ingest after each upload/edit."""
+    index = _user_index(user_id)
+    if index.has_document(document_id, digest) or not text_cache.has_text(digest):
+        return
+    index.replace_document(document_id, digest, enumerate(text_cache.iter_pages(digest)))
+
+
+def search(user_id: int, documents, query: str, limit: int = 20) -> list:
+    """
+    Search a user's documents. documents are the user's Document rows; the index is
+    first brought in line with their current versions (a no-op for documents already
+    indexed at their content_hash). Returns dicts with document_id, filename, page
+    (1-based), score, snippet.
+    """
+    index = _user_index(user_id)
+    for document in documents:
+        if document.content_hash:
+            update_document(user_id, document.id, document.content_hash)
+    owned = {document.id for document in documents}
+    for document_id in list(index.document_entries):
+        if document_id not in owned:
+            index.remove_document(document_id)  # deleted or not owned any more
+
+    by_id = {document.id: document for document in documents}
+    hits = []
+    for document_id, page_num, score in index.search(query, limit):
+        document = by_id.get(document_id)
+        if document is None:
+            continue  # deleted or not owned any more
+        hits.append({
+            "document_id": document_id,
+            "filename": document.filename,
+            "page": page_num + 1,
+            "score": round(score, 4),
+            "snippet": _snippet(index, document_id, page_num, query),
+        })
+    return hits
+
+
+def _snippet(index: UserIndex, document_id: int, page_num: int, query: str) -> str:
+    current = index.document_entries.get(document_id)
+    if current is None:
+        return ""
+    for cached_page, text in enumerate(text_cache.iter_pages(current[0])):
+        if cached_page == page_num:
+            break
+    else:
+        return ""
+
+    lowered = text.lower()
+    positions = [lowered.find(term) for term in tokenize(query)]
+    positions = [position for position in positions if position != -1]
+    center = min(positions) if positions else 0
+    start = max(0, center - SEARCH_SNIPPET_CHARS // 2)
+    snippet = " ".join(text[start:start + SEARCH_SNIPPET_CHARS].split())
+    return ("…" if start > 0 else "") + snippet + ("…" if start + SEARCH_SNIPPET_CHARS < len(text) else "")
@@ -0,0 +1,185 @@
+"""
+Semantic answer cache: reuse an answer when a paraphrase of an earlier
+question is asked against the same document version.
+
+Questions are normalized (case, punctuation, filler words) and embedded with
+SEMANTIC_CACHE_EMBEDDER, configured separately from retrieval; a new
+question whose cosine similarity to a cached one reaches the threshold gets
+that question's answer. The default hashing embedder is local and holds a
+strict threshold, so it only matches near-identical wording; with gemini,
+paraphrases such as "when is this due" / "what is the due date" match too.
+A remote embed call is bounded by SEMANTIC_CACHE_EMBED_TIMEOUT, and the
+first one that fails or times out switches the cache to the hashing embedder
+for the rest of the process. Entries are grouped per content digest, so an
+edit starts from an empty cache.
+"""
+import os
+import re
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from threading import Lock
+
+import numpy as np
+
+from . import retrieval
+
+SEMANTIC_CACHE_ENABLED = os.getenv("SEMANTIC_CACHE_ENABLED", "true").lower() == "true"
+SEMANTIC_CACHE_EMBEDDER = os.getenv("SEMANTIC_CACHE_EMBEDDER", "hashing")
+# Seconds a remote embedder gets per question before the lookup counts as a miss
+SEMANTIC_CACHE_EMBED_TIMEOUT = float(os.getenv("SEMANTIC_CACHE_EMBED_TIMEOUT", "2"))
+# Overrides the per-embedder default below when set
+SEMANTIC_CACHE_THRESHOLD = os.getenv("SEMANTIC_CACHE_THRESHOLD")
+# Cosine similarity at which two normalized questions count as the same question. The
+# hashing embedder scores shared words, not meaning, so it is held to near-identical text.
+DEFAULT_THRESHOLDS = {"gemini": 0.88, "hashing": 0.97}
+# Questions remembered per document version, and versions remembered in total
+SEMANTIC_CACHE_PER_VERSION = int(os.getenv("SEMANTIC_CACHE_PER_VERSION", "256"))
+SEMANTIC_CACHE_VERSIONS = int(os.getenv("SEMANTIC_CACHE_VERSIONS", "256"))
+
+stats = {"hits": 0, "misses": 0}
+
+# Words that change the phrasing of a question but not what it asks for
+_FILLER_WORDS = {
+    "a", "an", "the", "is", "are", "was", "were", "be", "of", "in", "on", "for", "to",
+    "this", "that", "these", "those", "it", "its", "does", "do", "did", "please", "me",
+    "tell", "can", "could", "would", "you", "i", "my", "document", "pdf", "file", "s",
+}
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+
+
+class _VersionEntries:
+    __slots__ = ("questions", "answers", "vectors")
+
+    def __init__(self):
+        self.questions = []
+        self.answers = []
+        self.vectors = []
+
+
+_versions = OrderedDict()  # digest -> _VersionEntries
+_lock = Lock()
+
+
+def normalize(question: str) -> str:
+    words = _WORD_RE.findall(question.lower())
+    kept = [word for word in words if word not in _FILLER_WORDS]
+    return " ".join(kept or words)
+
+
+_embedder = None
+_embedder_lock = Lock()
+# Remote embed calls run here so a hung call can be abandoned at the timeout
+_embed_executor = ThreadPoolExecutor(max_workers=4, thread_name_prefix="semantic-embed")
+
+
+def get_embedder():
+    """The cache's embedder; the hashing embedder when SEMANTIC_CACHE_EMBEDDER cannot be loaded or has failed."""
+    global _embedder
+    with _embedder_lock:
+        if _embedder is None:
+            try:
+                _embedder = retrieval.make_embedder(SEMANTIC_CACHE_EMBEDDER)
+            except Exception as e:
+                print(f"Warning: semantic cache embedder {SEMANTIC_CACHE_EMBEDDER} unavailable ({e}); "
+                      "only near-identical questions will match")
+                _embedder = retrieval.make_embedder("hashing")
+        return _embedder
+
+
+def _fall_back(failed, error):
+    """Switch to the hashing embedder after a failed call; vectors of the other embedder are dropped."""
+    global _embedder
+    with _embedder_lock:
+        if _embedder is not failed:
+            return
+        print(f"Warning: semantic cache embedder {failed.name} failed ({error}); "
+              "switching to the hashing embedder, only near-identical questions will match")
+        _embedder = retrieval.make_embedder("hashing")
+    with _lock:
+        _versions.clear()
+
+
+def default_threshold() -> float:
+    if SEMANTIC_CACHE_THRESHOLD:
+        return float(SEMANTIC_CACHE_THRESHOLD)
+    return DEFAULT_THRESHOLDS.get(get_embedder().name, DEFAULT_THRESHOLDS["hashing"])
+
+
+def _embed(normalized: str, embedder) -> np.ndarray:
+    if embedder.name == "hashing":
+        return embedder.embed([normalized])[0]
+    try:
+        return _embed_executor.submit(embedder.embed, [normalized]).result(timeout=SEMANTIC_CACHE_EMBED_TIMEOUT)[0]
+    except Exception as e:
+        _fall_back(embedder, str(e) or "timed out")
+        raise
+
+
+def lookup(version: str, question: str, threshold: float = None):
+    """Cached answer to the closest earlier question for this version, or None below the threshold."""
+    if not SEMANTIC_CACHE_ENABLED or not version:
+        return None
+    threshold = default_threshold() if threshold is None else threshold
+    normalized = normalize(question)
+    with _lock:
+        entries = _versions.get(version)
+        if entries is not None:
+            _versions.move_to_end(version)
+            if normalized in entries.questions:
+                stats["hits"] += 1
+                return entries.answers[entries.questions.index(normalized)]
+            vectors = np.vstack(entries.vectors) if entries.vectors else None
+            answers = list(entries.answers)
+    if entries is None or vectors is None:
+        stats["misses"] += 1
+        return None
+
+    try:
+        scores = vectors @ _embed(normalized, get_embedder())
+    except Exception as e:
+        print(f"Warning: semantic cache lookup failed: {e}")
+        stats["misses"] += 1
+        return None
+    best = int(np.argmax(scores))
+    if scores[best] >= threshold:
+        stats["hits"] += 1
+        return answers[best]
+    stats["misses"] += 1
+    return None
+
+
+def store(version: str, question: str, answer: str):
+    if not SEMANTIC_CACHE_ENABLED or not version:
+        return
+    normalized = normalize(question)
+    embedder = get_embedder()
+    try:
+        vector = _embed(normalized, embedder)
+    except Exception as e:
+        print(f"Warning: semantic cache store failed: {e}")
+        return
+    with _lock:
+        if _embedder is not embedder:
+            return  # switched embedders meanwhile; the vector would not compare with the others
+        entries = _versions.get(version)
+        if entries is None:
+            entries = _versions[version] = _VersionEntries()
+            while len(_versions) > SEMANTIC_CACHE_VERSIONS:
+                _versions.popitem(last=False)
+        _versions.move_to_end(version)
+        if normalized in entries.questions:
+            # A bypassed or re-asked question replaces its earlier answer
+            position = entries.questions.index(normalized)
+            entries.answers[position] = answer
+            return
+        entries.questions.append(normalized)
+        entries.answers.append(answer)
+        entries.vectors.append(vector)
+        if len(entries.questions) > SEMANTIC_CACHE_PER_VERSION:
+            del entries.questions[0], entries.answers[0], entries.vectors[0]
+
+
+def discard(version: str):
+    """Drop the cached answers of a superseded document version."""
+    with _lock:
+        _versions.pop(version, None)
@@ -0,0 +1,49 @@
+"""
+Single-flight coalescing of identical concurrent async operations.
+
+When several requests need the same result at the same time (the same
+document extracted, the same prompt sent to the model), only the first one
+runs the operation; the others await its result. Keys name the operation and
+its inputs, e.g. ("read_pages", file_path, max_chars). The shared operation
+is cancelled only when every caller waiting on it has been cancelled.
+"""
+import asyncio
+
+stats = {"started": 0, "coalesced": 0}
+
+_calls = {}  # key -> _Call
+
+
+class _Call:
+    __slots__ = ("task", "waiters")
+
+    def __init__(self, task):
+        self.task = task
+        self.waiters = 0
+
+
+async def run(key, fn, *args, **kwargs):
+    """Await fn(*args, **kwargs), sharing the result with concurrent callers that pass an equal key."""
+    call = _calls.get(key)
+    if call is None:
+        call = _Call(asyncio.ensure_future(fn(*args, **kwargs)))
+        _calls[key] = call
+        call.task.add_done_callback(lambda _, key=key, call=call: _forget(key, call))
+        stats["started"] += 1
+    else:
+        stats["coalesced"] += 1
+
+    call.waiters += 1
+    try:
+        return await asyncio.shield(call.task)
+    except asyncio.CancelledError:
+        if not call.task.done() and call.waiters == 1:
+            call.task.cancel()
+        raise
+    finally:
+        call.waiters -= 1
+
+
+def _forget(key, call):
+    if _calls.get(key) is call:
+        del _calls[key]
@@ -0,0 +1,306 @@
+"""
+Compact columnar layout of every text span in one document version.
+
+Built once from a single page.get_text("dict") pass, then shared by text
+extraction (page text is a slice of the concatenated span text) and the edit
+engine (span positions, fonts and colours without walking dict trees).
+Columns are array-backed, so a layout of a dense 300-page invoice is a few
+flat buffers instead of hundreds of thousands of nested dicts, and it
+serializes to disk as-is.
+"""
+import json
+import os
+from array import array
+from bisect import bisect_right
+from collections import OrderedDict
+from pathlib import Path
+
+LAYOUT_CACHE_DIR = Path(os.getenv("LAYOUT_CACHE_DIR", "cache/layout"))
+# Layouts kept in memory per worker process
+LAYOUT_MEMORY_SLOTS = int(os.getenv("LAYOUT_MEMORY_SLOTS", "8"))
+
+_FORMAT_VERSION = 1
+
+
+class Span:
+    """Read-only view of one span of a SpanLayout."""
+    __slots__ = ("index", "page", "text", "start", "end", "bbox", "font", "size", "color")
+
+    def __init__(self, index, page, text, start, end, bbox, font, size, color):
+        self.index = index
+        self.page = page
+        self.text = text
+        self.start = start
+        self.end = end
+        self.bbox = bbox
+        self.font = font
+        self.size = size
+        self.color = color
+
+
+class SpanLayout:
+    """
+    Columns, one entry per span (n spans):
+      span_start/span_end  offsets of the span text in `text`
+      span_page            page number
+      bbox                 x0, y0, x1, y1 (4n floats)
+      size, color, font_id font size, sRGB colour, index into `fonts`
+    plus page_span_start / page_text_start (page_count + 1 entries) to slice by page.
+    Spans of a line are adjacent in `text`; every line ends with a newline.
+    """
+    __slots__ = ("text", "fonts", "span_start", "span_end", "span_page", "bbox",
+                 "size", "color", "font_id", "page_span_start", "page_text_start")
+
+    def __init__(self):
+        self.text = ""
+        self.fonts = []
+        self.span_start = array("I")
+        self.span_end = array("I")
+        self.span_page = array("I")
+        self.bbox = array("f")
+        self.size = array("f")
+        self.color = array("I")
+        self.font_id = array("H")
+        self.page_span_start = array("I", [0])
+        self.page_text_start = array("I", [0])
+
+    @property
+    def span_count(self) -> int:
+        return len(self.span_start)
+
+    @property
+    def page_count(self) -> int:
+        return len(self.page_text_start) - 1
+
+    def span(self, index: int) -> Span:
+        start, end = self.span_start[index], self.span_end[index]
+        return Span(
+            index,
+            self.span_page[index],
+            self.text[start:end],
+            start,
+            end,
+            tuple(self.bbox[4 * index:4 * index + 4]),
+            self.fonts[self.font_id[index]],
+            self.size[index],
+            self.color[index],
+        )
+
+    def page_text(self, page_num: int) -> str:
+        return self.text[self.page_text_start[page_num]:self.page_text_start[page_num + 1]]
+
+    def page_texts(self) -> list:
+        return [self.page_text(page_num) for page_num in range(self.page_count)]
+
+    def page_layout(self, page_num: int):
+        """A standalone single-page layout (as page 0) of one page, as build_page_layout would return it."""
+        first, last = self.page_span_start[page_num], self.page_span_start[page_num + 1]
+        text_start = self.page_text_start[page_num]
+        layout = SpanLayout()
+        font_ids = {}
+        for font_id in self.font_id[first:last]:
+            if font_id not in font_ids:
+                font_ids[font_id] = len(layout.fonts)
+                layout.fonts.append(self.fonts[font_id])
+        layout.text = self.page_text(page_num)
+        layout.span_start = array("I", (start - text_start for start in self.span_start[first:last]))
+        layout.span_end = array("I", (end - text_start for end in self.span_end[first:last]))
+        layout.span_page = array("I", [0]) * (last - first)
+        layout.bbox = self.bbox[4 * first:4 * last]
+        layout.size = self.size[first:last]
+        layout.color = self.color[first:last]
+        layout.font_id = array("H", (font_ids[font_id] for font_id in self.font_id[first:last]))
+        layout.page_span_start.append(last - first)
+        layout.page_text_start.append(len(layout.text))
+        return layout
+
+    def span_at(self, offset: int):
+        """Index of the span covering a text offset, or None if the offset is a line break."""
+        index = bisect_right(self.span_start, offset) - 1
+        if index < 0 or offset >= self.span_end[index]:
+            return None
+        return index
+
+    def span_ranges(self, offsets, length: int) -> list:
+        """
+        Map match offsets of a needle of the given length to (first_span, last_span)
+        index pairs, in document order. A match may run across adjacent spans of a
+        line but not across lines; overlapping matches that start in the same span
+        are reported once.
+        """
+        ranges = []
+        for offset in offsets:
+            first = self.span_at(offset)
+            last = self.span_at(offset + length - 1)
+            if first is None or last is None or "\n" in self.text[offset:offset + length]:
+                continue
+            if ranges and ranges[-1][0] == first:
+                continue
+            ranges.append((first, last))
+        return ranges
+
+    def to_bytes(self) -> bytes:
+        text = self.text.encode("utf-8")
+        columns = [self.span_start, self.span_end, self.span_page, self.bbox, self.size,
+                   self.color, self.font_id, self.page_span_start, self.page_text_start]
+        header = {
+            "version": _FORMAT_VERSION,
+            "fonts": self.fonts,
+            "text_bytes": len(text),
+            "columns": [[column.typecode, len(column)] for column in columns],
+        }
+        return b"".join([json.dumps(header).encode("utf-8"), b"\n", text] + [column.tobytes() for column in columns])
+
+    @classmethod
+    def from_bytes(cls, data: bytes):
+        newline = data.index(b"\n")
+        header = json.loads(data[:newline])
+        if header.get("version") != _FORMAT_VERSION:
+            raise ValueError("unsupported layout format")
+        layout = cls()
+        layout.fonts = header["fonts"]
+        offset = newline + 1
+        layout.text = data[offset:offset + header["text_bytes"]].decode("utf-8")
+        offset += header["text_bytes"]
+        columns = []
+        for typecode, length in header["columns"]:
+            column = array(typecode)
+            size = column.itemsize * length
+            column.frombytes(data[offset:offset + size])
+            offset += size
+            columns.append(column)
+        (layout.span_start, layout.span_end, layout.span_page, layout.bbox, layout.size,
+         layout.color, layout.font_id, layout.page_span_start, layout.page_text_start) = columns
+        return layout
+
+
+def build_page_layout(page) -> SpanLayout:
+    """Build the layout of a single page (as page 0) with one dict parse."""
+    layout = SpanLayout()
+    parts = []
+    text_length = 0
+    font_ids = {}
+
+    text_dict = page.get_text("dict")
+    for block in text_dict.get("blocks", []):
+        if block.get("type") != 0:  # 0 = text block
+            continue
+        for line in block.get("lines", []):
+            for span in line.get("spans", []):
+                span_text = span.get("text", "")
+                font = span.get("font", "Helv")
+                if font not in font_ids:
+                    font_ids[font] = len(layout.fonts)
+                    layout.fonts.append(font)
+                color = span.get("color", 0)
+
+                layout.span_start.append(text_length)
+                parts.append(span_text)
+                text_length += len(span_text)
+                layout.span_end.append(text_length)
+                layout.span_page.append(0)
+                layout.bbox.extend(span.get("bbox", (0, 0, 0, 0)))
+                layout.size.append(span.get("size", 12))
+                layout.color.append(color if isinstance(color, int) else 0)
+                layout.font_id.append(font_ids[font])
+            parts.append("\n")
+            text_length += 1
+    layout.page_span_start.append(len(layout.span_start))
+    layout.page_text_start.append(text_length)
+
+    layout.text = "".join(parts)
+    return layout
+
+
+def join_pages(page_layouts) -> SpanLayout:
+    """Concatenate single-page layouts, in page order, into the layout of a document."""
+    layout = SpanLayout()
+    parts = []
+    text_length = 0
+    font_ids = {}
+
+    for page_num, page_layout in enumerate(page_layouts):
+        remap = []
+        for font in page_layout.fonts:
+            if font not in font_ids:
+                font_ids[font] = len(layout.fonts)
+                layout.fonts.append(font)
+            remap.append(font_ids[font])
+
+        layout.span_start.extend(start + text_length for start in page_layout.span_start)
+        layout.span_end.extend(end + text_length for end in page_layout.span_end)
+        layout.span_page.extend([page_num] * page_layout.span_count)
+        layout.bbox.extend(page_layout.bbox)
+        layout.size.extend(page_layout.size)
+        layout.color.extend(page_layout.color)
+        layout.font_id.extend(remap[font_id] for font_id in page_layout.font_id)
+        parts.append(page_layout.text)
+        text_length += len(page_layout.text)
+        layout.page_span_start.append(len(layout.span_start))
+        layout.page_text_start.append(text_length)
+
+    layout.text = "".join(parts)
+    return layout
+
+
+def build_layout(document, known_pages=None) -> SpanLayout:
+    """
+    Build the layout of an open fitz document with one dict parse per page.
+    known_pages maps page numbers to single-page layouts already built for an
+    identical page (see page_cache); those pages are not parsed again.
+    """
+    known_pages = known_pages or {}
+    return join_pages([
+        known_pages.get(page_num) or build_page_layout(page) for page_num, page in enumerate(document)
+    ])
+
+
+_memory = OrderedDict()
+
+
+def _entry_path(digest: str) -> Path:
+    return LAYOUT_CACHE_DIR / digest[:2] / f"{digest}.layout"
+
+
+def load(digest: str):
+    """Return the layout for a document version from memory or disk, or None on a miss."""
+    layout = _memory.get(digest)
+    if layout is not None:
+        _memory.move_to_end(digest)
+        return layout
+    try:
+        layout = SpanLayout.from_bytes(_entry_path(digest).read_bytes())
+    except (FileNotFoundError, OSError, ValueError):
+        return None
+    _remember(digest, layout)
+    return layout
+
+
+def save(digest: str, layout: SpanLayout):
+    _remember(digest, layout)
+    entry = _entry_path(digest)
+    try:
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        tmp = entry.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_bytes(layout.to_bytes())
+        os.replace(tmp, entry)
+    except OSError as e:
+        print(f"Warning: could not write layout cache entry {digest}: {e}")
+
+
+def discard(digest: str):
+    """Drop the layout of a superseded document version."""
+    _memory.pop(digest, None)
+    try:
+        _entry_path(digest).unlink()
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"Warning: could not remove layout cache entry {digest}: {e}")
+
+
+def _remember(digest: str, layout: SpanLayout):
+    _memory[digest] = layout
+    _memory.move_to_end(digest)
+    while len(_memory) > LAYOUT_MEMORY_SLOTS:
+        _memory.popitem(last=False)
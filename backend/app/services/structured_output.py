@@ -0,0 +1,94 @@
+"""
+Parsing of structured (JSON) LLM responses.
+
+Models asked for JSON still wrap it in code fences, add a sentence before
+it, or fall back to the older "Original: ... / New: ..." line format. These
+helpers recover the payload from all of those and validate its shape, so
+callers get a plan dict or None, never an exception.
+"""
+import json
+import re
+
+INTENT_EDIT = "EDIT"
+INTENT_QUESTION = "QUESTION"
+
+_FENCE_RE = re.compile(r"```(?:json)?\s*(.*?)```", re.DOTALL | re.IGNORECASE)
+_LEGACY_EDIT_RE = re.compile(r"^\s*Original:\s*(.*?)\s*\n\s*New:\s*(.*?)\s*$", re.MULTILINE | re.IGNORECASE)
+
+
+def extract_json(text: str):
+    """The first JSON object in text (bare, fenced or embedded in prose), or None."""
+    if not text:
+        return None
+    candidates = [match.group(1) for match in _FENCE_RE.finditer(text)] + [text]
+    decoder = json.JSONDecoder()
+    for candidate in candidates:
+        start = candidate.find("{")
+        while start != -1:
+            try:
+                value, _ = decoder.raw_decode(candidate, start)
+            except ValueError:
+                start = candidate.find("{", start + 1)
+                continue
+            if isinstance(value, dict):
+                return value
+            start = candidate.find("{", start + 1)
+    return None
+
+
+def _clean_edits(raw) -> list:
+    """[{"original", "new"}, ...] with both fields non-empty strings and original != new, in order, deduplicated."""
+    if isinstance(raw, dict):
+        raw = [raw]
+    if not isinstance(raw, list):
+        return []
+    edits, seen = [], set()
+    for item in raw:
+        if not isinstance(item, dict):
+            continue
+        original = item.get("original", item.get("old"))
+        new = item.get("new", item.get("replacement"))
+        if not isinstance(original, str) or not isinstance(new, str):
+            continue
+        original, new = original.strip().strip('"'), new.strip().strip('"')
+        if not original or original == new or (original, new) in seen:
+            continue
+        seen.add((original, new))
+        edits.append({"original": original, "new": new})
+    return edits
+
+
+def legacy_edits(text: str) -> list:
+    """Edits in the "Original: ...\\nNew: ..." line format."""
+    return _clean_edits([{"original": original, "new": new} for original, new in _LEGACY_EDIT_RE.findall(text or "")])
+
+
+def parse_edits(text: str) -> list:
+    """Edits from an edit-planning response: {"edits": [...]} JSON, a bare edit object, or the legacy line format."""
+    payload = extract_json(text)
+    if payload is not None:
+        edits = _clean_edits(payload.get("edits", payload))
+        if edits:
+            return edits
+    return legacy_edits(text)
+
+
+def parse_plan(text: str):
+    """
+    Parse a combined intent/answer/edit response into
+    {"intent": "EDIT" | "QUESTION", "answer": str, "edits": [...]}, or None when it is unusable.
+    """
+    payload = extract_json(text)
+    if payload is None:
+        edits = legacy_edits(text)
+        return {"intent": INTENT_EDIT, "answer": "", "edits": edits} if edits else None
+
+    intent = str(payload.get("intent", "")).strip().upper()
+    answer = payload.get("answer")
+    answer = answer.strip() if isinstance(answer, str) else ""
+    edits = _clean_edits(payload.get("edits", []))
+    if intent not in (INTENT_EDIT, INTENT_QUESTION):
+        intent = INTENT_EDIT if edits and not answer else INTENT_QUESTION
+    if intent == INTENT_QUESTION and not answer:
+        return None
+    return {"intent": intent, "answer": answer, "edits": edits}
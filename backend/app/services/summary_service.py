@@ -0,0 +1,192 @@
+"""
+Hierarchical document summaries, generated once per document version.
+
+After ingest, the page text is packed into sections of about SUMMARY_MAP_CHARS
+that are summarized in parallel (map); the section summaries are then merged
+SUMMARY_FAN_IN at a time, level by level, until one summary is left (reduce).
+The result is stored on Document.summary with the digest it describes, and
+broad questions ("what is this document about") are answered from it instead
+of from retrieved chunks. Section prompts go through the response cache, so
+after an edit only the sections whose text changed are summarized again.
+"""
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+from threading import Lock
+
+from .. import models
+from ..database import SessionLocal
+from . import llm_gateway, response_cache, text_cache
+from .retrieval import chunk_pages
+
+SUMMARY_ENABLED = os.getenv("SUMMARY_ENABLED", "true").lower() == "true"
+SUMMARY_MAP_CHARS = int(os.getenv("SUMMARY_MAP_CHARS", "12000"))
+SUMMARY_FAN_IN = int(os.getenv("SUMMARY_FAN_IN", "8"))
+# Concurrent LLM calls per summary, and documents summarized at once
+SUMMARY_CONCURRENCY = int(os.getenv("SUMMARY_CONCURRENCY", "4"))
+SUMMARY_WORKERS = int(os.getenv("SUMMARY_WORKERS", "1"))
+
+# "What is this document about": always about the whole document
+_ABOUT_PATTERNS = [
+    r"\bwhat\b.*\b(this|the)\s+(document|pdf|file|paper|report)\b.*\babout\b",
+    r"\bwhat\s+is\s+(this|it)\s+about\b",
+]
+# Summary requests, broad only when they name nothing but the document itself
+_SUMMARY_RE = re.compile(
+    r"\b(summar(y|ize|ise)|overview|gist|tl;?dr|synopsis|(main|key)\s+(points|ideas|takeaways|topics))\b", re.IGNORECASE
+)
+_SUMMARY_FILLER = {
+    "please", "can", "could", "would", "you", "me", "us", "i", "want", "need", "give", "provide", "write", "do",
+    "what", "are", "is", "a", "an", "the", "of", "for", "in", "to", "on", "its", "s", "brief", "short", "quick",
+    "high", "level", "this", "it", "that", "whole", "entire", "document", "pdf", "file", "paper", "report", "doc",
+}
+# A named part of the document is answered from its retrieved chunks, not the whole-document summary
+_NARROW_RE = re.compile(
+    r"\b(page|pages|section|sections|clause|clauses|chapter|chapters|paragraph|article|appendix|table|figure|part)\b",
+    re.IGNORECASE,
+)
+
+_executor = ThreadPoolExecutor(max_workers=SUMMARY_WORKERS, thread_name_prefix="summary")
+_llm_executor = ThreadPoolExecutor(max_workers=SUMMARY_CONCURRENCY, thread_name_prefix="summary-llm")
+_in_flight = set()
+# Documents submitted again while running; they run once more when the current run ends
+_dirty = set()
+_in_flight_lock = Lock()
+
+
+def is_broad_question(question: str) -> bool:
+    """Whether a question is about the whole document ("summarize this pdf"), not a part of it."""
+    if _NARROW_RE.search(question):
+        return False
+    if any(re.search(pattern, question, re.IGNORECASE) for pattern in _ABOUT_PATTERNS):
+        return True
+    match = _SUMMARY_RE.search(question)
+    if not match:
+        return False
+    rest = question[:match.start()] + " " + question[match.end():]
+    return all(word in _SUMMARY_FILLER for word in re.findall(r"[a-z0-9]+", rest.lower()))
+
+
+def submit(document_id: int):
+    """Queue a summary of a document's current (ingested) version. Queued or running documents run once more afterwards."""
+    if not SUMMARY_ENABLED:
+        return
+    with _in_flight_lock:
+        if document_id in _in_flight:
+            _dirty.add(document_id)
+            return
+        _in_flight.add(document_id)
+    _executor.submit(_run, document_id)
+
+
+def shutdown():
+    _executor.shutdown(wait=False, cancel_futures=True)
+    _llm_executor.shutdown(wait=False, cancel_futures=True)
+
+
+def _run(document_id: int):
+    db = SessionLocal()
+    try:
+        document = db.query(models.Document).filter(models.Document.id == document_id).first()
+        if not document or not document.content_hash or document.summary_hash == document.content_hash:
+            return
+        digest = document.content_hash
+        if not text_cache.has_text(digest):
+            return
+
+        try:
+            summary = summarize_pages(list(enumerate(text_cache.iter_pages(digest))))
+        except Exception as e:
+            print(f"Summary failed for document {document_id}: {e}")
+            return
+
+        db.refresh(document)
+        if document.content_hash != digest:
+            return  # edited meanwhile; the new version gets its own summary
+        document.summary = summary
+        document.summary_hash = digest
+        document.summarized_at = datetime.utcnow()
+        db.commit()
+        print(f"Summarized document {document_id}: {len(summary)} characters")
+    finally:
+        db.close()
+        SessionLocal.remove()
+        _finish(document_id)
+
+
+def _finish(document_id: int):
+    """Run a document again if it was submitted while running (e.g. edited mid-run), else release it."""
+    with _in_flight_lock:
+        rerun = document_id in _dirty
+        _dirty.discard(document_id)
+        if not rerun:
+            _in_flight.discard(document_id)
+            return
+    try:
+        _executor.submit(_run, document_id)
+    except RuntimeError:  # shutting down
+        with _in_flight_lock:
+            _in_flight.discard(document_id)
+
+
+def summarize_pages(pages) -> str:
+    """Map-reduce summary of [(page_number, text), ...]."""
+    sections = _pack_sections(pages)
+    if not sections:
+        return ""
+    summaries = list(_llm_executor.map(_summarize_section, sections))
+    while len(summaries) > 1:
+        groups = [summaries[start:start + SUMMARY_FAN_IN] for start in range(0, len(summaries), SUMMARY_FAN_IN)]
+        summaries = list(_llm_executor.map(_merge_summaries, groups))
+    return summaries[0]
+
+
+def _pack_sections(pages) -> list:
+    """Group consecutive chunks into sections of up to SUMMARY_MAP_CHARS, labelled with their page range."""
+    sections = []
+    first_page, parts, size = None, [], 0
+    for chunk in chunk_pages(pages, chunk_chars=SUMMARY_MAP_CHARS, overlap=0):
+        if parts and size + len(chunk.text) > SUMMARY_MAP_CHARS:
+            sections.append((first_page, last_page, "\n".join(parts)))
+            parts, size = [], 0
+        if not parts:
+            first_page = chunk.page
+        parts.append(chunk.text)
+        size += len(chunk.text)
+        last_page = chunk.page
+    if parts:
+        sections.append((first_page, last_page, "\n".join(parts)))
+    return sections
+
+
+def _summarize_section(section) -> str:
+    first_page, last_page, text = section
+    pages = f"page {first_page + 1}" if first_page == last_page else f"pages {first_page + 1}-{last_page + 1}"
+    prompt = (
+        f"Summarize this part of a document ({pages}) in a short paragraph. "
+        f"Keep names, dates, amounts and other specifics.\n\n{text}"
+    )
+    return f"[{pages.capitalize()}] {_complete(prompt)}"
+
+
+def _merge_summaries(summaries: list) -> str:
+    if len(summaries) == 1:
+        return summaries[0]
+    prompt = (
+        "Combine these summaries of consecutive parts of one document into a single summary "
+        "that covers what the document is, its purpose and its key points. Keep names, dates "
+        "and amounts.\n\n" + "\n\n".join(summaries)
+    )
+    return _complete(prompt)
+
+
+def _complete(prompt: str) -> str:
+    key = response_cache.make_key(llm_gateway.model_name(), prompt)
+    cached = response_cache.get(key)
+    if cached is not None:
+        return cached
+    text = llm_gateway.complete_blocking(prompt)
+    if text:
+        response_cache.put(key, text)
+    return text
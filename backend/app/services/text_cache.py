@@ -0,0 +1,109 @@
+"""
+Persistent cache for text extracted from PDFs.
+
+Entries are keyed by the SHA-256 of the PDF bytes, so every version of a
+document (original upload, each edited copy) gets its own entry and a stale
+entry can never be served for changed content.
+"""
+import hashlib
+import json
+import os
+from pathlib import Path
+from threading import get_ident
+
+CACHE_DIR = Path(os.getenv("TEXT_CACHE_DIR", "cache/text"))
+
+# file path -> (mtime_ns, size, digest) so local files are only re-hashed when they change
+_path_digests = {}
+
+
+def digest_bytes(data: bytes) -> str:
+    """Return the SHA-256 hex digest of raw PDF bytes."""
+    return hashlib.sha256(data).hexdigest()
+
+
+def digest_file(file_path: str) -> str:
+    """Return the SHA-256 hex digest of a local PDF, memoized on mtime and size."""
+    stat = os.stat(file_path)
+    memo = _path_digests.get(file_path)
+    if memo and memo[0] == stat.st_mtime_ns and memo[1] == stat.st_size:
+        return memo[2]
+
+    sha = hashlib.sha256()
+    with open(file_path, "rb") as f:
+        for block in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(block)
+    digest = sha.hexdigest()
+    _path_digests[file_path] = (stat.st_mtime_ns, stat.st_size, digest)
+    return digest
+
+
+def remember(file_path: str, digest: str):
+    """Record the digest of a remote file (e.g. an S3 URL) so it can be invalidated later."""
+    _path_digests[file_path] = (None, None, digest)
+
+
+def known_digest(file_path: str):
+    """The last digest computed or remembered for a path, without touching the file; None if never seen."""
+    memo = _path_digests.get(file_path)
+    return memo[2] if memo else None
+
+
+def _entry_path(digest: str) -> Path:
+    # One JSON-encoded string per line, one line per page, so entries can be streamed page by page
+    return CACHE_DIR / digest[:2] / f"{digest}.jsonl"
+
+
+def iter_pages(digest: str):
+    """Yield the cached text of each page in order. Yields nothing on a miss; use has_text() to tell the two apart."""
+    try:
+        with open(_entry_path(digest), encoding="utf-8") as f:
+            for line in f:
+                yield json.loads(line)
+    except (FileNotFoundError, OSError):
+        return
+
+
+def has_text(digest: str) -> bool:
+    return _entry_path(digest).exists()
+
+
+def get_text(digest: str):
+    """Return the cached text for a digest, or None on a miss."""
+    if not has_text(digest):
+        return None
+    return "".join(iter_pages(digest))
+
+
+def put_pages(digest: str, pages):
+    """Store extracted text, one string per page. Writes are atomic so readers never see partial entries."""
+    entry = _entry_path(digest)
+    try:
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        # Ingest threads and request threads of one process may write the same digest
+        tmp = entry.with_suffix(f".{os.getpid()}.{get_ident()}.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            for page_text in pages:
+                f.write(json.dumps(page_text))
+                f.write("\n")
+        os.replace(tmp, entry)
+    except OSError as e:
+        print(f"Warning: could not write text cache entry {digest}: {e}")
+
+
+def invalidate(file_path: str):
+    """
+    Drop the cache entry for a superseded document version.
+    Called when an edit replaces the file a document points at.
+    Returns the digest of the dropped version, or None if it was never seen.
+    """
+    memo = _path_digests.pop(file_path, None)
+    if memo is None:
+        return None
+    try:
+        _entry_path(memo[2]).unlink()
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"Warning: could not remove text cache entry {memo[2]}: {e}")
+    return memo[2]
@@ -0,0 +1,144 @@
+"""
+Trigram index over the concatenated span text of a SpanLayout.
+
+Finding an edit target is a lookup of the rarest trigram of the needle and a
+verification of each of its postings, so cost follows the number of
+candidate positions rather than document size. Offsets map back to spans
+through SpanLayout.span_at, which also lets a match run across span
+boundaries within a line.
+"""
+import json
+import os
+from array import array
+from collections import OrderedDict
+from pathlib import Path
+
+INDEX_CACHE_DIR = Path(os.getenv("INDEX_CACHE_DIR", "cache/index"))
+INDEX_MEMORY_SLOTS = int(os.getenv("INDEX_MEMORY_SLOTS", "8"))
+
+GRAM = 3
+_FORMAT_VERSION = 1
+
+
+class TrigramIndex:
+    __slots__ = ("text", "postings")
+
+    def __init__(self, text: str, postings: dict):
+        self.text = text
+        self.postings = postings
+
+    @classmethod
+    def build(cls, text: str):
+        lists = {}
+        for offset in range(len(text) - GRAM + 1):
+            gram = text[offset:offset + GRAM]
+            if "\n" in gram:
+                continue
+            positions = lists.get(gram)
+            if positions is None:
+                lists[gram] = positions = []
+            positions.append(offset)
+        return cls(text, {gram: array("I", positions) for gram, positions in lists.items()})
+
+    def find(self, needle: str) -> list:
+        """Every start offset of needle in the text, ascending."""
+        if not needle:
+            return []
+        if len(needle) < GRAM or "\n" in needle:
+            return _scan(self.text, needle)
+
+        # Anchor on the rarest gram of the needle and verify each candidate
+        best_shift, best_postings = 0, None
+        for shift in range(len(needle) - GRAM + 1):
+            postings = self.postings.get(needle[shift:shift + GRAM])
+            if postings is None:
+                return []
+            if best_postings is None or len(postings) < len(best_postings):
+                best_shift, best_postings = shift, postings
+        text = self.text
+        return [
+            position - best_shift
+            for position in best_postings
+            if position >= best_shift and text.startswith(needle, position - best_shift)
+        ]
+
+    def to_bytes(self) -> bytes:
+        grams = list(self.postings)
+        header = {"version": _FORMAT_VERSION, "grams": grams, "counts": [len(self.postings[gram]) for gram in grams]}
+        return b"".join([json.dumps(header).encode("utf-8"), b"\n"] + [self.postings[gram].tobytes() for gram in grams])
+
+    @classmethod
+    def from_bytes(cls, data: bytes, text: str):
+        newline = data.index(b"\n")
+        header = json.loads(data[:newline])
+        if header.get("version") != _FORMAT_VERSION:
+            raise ValueError("unsupported index format")
+        postings = {}
+        offset = newline + 1
+        for gram, count in zip(header["grams"], header["counts"]):
+            positions = array("I")
+            size = positions.itemsize * count
+            positions.frombytes(data[offset:offset + size])
+            offset += size
+            postings[gram] = positions
+        return cls(text, postings)
+
+
+def _scan(text: str, needle: str) -> list:
+    found = []
+    offset = text.find(needle)
+    while offset != -1:
+        found.append(offset)
+        offset = text.find(needle, offset + 1)
+    return found
+
+
+_memory = OrderedDict()
+
+
+def _entry_path(digest: str) -> Path:
+    return INDEX_CACHE_DIR / digest[:2] / f"{digest}.tgi"
+
+
+def load(digest: str, text: str):
+    """Return the index for a document version from memory or disk, or None on a miss."""
+    index = _memory.get(digest)
+    if index is not None:
+        _memory.move_to_end(digest)
+        return index
+    try:
+        index = TrigramIndex.from_bytes(_entry_path(digest).read_bytes(), text)
+    except (FileNotFoundError, OSError, ValueError):
+        return None
+    _remember(digest, index)
+    return index
+
+
+def save(digest: str, index: TrigramIndex):
+    _remember(digest, index)
+    entry = _entry_path(digest)
+    try:
+        entry.parent.mkdir(parents=True, exist_ok=True)
+        tmp = entry.with_suffix(f".{os.getpid()}.tmp")
+        tmp.write_bytes(index.to_bytes())
+        os.replace(tmp, entry)
+    except OSError as e:
+        print(f"Warning: could not write index cache entry {digest}: {e}")
+
+
+def discard(digest: str):
+    """Drop the index of a superseded document version."""
+    _memory.pop(digest, None)
+    try:
+        _entry_path(digest).unlink()
+    except FileNotFoundError:
+        pass
+    except OSError as e:
+        print(f"Warning: could not remove index cache entry {digest}: {e}")
+
+
+def _remember(digest: str, index: TrigramIndex):
+    _memory[digest] = index
+    _memory.move_to_end(digest)
+    while len(_memory) > INDEX_MEMORY_SLOTS:
+        _memory.popitem(last=False)
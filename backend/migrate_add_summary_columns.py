@@ -0,0 +1,39 @@
+"""
+Migration script to add document summary columns to documents table
+"""
+import sqlite3
+import sys
+
+NEW_COLUMNS = {
+    "summary": "TEXT NULL",
+    "summary_hash": "VARCHAR NULL",
+    "summarized_at": "DATETIME NULL",
+}
+
+def migrate():
+    try:
+        # Connect to the database
+        conn = sqlite3.connect('test.db')
+        cursor = conn.cursor()
+        
+        # Check which columns already exist
+        cursor.execute("PRAGMA table_info(documents)")
+        columns = [row[1] for row in cursor.fetchall()]
+        
+        for name, definition in NEW_COLUMNS.items():
+            if name not in columns:
+                cursor.execute(f"ALTER TABLE documents ADD COLUMN {name} {definition}")
+                print(f"✅ Added '{name}' column to documents table")
+            else:
+                print(f"ℹ️  Column '{name}' already exists in documents table")
+        
+        conn.commit()
+        conn.close()
+        return True
+    except Exception as e:
+        print(f"❌ Migration failed: {e}")
+        return False
+
+if __name__ == "__main__":
+    success = migrate()
+    sys.exit(0 if success else 1)
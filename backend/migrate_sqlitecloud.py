@@ -1,5 +1,6 @@
 """
-Migration script to add edited_file_path column to documents table in SQLiteCloud
+Migration script to add the columns the documents table needs in SQLiteCloud
+(edited_file_path, user_id, the ingest pipeline and summary columns)
 """
 import os
 import sys
@@ -9,6 +10,22 @@ from sqlalchemy.orm import sessionmaker
 
 load_dotenv()
 
+# Columns added after the table was first created, with their definitions
+REQUIRED_COLUMNS = {
+    "edited_file_path": "VARCHAR NULL",
+    "user_id": "INTEGER",
+    # Ingest pipeline (see migrate_add_ingest_columns.py)
+    "ingest_status": "VARCHAR DEFAULT 'pending'",
+    "ingest_error": "VARCHAR NULL",
+    "page_count": "INTEGER NULL",
+    "content_hash": "VARCHAR NULL",
+    "ingested_at": "DATETIME NULL",
+    # Document summaries (see migrate_add_summary_columns.py)
+    "summary": "TEXT NULL",
+    "summary_hash": "VARCHAR NULL",
+    "summarized_at": "DATETIME NULL",
+}
+
 def migrate():
     try:
         # Get the SQLiteCloud connection string
@@ -26,28 +43,15 @@ def migrate():
             inspector = inspect(engine)
             existing_columns = [col['name'] for col in inspector.get_columns('documents')]
             
-            # List of required columns
-            required_columns = ['edited_file_path', 'user_id']
             migrations_applied = 0
             
             # Add missing columns
-            for column in required_columns:
+            for column, definition in REQUIRED_COLUMNS.items():
                 if column not in existing_columns:
                     try:
-                        if column == 'edited_file_path':
-                            connection.execute(text("""
-                                ALTER TABLE documents 
-                                ADD COLUMN edited_file_path VARCHAR NULL
-                            """))
-                            print(f"✅ Added 'edited_file_path' column")
-                            migrations_applied += 1
-                        elif column == 'user_id':
-                            connection.execute(text("""
-                                ALTER TABLE documents 
-                                ADD COLUMN user_id INTEGER
-                            """))
-                            print(f"✅ Added 'user_id' column")
-                            migrations_applied += 1
+                        connection.execute(text(f"ALTER TABLE documents ADD COLUMN {column} {definition}"))
+                        print(f"✅ Added '{column}' column")
+                        migrations_applied += 1
                     except Exception as col_error:
                         print(f"⚠️  Could not add column '{column}': {col_error}")
                 else:
@@ -0,0 +1,25 @@
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+# database and pdf_service read these at import time
+os.environ.setdefault("ENVIRONMENT", "development")
+os.environ.setdefault("SQLITE_CLOUD_URL", "sqlite://")
+for key in ("AWS_ACCESS_KEY", "AWS_SECRET_KEY", "AWS_REGION", "AWS_BUCKET_NAME", "GEMINI_API_KEY"):
+    os.environ.setdefault(key, "test")
+
+
+@pytest.fixture(autouse=True)
+def isolated_cache(tmp_path, monkeypatch):
+    """Run every test in its own directory, so the relative cache/ paths never touch the real caches."""
+    monkeypatch.chdir(tmp_path)
+    from app.services import page_cache
+
+    monkeypatch.setattr(page_cache, "_connection", None)
+    yield
+    if page_cache._connection is not None:
+        page_cache._connection.close()
@@ -0,0 +1,28 @@
+from app.services import bm25
+
+PAGES = [
+    (0, "This agreement is made between the landlord and the tenant."),
+    (1, "The tenant pays rent on the first day of each month."),
+    (2, "Either party may terminate with sixty days written notice."),
+]
+
+
+def test_ranks_chunks_by_keyword_match():
+    index = bm25.build_index(PAGES)
+    hits = index.search("terminate notice", 3)
+    assert [index.chunks[chunk_id].page for chunk_id, _ in hits] == [2]
+
+    chunks = bm25.top_chunks(index, "tenant rent", 2)
+    assert [chunk.page for chunk in chunks] == [0, 1]
+
+
+def test_falls_back_to_opening_chunks_without_overlap():
+    index = bm25.build_index(PAGES)
+    assert index.search("zebra", 2) == []
+    assert [chunk.page for chunk in bm25.top_chunks(index, "zebra", 2)] == [0, 1]
+
+
+def test_round_trips_through_bytes():
+    index = bm25.build_index(PAGES)
+    loaded = bm25.BM25Index.from_bytes(index.to_bytes())
+    assert loaded.search("rent month", 3) == index.search("rent month", 3)
@@ -0,0 +1,79 @@
+import time
+
+import pymupdf
+import pytest
+
+from app.services import doc_pool, pdf_worker
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    pool = doc_pool.DocumentPool(max_bytes=300, idle_ttl=60)
+    monkeypatch.setattr(doc_pool, "pool", pool)
+    monkeypatch.setattr(doc_pool, "DOC_POOL_SIZE_FACTOR", 1)
+    return pool
+
+
+def _document():
+    document = pymupdf.open()
+    document.new_page()
+    return document
+
+
+def test_evicts_least_recently_used_over_budget(pool):
+    first, second, third = _document(), _document(), _document()
+    pool.put("a.pdf", "a1", first, b"x" * 100)
+    pool.put("b.pdf", "b1", second, b"x" * 100)
+    pool.get("a.pdf")  # a is now more recent than b
+    pool.put("c.pdf", "c1", third, b"x" * 150)
+
+    assert pool.get("b.pdf") is None
+    assert second.is_closed
+    assert pool.get("a.pdf").document is first
+    assert pool.total_bytes == 250
+
+
+def test_keeps_an_entry_larger_than_the_budget(pool):
+    pool.put("a.pdf", "a1", _document(), b"x" * 100)
+    pool.put("big.pdf", "big1", _document(), b"x" * 1000)
+    assert pool.get("a.pdf") is None
+    assert pool.get("big.pdf") is not None
+
+
+def test_idle_entries_expire(pool):
+    document = _document()
+    pool.idle_ttl = 0.01
+    pool.put("a.pdf", "a1", document, b"x" * 10)
+    time.sleep(0.02)
+    assert pool.get("a.pdf") is None
+    assert document.is_closed
+    assert pool.total_bytes == 0
+
+
+def test_take_hands_over_only_the_matching_version(pool):
+    document = _document()
+    pool.put("a.pdf", "a1", document, b"x" * 10)
+    assert pool.take("a.pdf", "a0") is None
+    assert pool.take("a.pdf", "a1") is document
+    assert not document.is_closed
+    assert pool.get("a.pdf") is None
+
+
+def test_edited_file_is_reopened_not_served_stale(pool):
+    original = pymupdf.open()
+    original.new_page().insert_text((72, 72), "version one")
+    original.save("doc.pdf")
+    digest, source = pdf_worker.fetch_pdf("doc.pdf")
+    first = pdf_worker.open_document("doc.pdf", digest, source)
+    assert pdf_worker.open_document("doc.pdf", digest, source) is first
+
+    edited = pymupdf.open()
+    edited.new_page().insert_text((72, 72), "version two, edited")
+    edited.save("doc.pdf")
+    new_digest, source = pdf_worker.fetch_pdf("doc.pdf")
+    assert new_digest != digest
+
+    second = pdf_worker.open_document("doc.pdf", new_digest, source)
+    assert second is not first
+    assert first.is_closed
+    assert "version two" in second[0].get_text()
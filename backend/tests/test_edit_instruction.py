@@ -0,0 +1,33 @@
+import pytest
+
+from app.services import edit_instruction
+
+
+@pytest.mark.parametrize("instruction, expected", [
+    ("change 'Acme Ltd' to 'Acme Inc'", {"original": "Acme Ltd", "new": "Acme Inc"}),
+    ('Please replace "2023" with "2024".', {"original": "2023", "new": "2024"}),
+    ("can you swap the word “red” for “blue”", {"original": "red", "new": "blue"}),
+    ("instead of Monday, write Tuesday", {"original": "Monday", "new": "Tuesday"}),
+    ("update John Smith to Jane Smith everywhere", {"original": "John Smith", "new": "Jane Smith"}),
+])
+def test_accepts_explicit_instructions(instruction, expected):
+    assert edit_instruction.parse(instruction)[0] == expected
+
+
+def test_ambiguous_unquoted_split_yields_every_reading():
+    assert edit_instruction.parse("change 1 to 2 to 3") == [
+        {"original": "1", "new": "2 to 3"},
+        {"original": "1 to 2", "new": "3"},
+    ]
+
+
+@pytest.mark.parametrize("instruction", [
+    "what is the due date?",
+    "change the date to next Friday",  # describes its target instead of naming it
+    "change 5 to 6 on page 2",  # the replacement carries a location
+    "change 1 to 2 and 3 to 4",  # several edits in one message
+    "change 'a' to 'a'",
+    "replace 'x' with",
+])
+def test_rejects_what_it_cannot_resolve(instruction):
+    assert edit_instruction.parse(instruction) == []
@@ -0,0 +1,86 @@
+import asyncio
+import threading
+
+import pytest
+
+from app.services import bm25, hybrid, retrieval
+
+PAGES = [
+    (0, "This agreement is made between the landlord and the tenant."),
+    (1, "The tenant pays rent on the first day of each month."),
+    (2, "Either party may terminate with sixty days written notice."),
+]
+
+
+class _SlowEmbedder(retrieval.HashingEmbedder):
+    def __init__(self, release):
+        super().__init__()
+        self.release = release
+
+    def embed(self, texts):
+        self.release.wait(5)
+        return super().embed(texts)
+
+
+@pytest.fixture
+def indexes():
+    return bm25.build_index(PAGES), retrieval.build_index(PAGES, retrieval.HashingEmbedder())
+
+
+def test_reciprocal_rank_fusion_rewards_agreement():
+    assert hybrid.reciprocal_rank_fusion([[1, 2, 3], [3, 1]]) == [1, 3, 2]
+
+
+def test_rerank_prefers_chunks_covering_the_question():
+    chunks = [retrieval.Chunk(page, text) for page, text in PAGES]
+    assert hybrid.rerank("tenant pays rent", chunks, [0, 1])[0] == 1
+
+
+def test_falls_back_to_opening_chunks_without_matches(indexes):
+    lexical, _ = indexes
+    chunks = asyncio.run(hybrid.search("zebra", lexical, k=2))
+    assert [chunk.page for chunk in chunks] == [0, 1]
+
+
+def test_fuses_both_legs(indexes, monkeypatch):
+    lexical, dense = indexes
+    monkeypatch.setattr(retrieval, "_embedder", retrieval.HashingEmbedder())
+    chunks = asyncio.run(hybrid.search("terminate notice", lexical, dense, k=1, budget_ms=5000))
+    assert [chunk.page for chunk in chunks] == [2]
+
+
+def test_slow_dense_leg_stays_in_flight_until_its_thread_finishes(indexes, monkeypatch):
+    lexical, dense = indexes
+    release = threading.Event()
+    monkeypatch.setattr(retrieval, "_embedder", _SlowEmbedder(release))
+    monkeypatch.setattr(hybrid, "_dense_inflight", 0)
+
+    async def scenario():
+        degraded = hybrid.stats["degraded"]
+        chunks = await hybrid.search("terminate notice", lexical, dense, k=1, budget_ms=10)
+        assert [chunk.page for chunk in chunks] == [2]
+        assert hybrid.stats["degraded"] == degraded + 1
+        # The query gave up waiting, but the embedding thread is still busy
+        assert hybrid._dense_inflight == 1
+        release.set()
+        for _ in range(100):
+            if hybrid._dense_inflight == 0:
+                break
+            await asyncio.sleep(0.01)
+        assert hybrid._dense_inflight == 0
+
+    asyncio.run(scenario())
+
+
+def test_failing_dense_leg_degrades_to_lexical(indexes, monkeypatch):
+    lexical, dense = indexes
+
+    class _BrokenEmbedder(retrieval.HashingEmbedder):
+        def embed(self, texts):
+            raise RuntimeError("quota exceeded")
+
+    monkeypatch.setattr(retrieval, "_embedder", _BrokenEmbedder())
+    degraded = hybrid.stats["degraded"]
+    chunks = asyncio.run(hybrid.search("terminate notice", lexical, dense, k=1, budget_ms=5000))
+    assert [chunk.page for chunk in chunks] == [2]
+    assert hybrid.stats["degraded"] == degraded + 1
@@ -0,0 +1,36 @@
+import pytest
+
+from app.services import intent_classifier
+
+
+@pytest.fixture(autouse=True)
+def seed_model(monkeypatch):
+    # Train on the seed set only, never on a model saved by an earlier run
+    monkeypatch.setattr(intent_classifier, "_model", intent_classifier.train(intent_classifier._SEED_EXAMPLES))
+
+
+@pytest.mark.parametrize("message", [
+    "change 2023 to 2024",
+    "Please replace John Smith with Jane Doe",
+    "can you update the total to $500",
+    "instead of Munich, write Berlin",
+])
+def test_explicit_instructions_are_certain_edits(message):
+    assert intent_classifier.classify(message) == (intent_classifier.EDIT, 1.0)
+
+
+@pytest.mark.parametrize("message", [
+    "how do I change my password to something secure?",
+    "Can you tell me if we need to update the address to the new one?",
+    "what happens if we change the supplier to Acme",
+    "Can you change the date to May 5?",
+])
+def test_questions_mentioning_edits_are_never_certain_edits(message):
+    intent, confidence = intent_classifier.classify(message)
+    assert intent == intent_classifier.QUESTION or confidence < intent_classifier.INTENT_MIN_CONFIDENCE
+
+
+def test_plain_questions_are_confident_questions():
+    intent, confidence = intent_classifier.classify("what is the due date?")
+    assert intent == intent_classifier.QUESTION
+    assert confidence >= intent_classifier.INTENT_MIN_CONFIDENCE
@@ -0,0 +1,155 @@
+import asyncio
+
+import pytest
+
+from app.services import llm_gateway
+
+
+@pytest.fixture(autouse=True)
+def fresh_gateway(monkeypatch):
+    # Semaphores belong to the loop they were created on; each test runs its own loop
+    monkeypatch.setattr(llm_gateway, "_global_limit", None)
+    monkeypatch.setattr(llm_gateway, "_provider_limits", {})
+    monkeypatch.setattr(llm_gateway, "_breakers", {})
+    monkeypatch.setattr(llm_gateway, "_latencies", {})
+    monkeypatch.setattr(llm_gateway, "LLM_FALLBACK_PROVIDERS", [])
+    monkeypatch.setattr(llm_gateway, "LLM_HEDGE", False)
+    monkeypatch.setattr(llm_gateway, "FAKE_LLM_LATENCY", 0)
+    monkeypatch.setattr(llm_gateway, "_PROVIDERS", dict(llm_gateway._PROVIDERS))
+    monkeypatch.setattr(llm_gateway, "_STREAMERS", dict(llm_gateway._STREAMERS))
+
+
+def _broken_provider(calls):
+    async def complete(prompt, **_):
+        calls.append(prompt)
+        raise llm_gateway.LLMError("provider down")
+    return complete
+
+
+def test_falls_back_to_the_next_provider(monkeypatch):
+    calls = []
+    llm_gateway._PROVIDERS["broken"] = _broken_provider(calls)
+    monkeypatch.setattr(llm_gateway, "LLM_FALLBACK_PROVIDERS", ["fake"])
+    fallbacks = llm_gateway.stats["fallbacks"]
+
+    answer = asyncio.run(llm_gateway.complete("fallback?", provider="broken"))
+    assert answer == llm_gateway.FAKE_LLM_RESPONSE
+    assert calls == ["fallback?"]
+    assert llm_gateway.stats["fallbacks"] == fallbacks + 1
+
+
+def test_stream_falls_back_before_the_first_piece(monkeypatch):
+    async def broken_stream(prompt, **_):
+        raise llm_gateway.LLMError("provider down")
+        yield
+
+    llm_gateway._STREAMERS["broken"] = broken_stream
+    llm_gateway._PROVIDERS["broken"] = _broken_provider([])
+    monkeypatch.setattr(llm_gateway, "LLM_FALLBACK_PROVIDERS", ["fake"])
+
+    async def collect():
+        return "".join([piece async for piece in llm_gateway.stream("stream?", provider="broken")])
+
+    assert asyncio.run(collect()) == llm_gateway.FAKE_LLM_RESPONSE
+
+
+def test_circuit_opens_after_repeated_failures_and_probes_after_reset(monkeypatch):
+    calls = []
+    llm_gateway._PROVIDERS["broken"] = _broken_provider(calls)
+    monkeypatch.setattr(llm_gateway, "CIRCUIT_FAILURES", 2)
+
+    async def scenario():
+        for attempt in range(2):
+            with pytest.raises(llm_gateway.LLMError):
+                await llm_gateway.complete(f"fail {attempt}", provider="broken")
+        # Open: rejected without reaching the provider
+        with pytest.raises(llm_gateway.LLMUnavailableError):
+            await llm_gateway.complete("rejected", provider="broken")
+        assert len(calls) == 2
+
+        # After the reset period one probe goes through; its success closes the circuit
+        monkeypatch.setattr(llm_gateway, "CIRCUIT_RESET_SECONDS", 0)
+        llm_gateway._PROVIDERS["broken"] = llm_gateway._PROVIDERS["fake"]
+        assert await llm_gateway.complete("probe", provider="broken") == llm_gateway.FAKE_LLM_RESPONSE
+        assert llm_gateway._breaker("broken").opened_at is None
+
+    asyncio.run(scenario())
+
+
+def test_hedge_races_a_slow_provider_against_the_next(monkeypatch):
+    cancelled = []
+
+    async def slow(prompt, **_):
+        try:
+            await asyncio.sleep(5)
+        except asyncio.CancelledError:
+            cancelled.append(prompt)
+            raise
+        return "slow answer"
+
+    llm_gateway._PROVIDERS["slow"] = slow
+    monkeypatch.setattr(llm_gateway, "LLM_FALLBACK_PROVIDERS", ["fake"])
+    monkeypatch.setattr(llm_gateway, "LLM_HEDGE", True)
+    monkeypatch.setattr(llm_gateway, "LLM_HEDGE_DELAY", 0.01)
+    hedge_wins = llm_gateway.stats["hedge_wins"]
+
+    answer = asyncio.run(llm_gateway.complete("hedge?", provider="slow"))
+    assert answer == llm_gateway.FAKE_LLM_RESPONSE
+    assert llm_gateway.stats["hedge_wins"] == hedge_wins + 1
+    # The losing call is cancelled, which leaves its circuit closed
+    assert cancelled == ["hedge?"]
+    assert llm_gateway._breaker("slow").failures == 0
+
+
+def test_slow_provider_hits_the_call_timeout(monkeypatch):
+    async def slow(prompt, **_):
+        await asyncio.sleep(5)
+
+    llm_gateway._PROVIDERS["slow"] = slow
+    timeouts = llm_gateway.stats["timeouts"]
+
+    with pytest.raises(llm_gateway.LLMTimeoutError):
+        asyncio.run(llm_gateway.complete("too slow", provider="slow", timeout=0.05))
+    assert llm_gateway.stats["timeouts"] == timeouts + 1
+    assert llm_gateway.stats["inflight"] == 0
+
+
+def test_slow_stream_hits_the_timeout(monkeypatch):
+    async def slow_stream(prompt, **_):
+        yield "first"
+        await asyncio.sleep(5)
+        yield "never"
+
+    llm_gateway._STREAMERS["slow"] = slow_stream
+
+    async def collect(pieces):
+        async for piece in llm_gateway.stream("too slow", provider="slow", timeout=0.05):
+            pieces.append(piece)
+
+    pieces = []
+    with pytest.raises(llm_gateway.LLMTimeoutError):
+        asyncio.run(collect(pieces))
+    assert pieces == ["first"]
+
+
+@pytest.mark.parametrize("provider_limit, global_limit, expected", [(2, 32, 2), (32, 3, 3)])
+def test_concurrent_calls_are_capped(monkeypatch, provider_limit, global_limit, expected):
+    active, peak = [0], [0]
+
+    async def counting(prompt, **_):
+        active[0] += 1
+        peak[0] = max(peak[0], active[0])
+        await asyncio.sleep(0.02)
+        active[0] -= 1
+        return prompt
+
+    llm_gateway._PROVIDERS["counting"] = counting
+    monkeypatch.setattr(llm_gateway, "PROVIDER_CONCURRENCY", {"counting": provider_limit})
+    monkeypatch.setattr(llm_gateway, "LLM_MAX_CONCURRENCY", global_limit)
+
+    async def scenario():
+        # Distinct prompts, so single-flight does not merge them into one call
+        return await asyncio.gather(*(llm_gateway.complete(f"prompt {n}", provider="counting") for n in range(8)))
+
+    assert asyncio.run(scenario()) == [f"prompt {n}" for n in range(8)]
+    assert peak[0] == expected
@@ -0,0 +1,59 @@
+import pymupdf
+
+from app.services import page_cache, pdf_worker, span_layout, text_cache
+
+
+def _text_pdf(texts) -> pymupdf.Document:
+    document = pymupdf.open()
+    for text in texts:
+        document.new_page().insert_text((72, 72), text)
+    return document
+
+
+def test_unchanged_pages_keep_their_hash_across_versions():
+    document = _text_pdf(["one", "two", "three"])
+    before = pymupdf.open("pdf", document.tobytes())
+    document[0].insert_text((72, 200), "edited")
+    after = pymupdf.open("pdf", document.tobytes(garbage=4))  # renumbers every xref
+
+    old, new = page_cache.page_hashes(before), page_cache.page_hashes(after)
+    assert old[0] != new[0]
+    assert old[1:] == new[1:]
+
+
+def test_pages_drawing_different_form_xobjects_do_not_collide():
+    source = _text_pdf(["Alpha contract total 100", "Beta invoice total 999"])
+    document = pymupdf.open()
+    for page_num in range(2):
+        document.new_page().show_pdf_page(pymupdf.Rect(0, 0, 595, 842), source, page_num)
+    assert document[0].read_contents() == document[1].read_contents()
+
+    assert len(set(page_cache.page_hashes(document))) == 2
+    texts, _ = pdf_worker.page_texts(document)
+    assert "Alpha contract total 100" in texts[0]
+    assert "Beta invoice total 999" in texts[1]
+
+
+def test_page_texts_reuses_cached_pages(monkeypatch):
+    document = _text_pdf(["first page", "second page"])
+    texts, hashes = pdf_worker.page_texts(document)
+    assert page_cache.get_texts(hashes) == dict(zip(hashes, texts))
+
+    def parse(page):
+        raise AssertionError("page parsed again")
+
+    monkeypatch.setattr(span_layout, "build_page_layout", parse)
+    assert pdf_worker.page_texts(document)[0] == texts
+    assert span_layout.join_pages(pdf_worker.page_layouts(document)).page_texts() == texts
+
+
+def test_every_path_extracts_the_layout_text():
+    _text_pdf(["Invoice number 42", "Total due"]).save("on_demand.pdf")
+    _text_pdf(["Invoice number 42", "Total due"]).save("ingested.pdf")
+    expected = span_layout.build_layout(pymupdf.open("on_demand.pdf")).page_texts()
+
+    # Whichever path sees a version first, the cached text is the same
+    assert [text for _, text in pdf_worker.read_pages("on_demand.pdf")["pages"]] == expected
+    digest = pdf_worker.ingest_file("ingested.pdf")["digest"]
+    assert list(text_cache.iter_pages(digest)) == expected
+    assert pdf_worker.extract_pages("ingested.pdf")["pages"] == expected
@@ -0,0 +1,76 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import pymupdf
+import pytest
+
+from app.services import ingest_service, page_cache, pdf_pool, pdf_service, pdf_worker, span_layout, text_cache
+
+PAGE_COUNT = 6
+
+
+@pytest.fixture
+def pool(monkeypatch):
+    # A thread stands in for the worker processes, which would not share the test's working
+    # directory; one thread, since each worker holds its own page cache connection
+    executor = ThreadPoolExecutor(max_workers=1)
+    monkeypatch.setattr(pdf_pool, "get_executor", lambda: executor)
+    monkeypatch.setattr(pdf_pool, "PDF_POOL_WORKERS", 3)
+    monkeypatch.setattr(pdf_pool, "PARALLEL_EXTRACT_MIN_PAGES", 2)
+    monkeypatch.setattr(pdf_pool, "PARALLEL_EXTRACT_MIN_RANGE", 2)
+    ranges = []
+    extract_page_range = pdf_worker.extract_page_range
+
+    def record(local_path, start, stop):
+        ranges.append((start, stop))
+        return extract_page_range(local_path, start, stop)
+
+    monkeypatch.setattr(pdf_worker, "extract_page_range", record)
+    yield ranges
+    executor.submit(_close_page_cache).result()
+    executor.shutdown()
+
+
+def _close_page_cache():
+    if page_cache._connection is not None:
+        page_cache._connection.close()
+        page_cache._connection = None
+
+
+@pytest.fixture
+def large_pdf():
+    document = pymupdf.open()
+    for page_num in range(PAGE_COUNT):
+        document.new_page().insert_text((72, 72), f"Page {page_num} of the contract")
+    document.save("large.pdf")
+    return span_layout.build_layout(pymupdf.open("large.pdf")).page_texts()
+
+
+def test_page_ranges_cover_every_page(pool):
+    assert pdf_pool.page_ranges(PAGE_COUNT) == [(0, 2), (2, 4), (4, 6)]
+    assert pdf_pool.page_ranges(1) == [(0, 1)]
+
+
+def test_index_builds_extract_large_documents_in_parallel(pool, large_pdf):
+    pages = asyncio.run(pdf_service.extract_pages("large.pdf"))
+    assert pages == large_pdf
+    assert sorted(pool) == [(0, 2), (2, 4), (4, 6)]
+
+
+def test_ingest_parses_large_documents_in_parallel(pool, large_pdf, monkeypatch):
+    build_page_layout = span_layout.build_page_layout
+    parsed_in_ranges = []
+
+    def parse(page):
+        parsed_in_ranges.append(page.number)
+        return build_page_layout(page)
+
+    monkeypatch.setattr(span_layout, "build_page_layout", parse)
+    result = ingest_service._ingest_file("large.pdf")
+
+    assert sorted(pool) == [(0, 2), (2, 4), (4, 6)]
+    # Every page was parsed once, in the ranges; ingest_file joined the cached page layouts
+    assert sorted(parsed_in_ranges) == list(range(PAGE_COUNT))
+    assert result["page_count"] == PAGE_COUNT
+    assert list(text_cache.iter_pages(result["digest"])) == large_pdf
+    assert span_layout.load(result["digest"]).page_texts() == large_pdf
@@ -0,0 +1,68 @@
+from collections import OrderedDict
+
+import pytest
+
+from app.services import response_cache
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(response_cache, "_memory", OrderedDict())
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE_DISK", True)
+    monkeypatch.setattr(response_cache, "RESPONSE_CACHE_TTL", 60)
+    return response_cache
+
+
+def _clock(monkeypatch, now: float):
+    monkeypatch.setattr(response_cache.time, "time", lambda: now)
+
+
+def test_key_is_scoped_to_model_and_document_version(cache):
+    key = cache.make_key("model-a", "What is  the total?", "v1")
+    assert key == cache.make_key("model-a", "What is the total?\n", "v1")  # formatting only
+    assert key != cache.make_key("model-a", "What is the total?", "v2")
+    assert key != cache.make_key("model-b", "What is the total?", "v1")
+    assert cache.make_key("model-a", "intent?") == cache.make_key("model-a", "intent?", None)
+
+    cache.put(key, "42")
+    assert cache.get(key) == "42"
+    assert cache.get(cache.make_key("model-a", "What is the total?", "v2")) is None
+
+
+def test_entries_expire_after_the_ttl(cache, monkeypatch):
+    _clock(monkeypatch, 1000.0)
+    key = cache.make_key("model", "prompt", "v1")
+    cache.put(key, "answer")
+
+    _clock(monkeypatch, 1059.0)
+    assert cache.get(key) == "answer"
+
+    _clock(monkeypatch, 1061.0)
+    expired = cache.stats["expired"]
+    assert cache.get(key) is None
+    # Both tiers held the entry; both drop it
+    assert cache.stats["expired"] == expired + 2
+    assert not cache._entry_path(key).exists()
+
+
+def test_disk_tier_survives_memory_eviction(cache, monkeypatch):
+    monkeypatch.setattr(cache, "RESPONSE_CACHE_SLOTS", 2)
+    keys = [cache.make_key("model", f"prompt {n}", "v1") for n in range(3)]
+    for n, key in enumerate(keys):
+        cache.put(key, f"answer {n}")
+    assert keys[0] not in cache._memory
+
+    disk_hits = cache.stats["disk_hits"]
+    assert cache.get(keys[0]) == "answer 0"
+    assert cache.stats["disk_hits"] == disk_hits + 1
+    assert keys[0] in cache._memory  # promoted back into memory
+
+
+def test_memory_only_cache_forgets_evicted_entries(cache, monkeypatch):
+    monkeypatch.setattr(cache, "RESPONSE_CACHE_DISK", False)
+    monkeypatch.setattr(cache, "RESPONSE_CACHE_SLOTS", 1)
+    first, second = cache.make_key("model", "one"), cache.make_key("model", "two")
+    cache.put(first, "1")
+    cache.put(second, "2")
+    assert cache.get(first) is None
+    assert cache.get(second) == "2"
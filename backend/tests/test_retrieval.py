@@ -0,0 +1,59 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from app.services import bm25, llm_gateway, pdf_service, retrieval
+
+PAGES = [(0, "alpha beta gamma " * 40), (1, "delta epsilon " * 60)]
+
+
+def test_chunks_overlap_and_stay_within_a_page():
+    chunks = retrieval.chunk_pages(PAGES, chunk_chars=200, overlap=50)
+    assert {chunk.page for chunk in chunks} == {0, 1}
+    assert all(len(chunk.text) <= 200 for chunk in chunks)
+    first, second = chunks[0].text, chunks[1].text
+    assert first[-20:].strip() in second
+
+
+def test_concurrent_stores_of_one_version_leave_a_loadable_entry(monkeypatch):
+    monkeypatch.setattr(retrieval, "_memory", retrieval.OrderedDict())
+    monkeypatch.setattr(bm25, "_memory", bm25.OrderedDict())
+    embedder = retrieval.HashingEmbedder()
+    dense = retrieval.build_index(PAGES, embedder)
+    lexical = bm25.build_index(PAGES)
+
+    with ThreadPoolExecutor(max_workers=4) as executor:
+        list(executor.map(lambda _: retrieval.store_index("f" * 64, dense, embedder), range(8)))
+        list(executor.map(lambda _: bm25.store_index("f" * 64, lexical), range(8)))
+    retrieval._memory.clear()
+    bm25._memory.clear()
+
+    loaded = retrieval.load_index("f" * 64, embedder)
+    assert np.array_equal(loaded.vectors, dense.vectors)
+    assert [chunk.text for chunk in loaded.chunks] == [chunk.text for chunk in dense.chunks]
+    assert bm25.load_index("f" * 64).search("delta", 3) == lexical.search("delta", 3)
+    assert not list(retrieval.CHUNK_CACHE_DIR.glob("**/*.tmp"))
+    assert not list(bm25.BM25_CACHE_DIR.glob("**/*.tmp"))
+
+
+def test_edit_prompt_gets_the_chunks_matching_the_instruction(monkeypatch):
+    prompts = []
+
+    async def explicit_edits(file_path, instruction):
+        return None
+
+    async def retrieve_context(file_path, question):
+        return ["...", f"chunk about {question}"]
+
+    async def complete(prompt, **kwargs):
+        prompts.append(prompt)
+        return '{"edits": []}'
+
+    monkeypatch.setattr(pdf_service, "_explicit_edits", explicit_edits)
+    monkeypatch.setattr(pdf_service, "retrieve_context", retrieve_context)
+    monkeypatch.setattr(llm_gateway, "complete", complete)
+
+    result = asyncio.run(pdf_service.edit_pdf("long.pdf", "fix the termination clause"))
+    assert result["success"] is False
+    assert "chunk about fix the termination clause" in prompts[0]
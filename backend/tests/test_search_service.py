@@ -0,0 +1,35 @@
+from types import SimpleNamespace
+
+import pytest
+
+from app.services import search_service, text_cache
+
+
+@pytest.fixture(autouse=True)
+def empty_indexes(monkeypatch):
+    monkeypatch.setattr(search_service, "_indexes", {})
+
+
+def _document(document_id, digest, pages):
+    text_cache.put_pages(digest, pages)
+    return SimpleNamespace(id=document_id, content_hash=digest, filename=f"doc{document_id}.pdf")
+
+
+def test_search_picks_up_versions_ingested_elsewhere():
+    contract = _document(1, "a" * 64, ["termination notice period", "payment schedule"])
+    hits = search_service.search(7, [contract], "payment")
+    assert [(hit["document_id"], hit["page"]) for hit in hits] == [(1, 2)]
+
+    # Another worker ingested an edit: only the document row tells this process about it
+    edited = _document(1, "b" * 64, ["termination notice period", "invoice schedule"])
+    assert search_service.search(7, [edited], "payment") == []
+    assert search_service.search(7, [edited], "invoice")[0]["snippet"] == "invoice schedule"
+
+
+def test_deleted_documents_drop_out_of_the_index():
+    first = _document(1, "c" * 64, ["alpha clause"])
+    second = _document(2, "d" * 64, ["alpha appendix"])
+    assert {hit["document_id"] for hit in search_service.search(7, [first, second], "alpha")} == {1, 2}
+
+    assert {hit["document_id"] for hit in search_service.search(7, [second], "alpha")} == {2}
+    assert 1 not in search_service._user_index(7).document_entries
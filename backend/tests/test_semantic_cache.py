@@ -0,0 +1,81 @@
+import threading
+
+import numpy as np
+import pytest
+
+from app.services import retrieval, semantic_cache
+
+
+@pytest.fixture
+def cache(monkeypatch):
+    monkeypatch.setattr(semantic_cache, "_versions", semantic_cache.OrderedDict())
+    monkeypatch.setattr(semantic_cache, "SEMANTIC_CACHE_THRESHOLD", None)
+    return semantic_cache
+
+
+def test_hashing_fallback_only_matches_near_identical_wording(cache, monkeypatch):
+    monkeypatch.setattr(cache, "_embedder", retrieval.HashingEmbedder())
+    cache.store("v1", "what is the due date", "June 1")
+
+    assert cache.lookup("v1", "What's the due date?") == "June 1"
+    assert cache.lookup("v1", "what is the start date") is None
+    assert cache.lookup("v1", "when is this due") is None
+    assert cache.lookup("v2", "what is the due date") is None
+
+
+class _TopicEmbedder:
+    """Maps questions onto hand-picked directions, standing in for a real embedding model."""
+    name = "gemini"
+
+    def embed(self, texts):
+        topics = {"due": [1.0, 0.0], "start": [0.0, 1.0]}
+        return np.array([topics["due" if "due" in text else "start"] for text in texts], dtype=np.float32)
+
+
+def test_model_embedder_matches_paraphrases(cache, monkeypatch):
+    monkeypatch.setattr(cache, "_embedder", _TopicEmbedder())
+    assert cache.default_threshold() == cache.DEFAULT_THRESHOLDS["gemini"]
+    cache.store("v1", "what is the due date", "June 1")
+
+    assert cache.lookup("v1", "when is this due") == "June 1"
+    assert cache.lookup("v1", "when does it start") is None
+
+
+def test_unavailable_model_falls_back_to_hashing(cache, monkeypatch):
+    def unavailable(name):
+        if name != "hashing":
+            raise KeyError("GEMINI_API_KEY")
+        return retrieval.HashingEmbedder()
+
+    monkeypatch.setattr(cache, "_embedder", None)
+    monkeypatch.setattr(retrieval, "make_embedder", unavailable)
+    assert cache.get_embedder().name == "hashing"
+    assert cache.default_threshold() == cache.DEFAULT_THRESHOLDS["hashing"]
+
+
+def test_failing_model_switches_to_hashing(cache, monkeypatch):
+    class _QuotaExceeded(_TopicEmbedder):
+        def embed(self, texts):
+            raise RuntimeError("quota exceeded")
+
+    monkeypatch.setattr(cache, "_embedder", _QuotaExceeded())
+    cache.store("v1", "what is the due date", "June 1")  # skipped, not an error
+    assert cache.get_embedder().name == "hashing"
+
+    cache.store("v1", "what is the due date", "June 1")
+    assert cache.lookup("v1", "What's the due date?") == "June 1"
+
+
+def test_slow_model_is_abandoned_at_the_timeout(cache, monkeypatch):
+    release = threading.Event()
+
+    class _Hung(_TopicEmbedder):
+        def embed(self, texts):
+            release.wait(5)
+            return super().embed(texts)
+
+    monkeypatch.setattr(cache, "_embedder", _Hung())
+    monkeypatch.setattr(cache, "SEMANTIC_CACHE_EMBED_TIMEOUT", 0.05)
+    cache.store("v1", "what is the due date", "June 1")
+    release.set()
+    assert cache.get_embedder().name == "hashing"
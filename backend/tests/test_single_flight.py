@@ -0,0 +1,65 @@
+import asyncio
+
+from app.services import single_flight
+
+
+def test_concurrent_callers_share_one_run():
+    runs = []
+
+    async def fetch(value):
+        runs.append(value)
+        await asyncio.sleep(0.01)
+        return value * 2
+
+    async def scenario():
+        results = await asyncio.gather(*(single_flight.run(("fetch", 1), fetch, 1) for _ in range(3)))
+        assert results == [2, 2, 2]
+        assert runs == [1]
+        # Finished calls are forgotten, so a later caller runs it again
+        assert await single_flight.run(("fetch", 1), fetch, 1) == 2
+        assert runs == [1, 1]
+
+    asyncio.run(scenario())
+
+
+def test_cancelling_one_waiter_keeps_the_shared_run():
+    async def scenario():
+        gate = asyncio.Event()
+
+        async def slow():
+            await gate.wait()
+            return "done"
+
+        first = asyncio.ensure_future(single_flight.run("slow", slow))
+        second = asyncio.ensure_future(single_flight.run("slow", slow))
+        await asyncio.sleep(0)
+        first.cancel()
+        await asyncio.sleep(0)
+        gate.set()
+        assert await second == "done"
+        assert first.cancelled()
+
+    asyncio.run(scenario())
+
+
+def test_cancelling_every_waiter_cancels_the_run():
+    cancelled = []
+
+    async def scenario():
+        async def slow():
+            try:
+                await asyncio.sleep(10)
+            except asyncio.CancelledError:
+                cancelled.append(True)
+                raise
+
+        waiters = [asyncio.ensure_future(single_flight.run("forever", slow)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for waiter in waiters:
+            waiter.cancel()
+        await asyncio.gather(*waiters, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert cancelled == [True]
+        assert "forever" not in single_flight._calls
+
+    asyncio.run(scenario())
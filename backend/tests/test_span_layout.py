@@ -0,0 +1,53 @@
+import pymupdf
+
+from app.services import span_layout
+
+
+def _document():
+    document = pymupdf.open()
+    first = document.new_page()
+    first.insert_text((72, 72), "Invoice number 42", fontname="helv")
+    first.insert_text((72, 100), "Total due", fontname="cour")
+    document.new_page().insert_text((72, 72), "Second page text", fontname="helv")
+    return document
+
+
+def _fields(span):
+    return {name: getattr(span, name) for name in span.__slots__}
+
+
+def test_layout_slices_text_by_page_and_span():
+    layout = span_layout.build_layout(_document())
+    assert layout.page_count == 2
+    assert layout.page_texts() == ["Invoice number 42\nTotal due\n", "Second page text\n"]
+
+    span = layout.span(layout.span_at(layout.text.index("Total")))
+    assert (span.page, span.text) == (0, "Total due")
+    assert span.font != layout.span(0).font
+    assert layout.span_at(layout.text.index("\n")) is None
+
+
+def test_page_layout_matches_a_single_page_build():
+    document = _document()
+    layout = span_layout.build_layout(document)
+    single = span_layout.build_page_layout(document[1])
+    assert layout.page_layout(1).to_bytes() == single.to_bytes()
+    assert span_layout.join_pages([layout.page_layout(0), single]).to_bytes() == layout.to_bytes()
+
+
+def test_round_trips_through_bytes():
+    layout = span_layout.build_layout(_document())
+    loaded = span_layout.SpanLayout.from_bytes(layout.to_bytes())
+    assert loaded.text == layout.text
+    assert loaded.fonts == layout.fonts
+    assert [_fields(loaded.span(i)) for i in range(loaded.span_count)] == \
+        [_fields(layout.span(i)) for i in range(layout.span_count)]
+
+
+def test_span_ranges_stay_within_a_line():
+    layout = span_layout.build_layout(_document())
+    offset = layout.text.index("number")
+    assert layout.span_ranges([offset], len("number 42")) == [(0, 0)]
+    # A match may not run across the line break
+    across = layout.text.index("42\nTotal")
+    assert layout.span_ranges([across], len("42\nTotal")) == []
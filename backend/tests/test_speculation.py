@@ -0,0 +1,99 @@
+import asyncio
+from collections import OrderedDict
+
+import pytest
+
+from app.services import llm_gateway, pdf_service, prompt_builder, response_cache
+
+CONTEXT = "The lease runs from 1 May and the rent is due on the first day of each month."
+
+
+@pytest.fixture(autouse=True)
+def fake_llm(monkeypatch):
+    monkeypatch.setattr(llm_gateway, "LLM_PROVIDER", "fake")
+    monkeypatch.setattr(llm_gateway, "FAKE_LLM_LATENCY", 0)
+    monkeypatch.setattr(llm_gateway, "_global_limit", None)
+    monkeypatch.setattr(llm_gateway, "_provider_limits", {})
+    monkeypatch.setattr(response_cache, "_memory", OrderedDict())
+    monkeypatch.setattr(pdf_service, "conversation_history", [])
+    monkeypatch.setattr(pdf_service, "speculation_stats", dict.fromkeys(pdf_service.speculation_stats, 0))
+
+    async def question_context(file_path, question, document=None):
+        return CONTEXT
+
+    async def handle_edit(question, file_path, document=None, db=None, edits=None):
+        return {"answer": "edited", "is_edit": True}
+
+    monkeypatch.setattr(pdf_service, "_question_context", question_context)
+    monkeypatch.setattr(pdf_service, "_handle_edit", handle_edit)
+
+
+def _resolve_intent_as_edit(monkeypatch, delay: float):
+    async def intent_is_edit(question):
+        await asyncio.sleep(delay)
+        return True
+
+    monkeypatch.setattr(pdf_service, "_llm_intent_is_edit", intent_is_edit)
+
+
+def _draft_prompt(question: str) -> str:
+    return prompt_builder.build_answer_prompt(question, CONTEXT, [question])
+
+
+def test_draft_is_kept_when_intent_is_question():
+    result = asyncio.run(pdf_service._speculate("when is the rent due", "lease.pdf"))
+
+    assert result == {"answer": llm_gateway.FAKE_LLM_RESPONSE, "is_edit": False}
+    assert pdf_service.speculation_stats["started"] == 1
+    assert pdf_service.speculation_stats["kept"] == 1
+    assert pdf_service.speculation_stats["discarded"] == 0
+    assert [entry["content"] for entry in pdf_service.conversation_history] == [
+        "when is the rent due", llm_gateway.FAKE_LLM_RESPONSE]
+
+
+def test_streamed_draft_is_released_when_intent_is_question():
+    async def collect():
+        return [event async for event in pdf_service._speculate_stream("when does the lease start", "lease.pdf")]
+
+    events = asyncio.run(collect())
+    assert "".join(data for event, data in events if event == "token") == llm_gateway.FAKE_LLM_RESPONSE
+    assert events[-1] == ("done", {"answer": llm_gateway.FAKE_LLM_RESPONSE, "is_edit": False})
+    assert pdf_service.speculation_stats["kept"] == 1
+
+
+def test_draft_is_cancelled_when_intent_is_edit(monkeypatch):
+    monkeypatch.setattr(llm_gateway, "FAKE_LLM_LATENCY", 5)
+    _resolve_intent_as_edit(monkeypatch, delay=0.05)  # the draft call is under way by then
+    cancelled = llm_gateway.stats["cancelled"]
+
+    result = asyncio.run(pdf_service._speculate("make the rent due on the fifth", "lease.pdf"))
+
+    assert result == {"answer": "edited", "is_edit": True}
+    assert llm_gateway.stats["cancelled"] == cancelled + 1
+    assert pdf_service.speculation_stats["discarded"] == 1
+    assert pdf_service.speculation_stats["kept"] == 0
+    # The draft never reached the history or the caches
+    assert pdf_service.conversation_history == []
+    assert len(response_cache._memory) == 0
+    # Its prompt was sent; nothing came back before it was cancelled
+    assert pdf_service.speculation_stats["wasted_prompt_tokens"] == prompt_builder.count_tokens(
+        _draft_prompt("make the rent due on the fifth"))
+    assert pdf_service.speculation_stats["wasted_completion_tokens"] == 0
+
+
+def test_streamed_pieces_of_a_discarded_draft_count_as_wasted(monkeypatch):
+    words = "one two three four five six seven eight nine ten"
+    monkeypatch.setattr(llm_gateway, "FAKE_LLM_RESPONSE", words)
+    monkeypatch.setattr(llm_gateway, "FAKE_LLM_LATENCY", 1.0)  # a word every 0.1s
+    _resolve_intent_as_edit(monkeypatch, delay=0.35)
+
+    async def collect():
+        return [event async for event in pdf_service._speculate_stream("push the start to June", "lease.pdf")]
+
+    events = asyncio.run(collect())
+    # Nothing of the draft reached the client
+    assert events == [("done", {"answer": "edited", "is_edit": True})]
+    wasted = pdf_service.speculation_stats["wasted_completion_tokens"]
+    assert 0 < wasted < prompt_builder.count_tokens(words)
+    assert pdf_service.speculation_stats["wasted_prompt_tokens"] == prompt_builder.count_tokens(
+        _draft_prompt("push the start to June"))
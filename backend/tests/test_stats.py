@@ -0,0 +1,15 @@
+import asyncio
+
+from app.api import routes
+from app.services import response_cache, semantic_cache
+
+
+def test_stats_reports_every_counter():
+    stats = asyncio.run(routes.get_stats(current_user=None))
+    assert stats["response_cache"] == response_cache.stats
+    assert stats["semantic_cache"] == semantic_cache.stats
+    assert set(stats["speculation"]) >= {"started", "kept", "discarded"}
+    assert set(stats["explicit_edits"]) == {"direct", "ambiguous", "not_found"}
+    # Snapshots, not the live dicts
+    stats["semantic_cache"]["hits"] = -1
+    assert semantic_cache.stats["hits"] != -1
@@ -0,0 +1,36 @@
+from app.services import structured_output
+
+
+def test_extract_json_from_fences_and_prose():
+    assert structured_output.extract_json('```json\n{"a": 1}\n```') == {"a": 1}
+    assert structured_output.extract_json('Sure! Here it is: {"a": {"b": 2}} hope that helps') == {"a": {"b": 2}}
+    assert structured_output.extract_json("{not json} then {\"ok\": true}") == {"ok": True}
+    assert structured_output.extract_json("[1, 2]") is None
+    assert structured_output.extract_json("") is None
+
+
+def test_parse_edits_cleans_and_deduplicates():
+    text = ('{"edits": [{"original": "\\"A\\"", "new": "B"}, {"original": "A", "new": "B"}, '
+            '{"original": "C", "new": "C"}, {"original": "", "new": "D"}, "junk", {"old": "E", "replacement": "F"}]}')
+    assert structured_output.parse_edits(text) == [{"original": "A", "new": "B"}, {"original": "E", "new": "F"}]
+
+
+def test_parse_edits_accepts_bare_objects_and_legacy_lines():
+    assert structured_output.parse_edits('{"original": "A", "new": "B"}') == [{"original": "A", "new": "B"}]
+    assert structured_output.parse_edits("Original: 10 days\nNew: 30 days") == [{"original": "10 days", "new": "30 days"}]
+    assert structured_output.parse_edits("I could not find that text.") == []
+
+
+def test_parse_plan():
+    assert structured_output.parse_plan('{"intent": "question", "answer": " It is due on May 1. "}') == {
+        "intent": "QUESTION", "answer": "It is due on May 1.", "edits": []}
+    assert structured_output.parse_plan('{"intent": "EDIT", "answer": "", "edits": [{"original": "A", "new": "B"}]}') == {
+        "intent": "EDIT", "answer": "", "edits": [{"original": "A", "new": "B"}]}
+    # A missing intent is inferred from what the response carries
+    assert structured_output.parse_plan('{"edits": [{"original": "A", "new": "B"}]}')["intent"] == "EDIT"
+    assert structured_output.parse_plan("Original: A\nNew: B")["intent"] == "EDIT"
+
+
+def test_parse_plan_rejects_unusable_responses():
+    assert structured_output.parse_plan('{"intent": "QUESTION", "answer": ""}') is None
+    assert structured_output.parse_plan("no json here") is None
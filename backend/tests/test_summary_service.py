@@ -0,0 +1,27 @@
+import pytest
+
+from app.services import summary_service
+
+
+@pytest.mark.parametrize("question", [
+    "What is this document about?",
+    "what is it about",
+    "summarize",
+    "Can you summarize this PDF for me?",
+    "give me a brief overview of the document",
+    "what are the key points",
+    "tl;dr",
+])
+def test_whole_document_questions_are_broad(question):
+    assert summary_service.is_broad_question(question)
+
+
+@pytest.mark.parametrize("question", [
+    "summarize the termination clause on page 12",
+    "key points of section 4",
+    "summarize the payment terms",
+    "give me an overview of chapter 2",
+    "what is the due date",
+])
+def test_questions_about_a_part_are_not_broad(question):
+    assert not summary_service.is_broad_question(question)
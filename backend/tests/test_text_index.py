@@ -0,0 +1,36 @@
+from collections import OrderedDict
+
+import pytest
+
+from app.services import text_index
+
+TEXT = "net 30 days\nnet 30 days after invoice\nabcabcabc\n"
+
+
+@pytest.mark.parametrize("needle", ["net 30 days", "30", "abcabc", "c", "days after", "invoice", "zzz", "ys\nne"])
+def test_find_matches_a_plain_scan(needle):
+    index = text_index.TrigramIndex.build(TEXT)
+    assert index.find(needle) == text_index._scan(TEXT, needle)
+
+
+def test_find_misses_text_across_lines_and_empty_needles():
+    index = text_index.TrigramIndex.build(TEXT)
+    assert index.find("days net") == []
+    assert index.find("") == []
+
+
+def test_round_trips_through_bytes():
+    index = text_index.TrigramIndex.build(TEXT)
+    loaded = text_index.TrigramIndex.from_bytes(index.to_bytes(), TEXT)
+    assert loaded.postings == index.postings
+    assert loaded.find("abcabc") == text_index._scan(TEXT, "abcabc")
+
+
+def test_save_load_and_discard(monkeypatch):
+    digest = "e" * 64
+    text_index.save(digest, text_index.TrigramIndex.build(TEXT))
+    monkeypatch.setattr(text_index, "_memory", OrderedDict())  # force a read from disk
+    assert text_index.load(digest, TEXT).find("invoice") == [TEXT.index("invoice")]
+
+    text_index.discard(digest)
+    assert text_index.load(digest, TEXT) is None